@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save
 
 
 class CandidatesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "candidates"
+
+    def ready(self):
+        from tom_targets.models import get_target_model_class
+        from .models import update_target_healpix
+
+        # Only for the configured Target class (settings.TARGET_MODEL_CLASS), not for every model save
+        post_save.connect(update_target_healpix, sender=get_target_model_class(),
+                          dispatch_uid="candidates_update_target_healpix")
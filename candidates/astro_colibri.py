@@ -5,6 +5,9 @@ import requests
 # Django imports
 from django.conf import settings
 
+# Local imports
+from .http_client import http_post
+
 # Logging
 import logging
 logger = logging.getLogger(__name__)
@@ -21,7 +24,7 @@ auth = requests.auth.HTTPBasicAuth("last", auth_pass)
 def send_astro_colibri(data):
     logger.info("Sending candidate {} to Astro-COLIBRI".format(data['source_name']))
     logger.info(json.dumps(data, indent=4))
-    request = requests.post(api_url + "/add_last_transient", json=data, auth=auth)
+    request = http_post(api_url + "/add_last_transient", json=data, auth=auth)
     request.raise_for_status()
     logger.info("Sent to Astro-COLIBRI successfully. Response code: {}".format(request.status_code))
     logger.info(request.json())
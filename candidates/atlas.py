@@ -0,0 +1,267 @@
+# Built-in imports
+import os
+import re
+import socket
+import time
+import uuid
+from datetime import timedelta
+
+# Third-party imports
+import requests
+
+# Django imports
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.timezone import now
+
+# Local imports
+from .http_client import get_client
+from .models import AtlasJob
+from .photometry_utils import ATLAS_BASEURL, add_atlas_photometry, record_photometry_fetch
+from .time_utils import mjd_to_datetime
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# ATLAS forced photometry job manager. Web requests and ingestion only queue AtlasJob rows (request_atlas_fp);
+# a single manager process (the atlas_jobs command) submits them within a shared throttle budget, polls all
+# outstanding tasks in one loop, and writes the photometry back when a task is done.
+# The manager lock, the throttle and the API token live in the Django cache, which must be shared by all
+# processes (e.g. Redis), otherwise every process would have its own lock.
+
+ATLAS_TOKEN_CACHE_KEY = 'atlas:token'
+ATLAS_THROTTLE_CACHE_KEY = 'atlas:throttled_until'
+ATLAS_MANAGER_LOCK_KEY = 'atlas:manager_lock'
+
+ATLAS_MAX_OUTSTANDING = getattr(settings, 'ATLAS_MAX_OUTSTANDING', 10)  # Tasks submitted and not finished at once
+ATLAS_MAX_ATTEMPTS = 3
+ATLAS_TASK_TIMEOUT = timedelta(hours=6)  # Resubmit tasks that did not finish by then
+ATLAS_REQUEST_TIMEOUT = 30  # Seconds
+ATLAS_LOCK_TIMEOUT = 300  # Seconds, the lock is refreshed before every job and every poll
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+class AtlasError(Exception):
+    pass
+
+
+class AtlasLockLost(Exception):
+    """
+    Raised when the manager lock expired and was taken by another manager.
+    """
+
+
+class AtlasManagerLock:
+    """
+    Single-manager lock in the Django cache, owned by a unique token of this process.
+    """
+
+    def __init__(self, timeout=ATLAS_LOCK_TIMEOUT):
+        self.timeout = timeout
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+    def acquire(self):
+        return cache.add(ATLAS_MANAGER_LOCK_KEY, self.owner, timeout=self.timeout)
+
+    def refresh(self):
+        """
+        Extend the lock while this process owns it, or take it again if it expired and nobody took it since.
+        The key is never set, only touched: if it changed hands just before the touch, the other owner's lock is
+        extended (which it does itself anyway) and the check after it reports the lock as lost.
+        """
+        cache.touch(ATLAS_MANAGER_LOCK_KEY, timeout=self.timeout)
+        owner = cache.get(ATLAS_MANAGER_LOCK_KEY)
+        if owner == self.owner or (owner is None and self.acquire()):
+            return
+        raise AtlasLockLost(f"ATLAS manager lock taken over by {owner or 'another process'}")
+
+    def release(self):
+        if cache.get(ATLAS_MANAGER_LOCK_KEY) == self.owner:
+            cache.delete(ATLAS_MANAGER_LOCK_KEY)
+
+
+def get_atlas_headers(session):
+    """
+    Auth headers for the ATLAS API. The token is cached (in the Django cache, so shared by all processes)
+    instead of logging in for every request.
+    """
+    token = cache.get(ATLAS_TOKEN_CACHE_KEY)
+    if token is None:
+        atlas_settings = settings.BROKERS.get('ATLAS', {})
+        username = atlas_settings.get('user_name')
+        password = atlas_settings.get('password')
+        if not username or not password:
+            raise AtlasError("ATLAS API credentials not set.")
+        resp = session.post(f"{ATLAS_BASEURL}/api-token-auth/", data={'username': username, 'password': password},
+                            timeout=ATLAS_REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        token = resp.json()['token']
+        cache.set(ATLAS_TOKEN_CACHE_KEY, token, timeout=24 * 3600)
+    return {'Authorization': f'Token {token}', 'Accept': 'application/json'}
+
+
+def forget_atlas_token():
+    cache.delete(ATLAS_TOKEN_CACHE_KEY)
+
+
+def atlas_throttle_wait():
+    """
+    Seconds until ATLAS accepts new tasks again, as last reported by a 429 response.
+    """
+    throttled_until = cache.get(ATLAS_THROTTLE_CACHE_KEY)
+    return max(0.0, throttled_until - time.time()) if throttled_until else 0.0
+
+
+def set_atlas_throttle(message):
+    """
+    Record the wait time from an ATLAS 429 message, e.g. "Request was throttled. Expected available in 60 seconds."
+    """
+    t_sec = re.findall(r'available in (\d+) seconds', message)
+    t_min = re.findall(r'available in (\d+) minutes', message)
+    if t_sec:
+        waittime = int(t_sec[0])
+    elif t_min:
+        waittime = int(t_min[0]) * 60
+    else:
+        waittime = 10
+    logger.debug(f'ATLAS throttled, waiting {waittime} seconds')
+    cache.set(ATLAS_THROTTLE_CACHE_KEY, time.time() + waittime, timeout=waittime + 1)
+
+
+def fail_or_requeue(job, error):
+    """
+    Put a job back in the queue after a failed attempt, or mark it failed after ATLAS_MAX_ATTEMPTS.
+    """
+    job.error = error
+    job.task_url = None
+    job.status = AtlasJob.STATUS_FAILED if job.attempts >= ATLAS_MAX_ATTEMPTS else AtlasJob.STATUS_QUEUED
+    if job.status == AtlasJob.STATUS_FAILED:
+        job.finished_at = now()
+        logger.error(f"ATLAS job {job.id} for {job.candidate.name} failed: {error}")
+    job.save()
+
+
+def submit_queued_jobs(session, heartbeat=lambda: None):
+    """
+    Submit queued jobs to ATLAS, oldest first, as long as the outstanding budget allows and ATLAS is not throttling.
+    :param heartbeat: Called before every job, e.g. to refresh the manager lock
+    :return: The number of jobs submitted
+    """
+    if atlas_throttle_wait() > 0:
+        return 0
+    budget = ATLAS_MAX_OUTSTANDING - AtlasJob.objects.filter(status=AtlasJob.STATUS_SUBMITTED).count()
+    if budget <= 0:
+        return 0
+
+    submitted = 0
+    queued = AtlasJob.objects.filter(status=AtlasJob.STATUS_QUEUED).select_related('candidate').order_by('created_at')
+    for job in queued[:budget]:
+        heartbeat()
+        candidate = job.candidate
+        resp = session.post(f"{ATLAS_BASEURL}/queue/", headers=get_atlas_headers(session), timeout=ATLAS_REQUEST_TIMEOUT,
+                            data={'ra': str(candidate.ra), 'dec': str(candidate.dec),
+                                  'mjd_min': job.mjd_min, 'send_email': False})
+        if resp.status_code == 201:  # successfully queued
+            job.task_url = resp.json()['url']
+            job.status = AtlasJob.STATUS_SUBMITTED
+            job.submitted_at = now()
+            job.attempts += 1
+            job.save()
+            submitted += 1
+            logger.info(f'Submitted ATLAS photometry for {candidate.name}, task {job.task_url}')
+        elif resp.status_code == 429:  # throttled, stop submitting until the wait is over
+            set_atlas_throttle(resp.json().get("detail", ""))
+            break
+        elif resp.status_code == 401:  # token expired
+            forget_atlas_token()
+            break
+        else:
+            job.attempts += 1
+            fail_or_requeue(job, f'ERROR {resp.status_code}: {resp.text[:1000]}')
+    return submitted
+
+
+def poll_submitted_jobs(session, heartbeat=lambda: None):
+    """
+    Check all submitted ATLAS tasks once, and add the photometry of the finished ones.
+    :param heartbeat: Called before every job, e.g. to refresh the manager lock
+    :return: The number of jobs finished
+    """
+    finished = 0
+    for job in AtlasJob.objects.filter(status=AtlasJob.STATUS_SUBMITTED).select_related('candidate'):
+        heartbeat()
+        headers = get_atlas_headers(session)
+        task_url = job.task_url
+        resp = session.get(task_url, headers=headers, timeout=ATLAS_REQUEST_TIMEOUT)
+        if resp.status_code == 401:  # token expired
+            forget_atlas_token()
+            return finished
+        if resp.status_code == 404:  # task deleted on the server
+            fail_or_requeue(job, 'ATLAS task disappeared')
+            continue
+        if resp.status_code != 200:
+            logger.warning(f'ERROR {resp.status_code} polling ATLAS task {task_url}')
+            continue
+
+        task = resp.json()
+        if not task.get('finishtimestamp'):
+            if now() - job.submitted_at > ATLAS_TASK_TIMEOUT:
+                session.delete(task_url, headers=headers, timeout=ATLAS_REQUEST_TIMEOUT)
+                fail_or_requeue(job, 'ATLAS task did not finish in time')
+            continue
+
+        if task.get('result_url'):
+            try:
+                textdata = session.get(task['result_url'], headers=headers, timeout=ATLAS_REQUEST_TIMEOUT).text
+                job.n_points = add_atlas_photometry(job.candidate, textdata)
+                record_photometry_fetch(job.candidate, "ATLAS", mjd_to_datetime(job.mjd_min)[0],
+                                        fetched_at=job.submitted_at)
+            except requests.RequestException:
+                continue  # Result not reachable right now, try again on the next poll
+            except Exception as e:
+                fail_or_requeue(job, f"Error reading ATLAS result: {e}")
+            else:
+                job.status = AtlasJob.STATUS_DONE
+                job.finished_at = now()
+                job.error = None
+                job.save()
+                finished += 1
+                logger.info(f"ATLAS photometry for {job.candidate.name} done, {job.n_points} new points")
+        else:
+            fail_or_requeue(job, task.get('error_msg') or 'ATLAS task finished without a result')
+        # Free the slot on the ATLAS server
+        session.delete(task_url, headers=headers, timeout=ATLAS_REQUEST_TIMEOUT)
+    return finished
+
+
+def run_atlas_manager(poll_interval=10, should_stop=lambda: False):
+    """
+    Submit and poll ATLAS jobs until should_stop() returns True.
+    Only one manager runs at a time (a lock in the shared Django cache), so the throttle budget is respected
+    and every task is polled by a single process. The manager stops if it loses the lock.
+    :return: False if another manager is already running
+    """
+    if settings.CACHES.get('default', {}).get('BACKEND') in PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured("The ATLAS job manager needs a cache shared by all processes (e.g. RedisCache) "
+                                   "for its lock, throttle and token.")
+    lock = AtlasManagerLock()
+    if not lock.acquire():
+        return False
+    try:
+        session = get_client(ATLAS_BASEURL)
+        while not should_stop():
+            lock.refresh()
+            try:
+                submit_queued_jobs(session, heartbeat=lock.refresh)
+                poll_submitted_jobs(session, heartbeat=lock.refresh)
+            except (requests.RequestException, AtlasError) as e:
+                logger.error(f"Error talking to the ATLAS API: {e}")
+            time.sleep(poll_interval)
+    except AtlasLockLost as e:
+        logger.error(f"Stopping the ATLAS job manager: {e}")
+    finally:
+        lock.release()
+    return True
@@ -1,15 +1,20 @@
 # Built-in imports
 import os
+import shutil
+import time
 
 # Third-party imports
 import numpy as np
 import pandas as pd
 from astropy import units as u
-from astropy.coordinates import SkyCoord
+from astropy_healpix import HEALPix
 
 # Django imports
 from django.conf import settings
 
+# Local imports
+from .spatial import angular_separation, healpix_cone_ranges, healpix_index
+
 # Logging
 import logging
 logger = logging.getLogger(__name__)
@@ -22,23 +27,165 @@ dtype_mapping = {
     "wiseX": "str",
     "SDSS-DR16Q": "str",
 }
+GLADE_NAME_COLUMNS = ["GWGC", "HyperLEDA", "2MASS", "wiseX", "SDSS-DR16Q"]  # By priority of catalogs
 
 GLADE_CAT_PATH = os.path.join(settings.BASE_DIR, "data", "catalogs", "GLADE_for_CAST.csv")
+# Binary layout built from the CSV by `python manage.py build_glade`, one .npy file per column.
+# GLADE_DIR is a symlink to the current build, a sibling directory named GLADE_for_CAST.<build time>.
+GLADE_DIR = os.path.join(settings.BASE_DIR, "data", "catalogs", "GLADE_for_CAST")
+GLADE_COLUMNS = {
+    'ra': np.float64,
+    'dec': np.float64,
+    'd_L': np.float32,
+    'z_helio': np.float64,
+    'name_catalog': np.int8,  # Index in GLADE_NAME_COLUMNS of the catalog the name comes from, -1 if no name
+    'name_offsets': np.int64,  # Name i is name_chars[name_offsets[i]:name_offsets[i+1]]
+    'name_chars': np.uint8,  # All names, UTF-8 encoded and concatenated
+    'healpix_offsets': np.int64,  # Rows are sorted by HEALPix pixel, pixel p is rows healpix_offsets[p]:healpix_offsets[p+1]
+}
+GLADE_HEALPIX_ORDER = 8  # Nested order of the row sorting, ~14 arcmin pixels
 glade = None  # Global variable to store the GLADE catalog, instead of initializing it every time
 
 
+class GladeCatalog:
+    """
+    Columns of the GLADE catalog as numpy arrays (memory-mapped when loaded from GLADE_DIR, so all
+    worker processes share the same pages). See GLADE_COLUMNS for the layout.
+    The rows are sorted by HEALPix pixel, so the galaxies of any cone are a few contiguous row ranges.
+    """
+
+    def __init__(self, columns):
+        for column in GLADE_COLUMNS:
+            setattr(self, column, columns[column])
+
+    def __len__(self):
+        return len(self.ra)
+
+    def name(self, i):
+        """
+        Name of galaxy i, as "<name> (<catalog>)", or None if it has no name.
+        """
+        catalog = int(self.name_catalog[i])
+        if catalog < 0:
+            return None
+        name = bytes(self.name_chars[self.name_offsets[i]:self.name_offsets[i + 1]]).decode()
+        return f"{name} ({GLADE_NAME_COLUMNS[catalog]})"
+
+    def cone(self, ra, dec, radius):
+        """
+        All galaxies within `radius` of a position. The HEALPix cone search is done on the sphere,
+        so RA wraparound and the poles are handled.
+        :param ra: Right ascension in degrees.
+        :param dec: Declination in degrees.
+        :param radius: Search radius in degrees.
+        :return: (row indices, separations in degrees) of the galaxies within the radius
+        """
+        ranges = healpix_cone_ranges(ra, dec, radius, order=GLADE_HEALPIX_ORDER)
+        rows = np.concatenate([
+            np.arange(self.healpix_offsets[start], self.healpix_offsets[stop]) for start, stop in ranges
+        ]) if ranges else np.empty(0, dtype=np.int64)
+        sep = angular_separation(ra, dec, self.ra[rows], self.dec[rows])
+        within = sep <= radius
+        return rows[within], sep[within]
+
+
+def glade_columns_from_csv(csv_path=GLADE_CAT_PATH):
+    """
+    Read the GLADE CSV into the binary column layout (see GLADE_COLUMNS).
+    Only the first non-null name of each galaxy (by priority of catalogs) is kept.
+    :return: Dict of column name -> numpy array
+    """
+    df = pd.read_csv(csv_path, dtype=dtype_mapping, usecols=["RA", "Dec", "d_L", "z_helio", *GLADE_NAME_COLUMNS])
+
+    # Sort the rows by HEALPix pixel, and record where each pixel starts
+    pixels = healpix_index(df['RA'].to_numpy(dtype=np.float64), df['Dec'].to_numpy(dtype=np.float64), order=GLADE_HEALPIX_ORDER)
+    order = np.argsort(pixels, kind='stable')
+    df = df.iloc[order].reset_index(drop=True)
+    healpix_offsets = np.searchsorted(pixels[order], np.arange(12 * 4**GLADE_HEALPIX_ORDER + 1))
+
+    names = df[GLADE_NAME_COLUMNS]
+    has_name = names.notna().to_numpy()
+    name_catalog = np.where(has_name.any(axis=1), has_name.argmax(axis=1), -1).astype(np.int8)
+    first_names = names.to_numpy()[np.arange(len(df)), np.maximum(name_catalog, 0)]
+    encoded = [name.encode() if catalog >= 0 else b'' for name, catalog in zip(first_names, name_catalog)]
+    name_offsets = np.zeros(len(df) + 1, dtype=np.int64)
+    name_offsets[1:] = np.cumsum([len(name) for name in encoded])
+
+    return {
+        'ra': df['RA'].to_numpy(dtype=np.float64),
+        'dec': df['Dec'].to_numpy(dtype=np.float64),
+        'd_L': df['d_L'].to_numpy(dtype=np.float32),
+        'z_helio': df['z_helio'].to_numpy(dtype=np.float64),
+        'name_catalog': name_catalog,
+        'name_offsets': name_offsets,
+        'name_chars': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        'healpix_offsets': healpix_offsets.astype(np.int64),
+    }
+
+
+def write_glade_columns(columns, directory=GLADE_DIR):
+    """
+    Save the GLADE columns as .npy files. All files are written to a new sibling directory, and `directory`,
+    a symlink, is then switched to it with one rename, so a process loading the catalog gets either all old
+    or all new columns. The build before the previous one is deleted; the previous one is kept for processes
+    that resolved the symlink just before the switch (mapped files stay readable after deletion anyway).
+    :param columns: Dict of column name -> numpy array, see glade_columns_from_csv
+    :param directory: Path of the symlink to the current build
+    """
+    directory = directory.rstrip(os.sep)
+    build_dir = f"{directory}.{time.strftime('%Y%m%d%H%M%S')}"
+    os.makedirs(build_dir)
+    for column, dtype in GLADE_COLUMNS.items():
+        np.save(os.path.join(build_dir, f"{column}.npy"), np.ascontiguousarray(columns[column], dtype=dtype))
+
+    previous = os.path.realpath(directory) if os.path.islink(directory) else None
+    if os.path.isdir(directory) and not os.path.islink(directory):
+        # Plain directory from before the builds were versioned. Until the symlink exists, loaders use the CSV
+        previous = f"{directory}.old"
+        os.rename(directory, previous)
+    link = f"{directory}.link"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(build_dir), link)
+    os.replace(link, directory)
+
+    parent, prefix = os.path.dirname(directory), os.path.basename(directory) + "."
+    for name in os.listdir(parent):
+        path = os.path.join(parent, name)
+        if (name.startswith(prefix) and os.path.isdir(path) and not os.path.islink(path)
+                and path not in (build_dir, previous)):
+            shutil.rmtree(path)
+
+
 def get_glade():
     """
-    Load the GLADE catalog file if not already loaded.
-    Avoids long initialization time of the server, and loads the catalog only when first needed.
+    Load the GLADE catalog if not already loaded.
+    The binary columns in GLADE_DIR are memory-mapped, which is nearly instant and shares one page-cache
+    copy between all processes. If they were not built yet, falls back to reading the CSV.
     """
     global glade
     if glade is None:
-        logger.info("Loading GLADE catalog...")
-        glade = pd.read_csv(GLADE_CAT_PATH, dtype=dtype_mapping)
+        # Resolve the symlink once, so all columns come from the same build even if build_glade switches it
+        build_dir = os.path.realpath(GLADE_DIR)
+        if all(os.path.exists(os.path.join(build_dir, f"{column}.npy")) for column in GLADE_COLUMNS):
+            logger.info(f"Memory-mapping GLADE catalog from {build_dir}")
+            glade = GladeCatalog({
+                column: np.load(os.path.join(build_dir, f"{column}.npy"), mmap_mode='r') for column in GLADE_COLUMNS
+            })
+        else:
+            logger.warning(f"{GLADE_DIR} not found, loading GLADE from the CSV. "
+                           f"Run `python manage.py build_glade` to build the fast binary catalog.")
+            glade = GladeCatalog(glade_columns_from_csv())
     return glade
 
 
+def catalog_float(value):
+    """
+    Convert a catalog value (possibly float32) to a Python float with its shortest decimal representation.
+    """
+    return None if np.isnan(value) else float(str(value))
+
+
 def associate_galaxy(ra, dec, radius=30.0):
     """
     Find the galaxy in the catalog that is most likely associated with the given RA, Dec.
@@ -52,24 +199,72 @@ def associate_galaxy(ra, dec, radius=30.0):
         tuple (galaxy name, d_L in Mpc, redshift). (None, None, None) if no galaxy is found within the radius.
     """
     glade = get_glade()
-    
-    # Create a 1 deg^2 area around the target coordinates, for faster SkyCoord match
-    mini_glade = glade[np.logical_and(
-        np.logical_and(glade['RA'] > ra-0.5, glade['RA'] < ra+0.5),
-        np.logical_and(glade['Dec'] > dec-0.5, glade['Dec'] < dec+0.5)
-        )]
-    glade_coo = SkyCoord(mini_glade['RA'], mini_glade['Dec'],frame='icrs',unit='deg')
-
-    target_coord = SkyCoord(ra=ra * u.deg, dec=dec * u.deg, frame='icrs')
-    idx, sep2d, _ = target_coord.match_to_catalog_sky(glade_coo)
-
-    if sep2d.arcsecond <= radius:
-        gal = mini_glade.iloc[idx]
-        gal_name = next(
-            (f"{gal[col]} ({col})" for col in ["GWGC", "HyperLEDA", "2MASS", "wiseX", "SDSS-DR16Q"] if not pd.isna(gal[col])),
-            None)  # Get the first non-null galaxy name by priority of catalogs
-        logger.info(f"Found galaxy: {gal_name} with separation {sep2d.arcsecond[0]:.2f} arcseconds and distance {gal.d_L:.2f} Mpc.")
-        return gal_name, gal.d_L, gal.z_helio
+
+    rows, sep = glade.cone(ra, dec, radius / 3600)
+
+    if len(rows):
+        nearest = np.argmin(sep)
+        i = rows[nearest]
+        gal_name = glade.name(i)  # First non-null galaxy name by priority of catalogs
+        d_L, z_helio = catalog_float(glade.d_L[i]), catalog_float(glade.z_helio[i])
+        distance = f"{d_L:.2f} Mpc" if d_L is not None else "unknown"
+        logger.info(f"Found galaxy: {gal_name} with separation {sep[nearest] * 3600:.2f} arcseconds and distance {distance}.")
+        return gal_name, d_L, z_helio
     else:
         logger.error(f"No galaxy found within {radius} arcseconds for candidate at RA: {ra}, Dec: {dec}.")
-        return None, None, None
\ No newline at end of file
+        return None, None, None
+
+
+def associate_galaxies(ra, dec, radius=30.0):
+    """
+    Vectorized associate_galaxy: find the nearest GLADE galaxy within the radius of each position.
+    Each position is matched against the galaxies of its HEALPix pixel and the 8 neighbouring pixels,
+    all positions in one pass. Radii larger than half a pixel fall back to one cone search per position.
+
+    Parameters:
+        ra (array): Right Ascensions in degrees.
+        dec (array): Declinations in degrees.
+        radius (float): Search radius in arcseconds.
+
+    Returns:
+        list of tuples (galaxy name, d_L in Mpc, redshift), one per position. (None, None, None) where no galaxy is found.
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    radius = radius / 3600
+    glade = get_glade()
+    best_rows = np.full(len(ra), -1, dtype=np.int64)
+
+    hp = HEALPix(nside=2**GLADE_HEALPIX_ORDER, order='nested')
+    if radius <= hp.pixel_resolution.to_value(u.deg) / 2:
+        pixels = hp.lonlat_to_healpix(ra * u.deg, dec * u.deg)
+        search = np.vstack([pixels[np.newaxis, :], hp.neighbours(pixels)])  # (9, n), -1 where there is no neighbour
+        positions = np.broadcast_to(np.arange(len(ra)), search.shape).ravel()
+        search = search.ravel()
+        positions, search = positions[search >= 0], search[search >= 0]
+
+        # Expand every (position, pixel) pair to the catalog rows of the pixel
+        starts = glade.healpix_offsets[search]
+        counts = glade.healpix_offsets[search + 1] - starts
+        rows = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        positions = np.repeat(positions, counts)
+
+        sep = angular_separation(ra[positions], dec[positions], glade.ra[rows], glade.dec[rows])
+        within = sep <= radius
+        rows, positions, sep = rows[within], positions[within], sep[within]
+
+        # Keep the nearest galaxy of each position
+        order = np.lexsort((sep, positions))
+        rows, positions = rows[order], positions[order]
+        nearest = np.concatenate(([True], positions[1:] != positions[:-1])) if len(positions) else np.empty(0, dtype=bool)
+        best_rows[positions[nearest]] = rows[nearest]
+    else:
+        for k in range(len(ra)):
+            rows, sep = glade.cone(ra[k], dec[k], radius)
+            if len(rows):
+                best_rows[k] = rows[np.argmin(sep)]
+
+    return [
+        (glade.name(i), catalog_float(glade.d_L[i]), catalog_float(glade.z_helio[i])) if i >= 0 else (None, None, None)
+        for i in best_rows
+    ]
@@ -0,0 +1,198 @@
+# Built-in imports
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Third-party imports
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Django imports
+from django.conf import settings
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Shared client for all outbound HTTP calls (PS1, SDSS, TNS, ATLAS, Horizons, Astro-COLIBRI).
+# Every host gets one pooled keep-alive session, with a default timeout, retries with backoff on connection
+# errors and 5xx responses, a cap on concurrent calls and a circuit breaker: after `failure_threshold`
+# consecutive failures the host is skipped for `cooldown` seconds, so a hung service fails fast instead of
+# holding ingestion and request workers. After the cooldown a single trial call is let through (half-open), and
+# the circuit closes if it succeeds or opens again if it fails. Per-call latency and errors are kept in http_metrics().
+#
+# The defaults can be changed per host with settings.HTTP_SERVICES, e.g.
+# HTTP_SERVICES = {'www.wis-tns.org': {'timeout': (5, 20), 'max_concurrency': 2}}
+
+HTTP_DEFAULTS = {
+    'timeout': (5, 30),  # (connect, read) seconds
+    'retries': 2,  # Connection errors and 5xx responses; non-idempotent requests (POST) are only retried if not sent
+    'backoff': 0.5,  # Seconds, doubled after each retry
+    'max_concurrency': 8,  # Concurrent calls per host and process
+    'failure_threshold': 5,  # Consecutive failures before the circuit opens
+    'cooldown': 60,  # Seconds the circuit stays open
+}
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class ServiceUnavailable(requests.RequestException):
+    """
+    Raised without calling the service when its circuit is open or all its connections are busy.
+    """
+
+
+class ServiceClient:
+    """
+    Pooled session for one host. Has the get/post/delete interface of requests.Session.
+    """
+
+    def __init__(self, host, timeout, retries, backoff, max_concurrency, failure_threshold, cooldown):
+        self.host = host
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                      status_forcelist=RETRY_STATUSES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_in_progress = False
+        self.metrics = {'calls': 0, 'errors': 0, 'rejected': 0, 'total_latency': 0.0, 'max_latency': 0.0}
+
+    def circuit_open(self):
+        return time.monotonic() < self.open_until
+
+    def admit(self):
+        """
+        Checks the circuit before a call. Raises ServiceUnavailable while the circuit is open, and while it is
+        half-open and the trial call is still in progress.
+        :return: Whether this call is the trial call of a half-open circuit
+        """
+        with self.lock:
+            if self.consecutive_failures < self.failure_threshold:
+                return False
+            if time.monotonic() >= self.open_until and not self.trial_in_progress:
+                self.trial_in_progress = True
+                return True
+        self.reject("is unavailable (circuit open)")
+
+    def end_trial(self):
+        with self.lock:
+            self.trial_in_progress = False
+
+    def record(self, latency, failed):
+        with self.lock:
+            self.metrics['calls'] += 1
+            self.metrics['total_latency'] += latency
+            self.metrics['max_latency'] = max(self.metrics['max_latency'], latency)
+            if not failed:
+                self.consecutive_failures = 0
+                return
+            self.metrics['errors'] += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                # Also re-opens right away when the trial call of a half-open circuit fails
+                self.open_until = time.monotonic() + self.cooldown
+                logger.warning(f"{self.host} failed {self.consecutive_failures} times in a row, "
+                               f"skipping it for {self.cooldown} s.")
+
+    def reject(self, reason):
+        with self.lock:
+            self.metrics['rejected'] += 1
+        raise ServiceUnavailable(f"{self.host} {reason}")
+
+    def request(self, method, url, **kwargs):
+        trial = self.admit()
+        try:
+            return self._request(method, url, **kwargs)
+        finally:
+            if trial:
+                # record() has closed or re-opened the circuit by now, unless the trial call was never sent
+                self.end_trial()
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        connect_timeout = kwargs['timeout'][0] if isinstance(kwargs['timeout'], tuple) else kwargs['timeout']
+        if not self.slots.acquire(timeout=connect_timeout):
+            self.reject("has too many calls in progress")
+
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            latency = time.monotonic() - start
+            self.record(latency, failed=True)
+            logger.warning(f"{method} {self.host} failed after {latency:.2f} s: {e}")
+            raise
+        finally:
+            self.slots.release()
+
+        latency = time.monotonic() - start
+        failed = response.status_code >= 500
+        self.record(latency, failed=failed)
+        logger.debug(f"{method} {self.host} {response.status_code} in {latency:.2f} s")
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def snapshot(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics['mean_latency'] = metrics['total_latency'] / metrics['calls'] if metrics['calls'] else 0.0
+        metrics['circuit_open'] = self.circuit_open()
+        return metrics
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url):
+    """
+    The ServiceClient of the host of a URL, created on first use.
+    """
+    host = urlsplit(url).netloc.lower()
+    with _clients_lock:
+        client = _clients.get(host)
+        if client is None:
+            options = {**HTTP_DEFAULTS, **getattr(settings, 'HTTP_SERVICES', {}).get(host, {})}
+            client = _clients[host] = ServiceClient(host, **options)
+    return client
+
+
+def http_get(url, **kwargs):
+    return get_client(url).get(url, **kwargs)
+
+
+def http_post(url, **kwargs):
+    return get_client(url).post(url, **kwargs)
+
+
+def http_delete(url, **kwargs):
+    return get_client(url).delete(url, **kwargs)
+
+
+def http_metrics():
+    """
+    Per-host call counts, errors, calls rejected by the circuit breaker or concurrency cap, and latencies
+    (seconds) of this process.
+    """
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {client.host: client.snapshot() for client in clients}
@@ -0,0 +1,34 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from candidates.atlas import run_atlas_manager
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run the ATLAS forced photometry job manager: submit queued requests, poll them and store the results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=10,
+                            help='Seconds between polls of the outstanding ATLAS tasks (default 10)')
+
+    def handle(self, *args, **kwargs):
+        stop = threading.Event()
+
+        def request_stop(signum, frame):
+            logger.info(f"Received signal {signum}, shutting down after the current poll.")
+            stop.set()
+
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+
+        self.stdout.write(self.style.SUCCESS("ATLAS job manager started."))
+        if not run_atlas_manager(kwargs['poll_interval'], should_stop=stop.is_set):
+            self.stdout.write(self.style.ERROR("Another ATLAS job manager is already running."))
+            return
+        self.stdout.write(self.style.SUCCESS("ATLAS job manager stopped."))
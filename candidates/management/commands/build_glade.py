@@ -0,0 +1,24 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from candidates.gal_association import GLADE_CAT_PATH, GLADE_DIR, glade_columns_from_csv, write_glade_columns
+
+
+class Command(BaseCommand):
+    help = 'Convert the GLADE CSV catalog to the memory-mapped binary layout used for host galaxy association'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv', type=str, default=GLADE_CAT_PATH, help=f'GLADE CSV file (default {GLADE_CAT_PATH})')
+        parser.add_argument('--output', type=str, default=GLADE_DIR, help=f'Output symlink, pointing to the latest build (default {GLADE_DIR})')
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write(f"Reading {kwargs['csv']}...")
+        columns = glade_columns_from_csv(kwargs['csv'])
+        write_glade_columns(columns, kwargs['output'])
+
+        size_mb = sum(os.path.getsize(os.path.join(kwargs['output'], name))
+                      for name in os.listdir(kwargs['output']) if name.endswith('.npy')) / 1e6
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(columns['ra'])} galaxies to {kwargs['output']} ({size_mb:.0f} MB). "
+            f"Restart the server and workers to pick up the new catalog."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from candidates.utils import CUTOUT_CACHE_DIR, clean_cutout_cache
+
+
+class Command(BaseCommand):
+    help = (f'Delete old cutouts from the on-disk cutout cache ({CUTOUT_CACHE_DIR}), along with expired '
+            '"no image" entries and leftover temporary files')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=float, default=90,
+                            help='Delete cached cutouts older than this (default 90)')
+        parser.add_argument('--empty-only', action='store_true',
+                            help='Only delete expired "no image" entries and temporary files')
+
+    def handle(self, *args, **kwargs):
+        deleted, freed = clean_cutout_cache(kwargs['max_age_days'], empty_only=kwargs['empty_only'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} cached files ({freed / 1e6:.1f} MB)."))
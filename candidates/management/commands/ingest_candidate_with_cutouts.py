@@ -1,16 +1,23 @@
 from django.core.management.base import BaseCommand
 from candidates.utils import process_multiple_json_files
+from django.conf import settings
 
 class Command(BaseCommand):
     help = 'Ingest multiple JSON files as candidates'
 
     def add_arguments(self, parser):
-        parser.add_argument('file', type=str, help='JSON file')
+        parser.add_argument('--directory', type=str, default=None,
+                            help='Directory of the JSON files (default TRANSIENT_DIR/json/)')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of files ingested concurrently (default 1, i.e. one after the other)')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Also retry files that failed in earlier runs, even outside the cutoff window')
 
     def handle(self, *args, **kwargs):
-        directory = kwargs['directory']
+        directory = kwargs['directory'] or settings.TRANSIENT_DIR+'json/'
         try:
-            total_candidates_added = process_multiple_json_files(directory)
+            total_candidates_added = process_multiple_json_files(directory, workers=kwargs['workers'],
+                                                                 retry_failed=kwargs['retry_failed'])
             self.stdout.write(self.style.SUCCESS(f"Total candidates added: {total_candidates_added}"))
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Error processing files: {e}"))
\ No newline at end of file
+            self.stdout.write(self.style.ERROR(f"Error processing files: {e}"))
@@ -0,0 +1,176 @@
+import json
+import os
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import close_old_connections
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from candidates.models import IngestedFile
+from candidates.utils import ingest_json_path, is_file_ingested, process_multiple_json_files
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class AlertFileHandler(FileSystemEventHandler):
+    """
+    Collects JSON files that were closed after writing (or moved into place) and wakes up the main loop,
+    also when a cutout file lands, since a pending JSON may be waiting for it.
+    """
+
+    def __init__(self, pending, wakeup):
+        self.pending = pending
+        self.wakeup = wakeup
+        self.lock = threading.Lock()
+
+    def _handle(self, path):
+        if path.endswith('.json'):
+            with self.lock:
+                self.pending.setdefault(path, time.monotonic())
+        self.wakeup.set()
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self._handle(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._handle(event.dest_path)
+
+
+def missing_cutouts(json_path, cutout_dir):
+    """
+    Returns the cutout files referenced by the last report of a JSON alert that do not exist yet.
+    Raises ValueError if the JSON can't be parsed (e.g. still being written).
+    """
+    with open(json_path, 'rb') as file:
+        try:
+            last_report = json.load(file).get('last_report', {})
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON format: {e}")
+    names = [last_report.get(key) for key in ('ref_cutout', 'new_cutout', 'diff_cutout')]
+    return [name for name in names if name and not os.path.exists(os.path.join(cutout_dir, name))]
+
+
+class Command(BaseCommand):
+    help = 'Watch TRANSIENT_DIR for new JSON alerts and ingest them as soon as they and their cutouts are on disk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-wait', type=float, default=120,
+                            help='Seconds to wait for the cutouts of an alert before ingesting it anyway (default 120)')
+        parser.add_argument('--poll-interval', type=float, default=1,
+                            help='Seconds between checks of the pending alerts (default 1)')
+        parser.add_argument('--no-catch-up', action='store_true',
+                            help='Skip the startup scan for files that arrived while the daemon was down')
+        parser.add_argument('--retry-interval', type=float, default=300,
+                            help='Seconds between retries of alerts that failed to ingest (default 300)')
+        parser.add_argument('--max-attempts', type=int, default=3,
+                            help='Alerts are retried until they failed this many times (default 3)')
+
+    def requeue_failed(self, json_dir, handler, max_wait, max_attempts):
+        """
+        Puts the files whose ledger entry failed fewer than max_attempts times back in the pending queue.
+        They are marked as seen max_wait ago, so they are not held back waiting for cutouts again.
+        """
+        names = list(IngestedFile.objects.filter(status=IngestedFile.STATUS_FAILED, attempts__lt=max_attempts)
+                     .values_list('filename', flat=True))
+        first_seen = time.monotonic() - max_wait
+        with handler.lock:
+            for name in names:
+                path = os.path.join(json_dir, name)
+                if path not in handler.pending and os.path.exists(path):
+                    handler.pending[path] = first_seen
+                    logger.info(f"Retrying {name}, which failed in an earlier attempt.")
+
+    def handle(self, *args, **kwargs):
+        json_dir = settings.TRANSIENT_DIR+'json/'
+        cutout_dir = settings.TRANSIENT_DIR+'cutouts'
+        max_wait = kwargs['max_wait']
+        poll_interval = kwargs['poll_interval']
+        retry_interval = kwargs['retry_interval']
+
+        stop = threading.Event()
+        wakeup = threading.Event()
+        pending = {}  # JSON path -> time it was first seen
+        retry_at = {}  # JSON path -> earliest time to try again, after an error outside the ingestion itself
+
+        def request_stop(signum, frame):
+            logger.info(f"Received signal {signum}, shutting down after the current file.")
+            stop.set()
+            wakeup.set()
+
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+
+        # Start watching before the catch-up scan, so nothing arriving in between is missed
+        handler = AlertFileHandler(pending, wakeup)
+        observer = Observer()
+        observer.schedule(handler, json_dir, recursive=False)
+        observer.schedule(handler, cutout_dir, recursive=False)
+        observer.start()
+        self.stdout.write(self.style.SUCCESS(f"Watching {json_dir} and {cutout_dir}"))
+
+        try:
+            if not kwargs['no_catch_up']:
+                total_candidates_added = process_multiple_json_files(json_dir)
+                self.stdout.write(self.style.SUCCESS(f"Catch-up done, candidates added: {total_candidates_added}"))
+
+            last_requeue = time.monotonic()
+            while not stop.is_set():
+                wakeup.wait(poll_interval)
+                wakeup.clear()
+                # Drop connections that broke (database restart, idle timeout), the next query reconnects
+                close_old_connections()
+                if time.monotonic() - last_requeue >= retry_interval:
+                    last_requeue = time.monotonic()
+                    try:
+                        self.requeue_failed(json_dir, handler, max_wait, kwargs['max_attempts'])
+                    except Exception as e:
+                        logger.error(f"Could not look up failed alerts to retry: {e}")
+                with handler.lock:
+                    ready = list(pending.items())
+                for path, first_seen in ready:
+                    if stop.is_set():
+                        break
+                    if retry_at.get(path, 0) > time.monotonic():
+                        continue
+                    waited = time.monotonic() - first_seen
+                    try:
+                        missing = missing_cutouts(path, cutout_dir)
+                    except (OSError, ValueError) as e:
+                        if waited < max_wait:
+                            continue  # Not fully written yet, try again later
+                        logger.error(f"Giving up on {os.path.basename(path)}: {e}")
+                        missing = None
+                    if missing and waited < max_wait:
+                        continue
+                    if missing:
+                        logger.warning(f"Ingesting {os.path.basename(path)} without cutouts {missing} after {waited:.0f} s.")
+
+                    with handler.lock:
+                        pending.pop(path, None)
+                    if missing is None:
+                        continue
+                    try:
+                        if is_file_ingested(os.path.basename(path)):
+                            continue  # Already ingested, e.g. by the catch-up scan
+                        candidates_added, elapsed = ingest_json_path(path)
+                    except Exception as e:
+                        # E.g. the database is down: keep the file queued instead of stopping the daemon
+                        logger.error(f"Could not ingest {os.path.basename(path)}, retrying in {retry_interval:.0f} s: {e}")
+                        retry_at[path] = time.monotonic() + retry_interval
+                        with handler.lock:
+                            pending.setdefault(path, first_seen)
+                        continue
+                    retry_at.pop(path, None)
+                    logger.info(f"Alert {os.path.basename(path)} ingested {waited + elapsed:.1f} s after it landed.")
+        finally:
+            observer.stop()
+            observer.join()
+            self.stdout.write(self.style.SUCCESS("Ingest daemon stopped."))
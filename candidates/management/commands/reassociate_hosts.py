@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from candidates.gal_association import associate_galaxies
+from candidates.models import Candidate
+
+
+class Command(BaseCommand):
+    help = 'Re-run host galaxy association for all candidates, e.g. after a GLADE update or a radius change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only-missing', action='store_true',
+                            help='Only candidates without a host galaxy, e.g. ingested while GLADE was missing')
+        parser.add_argument('--radius', type=float, default=30.0,
+                            help='Search radius in arcseconds (default 30)')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Number of candidates matched and updated at once (default 5000)')
+
+    def handle(self, *args, **kwargs):
+        candidates = Candidate.objects.order_by('id').only('id', 'ra', 'dec', 'host_galaxy', 'dist_Mpc', 'redshift')
+        if kwargs['only_missing']:
+            candidates = candidates.filter(Q(host_galaxy__isnull=True) | Q(host_galaxy=''))
+
+        start = time.monotonic()
+        processed = updated = matched = 0
+        last_id = 0
+        while True:
+            # Keyset pagination, so each chunk is a cheap indexed query however far into the table we are
+            chunk = list(candidates.filter(id__gt=last_id)[:kwargs['chunk_size']])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            hosts = associate_galaxies([c.ra for c in chunk], [c.dec for c in chunk], radius=kwargs['radius'])
+            changed = []
+            for candidate, (gal_name, dist_Mpc, z) in zip(chunk, hosts):
+                matched += gal_name is not None
+                if (candidate.host_galaxy, candidate.dist_Mpc, candidate.redshift) != (gal_name, dist_Mpc, z):
+                    candidate.host_galaxy, candidate.dist_Mpc, candidate.redshift = gal_name, dist_Mpc, z
+                    changed.append(candidate)
+            Candidate.objects.bulk_update(changed, ['host_galaxy', 'dist_Mpc', 'redshift'])
+
+            processed += len(chunk)
+            updated += len(changed)
+            self.stdout.write(f"Processed {processed} candidates ({updated} updated) in {time.monotonic() - start:.1f} s")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {processed} candidates processed, {matched} with a host galaxy, {updated} updated."))
@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from candidates.models import Candidate, TNS_LOOKUP_TTL
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Refresh the cached TNS status (TNSLookup) of candidates whose lookup is missing, stale, or for an old position'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=30,
+                            help='Only candidates with an alert in the last N days (default 30)')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Maximum number of candidates refreshed per pass')
+        parser.add_argument('--loop', type=float, default=None,
+                            help='Keep running, with a pass every LOOP seconds')
+        parser.add_argument('--delay', type=float, default=1,
+                            help='Seconds between TNS queries, to stay within the API rate limit (default 1)')
+
+    def handle(self, *args, **kwargs):
+        while True:
+            refreshed = self.refresh_pass(kwargs['days'], kwargs['limit'], kwargs['delay'])
+            self.stdout.write(self.style.SUCCESS(f"Refreshed {refreshed} TNS lookups."))
+            if kwargs['loop'] is None:
+                break
+            time.sleep(kwargs['loop'])
+
+    def refresh_pass(self, days, limit, delay):
+        stale = (Q(tns_lookup__isnull=True)
+                 | Q(tns_lookup__checked_at__lt=now() - TNS_LOOKUP_TTL)
+                 | ~Q(tns_lookup__ra=F('ra')) | ~Q(tns_lookup__dec=F('dec')))
+        candidates = (Candidate.objects.filter(latest_alert_time__gte=now() - timedelta(days=days))
+                      .filter(stale).order_by('-latest_alert_time'))
+        if limit:
+            candidates = candidates[:limit]
+
+        refreshed = 0
+        for candidate in candidates.iterator():
+            try:
+                candidate.refresh_tns_lookup()
+                refreshed += 1
+            except Exception as e:
+                logger.error(f"Error refreshing TNS lookup of {candidate.name}: {e}")
+            time.sleep(delay)
+        return refreshed
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from candidates.models import Candidate
+from candidates.photometry_utils import LASAIR_LIGHTCURVES_BATCH, refresh_ztf_photometry
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Refresh the ZTF forced photometry of the follow-up candidates, with batched Lasair light curve requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Refresh all candidates with a known ZTF object, not only the ones marked for follow-up')
+        parser.add_argument('--days-ago', type=float, default=10,
+                            help='Photometry window in days (default 10), only new epochs are added')
+        parser.add_argument('--batch-size', type=int, default=LASAIR_LIGHTCURVES_BATCH,
+                            help=f'Objects per Lasair lightcurves call (default {LASAIR_LIGHTCURVES_BATCH})')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['all']:
+            candidates = Candidate.objects.filter(ztf_object_id__isnull=False)
+        else:
+            candidates = Candidate.objects.filter(marked_for_followup=True)
+
+        n_added = refresh_ztf_photometry(candidates.iterator(), days_ago=kwargs['days_ago'],
+                                         batch_size=kwargs['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Added {n_added} ZTF photometry points."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from candidates.tns_catalog import load_tns_catalog
+
+
+class Command(BaseCommand):
+    help = 'Load the TNS public objects CSV export into the local TNS mirror, used to crossmatch candidates without the TNS API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', type=str, help='Path of tns_public_objects.csv (or .csv.zip)')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of objects written per query (default 5000)')
+
+    def handle(self, *args, **kwargs):
+        try:
+            snapshot = load_tns_catalog(kwargs['csv_path'], batch_size=kwargs['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Loaded {snapshot.n_objects} TNS objects (export of {snapshot.taken_at})."))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Error loading TNS catalog: {e}"))
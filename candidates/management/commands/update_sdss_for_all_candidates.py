@@ -1,21 +1,52 @@
 from django.core.management.base import BaseCommand
-from django.conf import settings
-from candidates.models import Candidate,CandidateDataProduct
-from candidates.utils import fetch_sdss_cutout
+from candidates.models import Candidate, CandidateDataProduct
+from candidates.utils import CUTOUT_WORKERS, fetch_cutouts
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
 
 class Command(BaseCommand):
-    help = 'Update SDSS data for all candidates'
-    # Loop through all candidates
+    help = ('Backfill the SDSS (and optionally PS1) cutouts of all candidates that do not have one yet. '
+            'Cutouts are saved per batch, so an interrupted run continues where it stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--survey', action='append', choices=['sdss', 'ps1'],
+                            help='Survey to backfill, can be repeated (default sdss)')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Candidates fetched concurrently and saved together (default 100)')
+        parser.add_argument('--workers', type=int, default=CUTOUT_WORKERS,
+                            help=f'Concurrent downloads (default {CUTOUT_WORKERS})')
+
     def handle(self, *args, **kwargs):
-        for candidate in Candidate.objects.all():
-            try:
-                sdss_cutout = fetch_sdss_cutout(candidate.ra, candidate.dec)
-            except Exception as e:
-                print (f"Error fetching SDSS cutout for {candidate.name}: {e}")
-            if sdss_cutout:
+        for survey in kwargs['survey'] or ['sdss']:
+            added = self.backfill(survey, kwargs['batch_size'], kwargs['workers'])
+            self.stdout.write(self.style.SUCCESS(f"Added {added} {survey.upper()} cutouts."))
+
+    def backfill(self, survey, batch_size, workers):
+        added = 0
+        last_id = 0
+        while True:
+            # Candidates with a cutout (from earlier runs or batches) are skipped, which makes the command resumable
+            batch = list(Candidate.objects.filter(id__gt=last_id)
+                         .exclude(data_products__data_product_type=survey)
+                         .order_by('id').only('id', 'name', 'ra', 'dec')[:batch_size])
+            if not batch:
+                return added
+            last_id = batch[-1].id
+
+            cutouts = fetch_cutouts([(survey, candidate.ra, candidate.dec) for candidate in batch], max_workers=workers)
+            for candidate in batch:
+                cutout = cutouts[(survey, candidate.ra, candidate.dec)]
+                if cutout is None:
+                    logger.warning(f"No {survey.upper()} cutout for {candidate.name}")
+                    continue
                 CandidateDataProduct.objects.create(
                     candidate=candidate,
-                    datafile=sdss_cutout,
-                    data_product_type='sdss',
-                    name=f"{candidate.name} SDSS cutout",
-                )
\ No newline at end of file
+                    datafile=cutout,
+                    data_product_type=survey,
+                    name=f"{candidate.name} {survey.upper()} cutout",
+                )
+                added += 1
+            self.stdout.write(f"{survey.upper()}: processed candidates up to id {last_id}, {added} cutouts added")
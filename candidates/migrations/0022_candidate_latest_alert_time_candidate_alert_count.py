@@ -0,0 +1,40 @@
+# Generated by Django 4.2.17 on 2026-10-17 09:12
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_alert_summary(apps, schema_editor):
+    """
+    Fill latest_alert_time and alert_count from the existing alerts in a single UPDATE.
+    """
+    Candidate = apps.get_model("candidates", "Candidate")
+    CandidateAlert = apps.get_model("candidates", "CandidateAlert")
+
+    alerts = CandidateAlert.objects.filter(candidate=OuterRef("pk")).order_by().values("candidate")
+    Candidate.objects.update(
+        latest_alert_time=Subquery(alerts.annotate(latest=Max("created_at")).values("latest")),
+        alert_count=Coalesce(Subquery(alerts.annotate(n=Count("id")).values("n")), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("candidates", "0021_candidate_real_bogus_user"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="candidate",
+            name="latest_alert_time",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="candidate",
+            name="alert_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_alert_summary, migrations.RunPython.noop),
+    ]
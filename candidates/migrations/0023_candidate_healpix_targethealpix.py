@@ -0,0 +1,75 @@
+# Generated by Django 4.2.17 on 2026-10-17 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import numpy as np
+from astropy import units as u
+from astropy_healpix import HEALPix
+
+
+def healpix_index(ra, dec):
+    """
+    Nested HEALPix index at order 14, the order the healpix columns are stored at.
+    Inlined so that the migration doesn't change with candidates.spatial.
+    """
+    hp = HEALPix(nside=2**14, order="nested")
+    return hp.lonlat_to_healpix(np.asarray(ra, dtype=float) * u.deg, np.asarray(dec, dtype=float) * u.deg)
+
+
+def backfill_healpix(apps, schema_editor):
+    """
+    Compute the HEALPix index of all existing candidates and targets.
+    """
+    Candidate = apps.get_model("candidates", "Candidate")
+    TargetHealpix = apps.get_model("candidates", "TargetHealpix")
+    BaseTarget = apps.get_model("tom_targets", "BaseTarget")
+
+    candidates = list(Candidate.objects.only("id", "ra", "dec"))
+    if candidates:
+        pixels = healpix_index([c.ra for c in candidates], [c.dec for c in candidates])
+        for candidate, pixel in zip(candidates, pixels):
+            candidate.healpix = int(pixel)
+        Candidate.objects.bulk_update(candidates, ["healpix"], batch_size=1000)
+
+    targets = list(BaseTarget.objects.filter(ra__isnull=False, dec__isnull=False).only("id", "ra", "dec"))
+    if targets:
+        pixels = healpix_index([t.ra for t in targets], [t.dec for t in targets])
+        TargetHealpix.objects.bulk_create(
+            [TargetHealpix(target_id=t.id, healpix=int(pixel)) for t, pixel in zip(targets, pixels)],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tom_targets", "0021_rename_target_basetarget_alter_basetarget_options"),
+        ("candidates", "0022_candidate_latest_alert_time_candidate_alert_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="candidate",
+            name="healpix",
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="TargetHealpix",
+            fields=[
+                (
+                    "target",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="healpix_index",
+                        serialize=False,
+                        to="tom_targets.basetarget",
+                    ),
+                ),
+                ("healpix", models.BigIntegerField(db_index=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_healpix, migrations.RunPython.noop),
+    ]
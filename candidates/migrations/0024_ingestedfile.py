@@ -0,0 +1,71 @@
+# Generated by Django 4.2.17 on 2026-10-17 11:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_ingested_files(apps, schema_editor):
+    """
+    Record the json files that were already ingested, so they are not picked up again.
+    """
+    CandidateDataProduct = apps.get_model("candidates", "CandidateDataProduct")
+    IngestedFile = apps.get_model("candidates", "IngestedFile")
+
+    rows = CandidateDataProduct.objects.filter(data_product_type="json").values_list("name", "candidate_id").iterator()
+    batch = []
+    for name, candidate_id in rows:
+        batch.append(IngestedFile(filename=name, status="done", attempts=1, candidate_id=candidate_id))
+        if len(batch) >= 1000:
+            IngestedFile.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    IngestedFile.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("candidates", "0023_candidate_healpix_targethealpix"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestedFile",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("filename", models.CharField(max_length=255, unique=True)),
+                ("size", models.BigIntegerField(blank=True, null=True)),
+                ("mtime", models.DateTimeField(blank=True, null=True)),
+                ("content_hash", models.CharField(blank=True, max_length=64, null=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("processing", "Processing"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        db_index=True,
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("error", models.TextField(blank=True, null=True)),
+                ("stage_timings", models.JSONField(blank=True, default=dict)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "candidate",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="ingested_files",
+                        to="candidates.candidate",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(backfill_ingested_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.17 on 2026-10-17 12:10
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_photometry(apps, schema_editor):
+    """
+    Keep only the first row of every (candidate, telescope, filter_band, obs_date) point,
+    e.g. the LAST non-detections that were added again with every alert.
+    """
+    CandidatePhotometry = apps.get_model("candidates", "CandidatePhotometry")
+
+    duplicates = (CandidatePhotometry.objects
+                  .values("candidate_id", "telescope", "filter_band", "obs_date")
+                  .annotate(first_id=Min("id"), n=Count("id"))
+                  .filter(n__gt=1))
+    for point in duplicates.iterator():
+        first_id = point.pop("first_id")
+        point.pop("n")
+        CandidatePhotometry.objects.filter(**point).exclude(id=first_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("candidates", "0024_ingestedfile"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_photometry, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="candidatephotometry",
+            constraint=models.UniqueConstraint(
+                fields=("candidate", "telescope", "filter_band", "obs_date"),
+                name="unique_candidate_photometry_point",
+            ),
+        ),
+    ]
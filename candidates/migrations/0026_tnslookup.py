@@ -0,0 +1,34 @@
+# Generated by Django 4.2.17 on 2026-10-17 13:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("candidates", "0025_candidatephotometry_unique_point"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TNSLookup",
+            fields=[
+                (
+                    "candidate",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="tns_lookup",
+                        serialize=False,
+                        to="candidates.candidate",
+                    ),
+                ),
+                ("ra", models.FloatField()),
+                ("dec", models.FloatField()),
+                ("tns_name", models.CharField(blank=True, max_length=100, null=True)),
+                ("reported_by_LAST", models.BooleanField(default=False)),
+                ("checked_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.17 on 2026-10-17 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("candidates", "0026_tnslookup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TNSObject",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=20, unique=True)),
+                ("name_prefix", models.CharField(blank=True, max_length=10, null=True)),
+                ("ra", models.FloatField()),
+                ("dec", models.FloatField()),
+                ("healpix", models.BigIntegerField(db_index=True)),
+                ("redshift", models.FloatField(blank=True, null=True)),
+                ("type", models.CharField(blank=True, max_length=50, null=True)),
+                ("reporting_group", models.CharField(blank=True, max_length=100, null=True)),
+                ("source_group", models.CharField(blank=True, max_length=100, null=True)),
+                ("internal_names", models.TextField(blank=True, null=True)),
+                ("discovery_date", models.DateTimeField(blank=True, null=True)),
+                ("last_modified", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="TNSCatalogSnapshot",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("taken_at", models.DateTimeField(db_index=True)),
+                ("loaded_at", models.DateTimeField(auto_now_add=True)),
+                ("n_objects", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.17 on 2026-10-17 15:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("candidates", "0028_atlasjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PhotometryWatermark",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("survey", models.CharField(max_length=20)),
+                ("covered_from", models.DateTimeField()),
+                ("newest_epoch", models.DateTimeField(blank=True, null=True)),
+                ("fetched_at", models.DateTimeField()),
+                (
+                    "candidate",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="photometry_watermarks",
+                        to="candidates.candidate",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="photometrywatermark",
+            constraint=models.UniqueConstraint(
+                fields=("candidate", "survey"), name="unique_candidate_survey_watermark"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.17 on 2026-10-17 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("candidates", "0029_photometrywatermark"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="candidate",
+            name="ztf_object_id",
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+    ]
@@ -1,12 +1,26 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils.timezone import now
 from astropy.coordinates import SkyCoord
 from astropy import units as u
 from django.conf import settings
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from tom_targets.base_models import BaseTarget
 import requests
 import json
 import os
+from datetime import timedelta
+
+from .http_client import http_post
+from .spatial import angular_separation, healpix_cone_q, healpix_index
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# How long a cached TNS lookup is considered fresh, see TNSLookup
+TNS_LOOKUP_TTL = timedelta(seconds=getattr(settings, 'TNS_LOOKUP_TTL', 6 * 3600))
 
 
 CLASSIFICATION_CHOICES = [
@@ -58,13 +72,56 @@ def tns_cone_search(ra, dec, radius=3.0):
     }
     # Perform the request
     try:
-        response = requests.post(endpoint, headers=headers, data=payload, timeout=10)
+        response = http_post(endpoint, headers=headers, data=payload)
         response.raise_for_status()  # Raise an error for bad status codes
         return response.json()  # Parse the JSON response
     except requests.RequestException as e:
         print(f"Error during TNS cone search: {e}")
         return None
     
+def tns_catalog_match(ra, dec, radius=3.0, last_alert_at=None):
+    """
+    Crossmatch a position with the local mirror of the TNS public objects (see the sync_tns_catalog command).
+
+    An object in the mirror counts as reported by LAST if its reporting or source group is in
+    settings.TNS_LAST_GROUPS, while the API path (Candidate.query_tns) looks for LAST-Cam photometry.
+    The two only differ for objects reported by another group with LAST photometry added later,
+    which the mirror reports as not reported by LAST.
+
+    Parameters:
+        ra (float): Right Ascension in degrees.
+        dec (float): Declination in degrees.
+        radius (float): Search radius in arcsec.
+        last_alert_at (datetime): Time of the newest alert of the candidate, None for a new candidate.
+
+    Returns:
+        tuple (reported_by_LAST, tns_name) like Candidate.query_tns, or None if the mirror can't tell and TNS
+        has to be queried: no snapshot is loaded, or nothing matches and TNS may have changed since the
+        snapshot, i.e. the snapshot is older than TNS_LOOKUP_TTL or the candidate had an alert after it.
+    """
+    snapshot = TNSCatalogSnapshot.objects.order_by('-taken_at').first()
+    if snapshot is None:
+        return None
+
+    radius_deg = radius / 3600
+    nearby = list(TNSObject.objects.filter(healpix_cone_q(ra, dec, radius_deg))
+                  .order_by('name').values_list('name', 'ra', 'dec', 'reporting_group', 'source_group'))
+    matches = [obj for obj in nearby if angular_separation(ra, dec, obj[1], obj[2]) <= radius_deg]
+    if not matches:
+        # Reports usually come days after discovery, so only an absence from a recent snapshot taken
+        # after the last alert of the candidate is trusted
+        if (snapshot.taken_at < now() - TNS_LOOKUP_TTL
+                or last_alert_at is None or last_alert_at >= snapshot.taken_at):
+            return None
+        return False, None
+
+    last_groups = getattr(settings, 'TNS_LAST_GROUPS', ['LAST'])
+    for name, _, _, reporting_group, source_group in matches:
+        if reporting_group in last_groups or source_group in last_groups:
+            return True, name
+    return False, matches[-1][0]
+
+
 class Candidate(models.Model):
     name = models.CharField(max_length=100)
     ra = models.FloatField()   # Right Ascension
@@ -93,15 +150,83 @@ class Candidate(models.Model):
         blank=True
     )
     marked_for_followup = models.BooleanField(default=False)  # Marked for follow-up observations
+    latest_alert_time = models.DateTimeField(null=True, blank=True, db_index=True)  # created_at of the newest alert, maintained by save_alert
+    alert_count = models.PositiveIntegerField(default=0)  # Number of alerts, maintained by save_alert
+    healpix = models.BigIntegerField(null=True, blank=True, db_index=True)  # Nested HEALPix index of (ra, dec), for cone searches
+    ztf_object_id = models.CharField(max_length=20, null=True, blank=True)  # Matching ZTF objectId, stored by find_ztf_object
     
     def save(self, check_tns=True, *args, **kwargs):
         """
-        Override the save method to generate the SDSS-style name using astropy.
+        Override the save method to generate the SDSS-style name using astropy,
+        and to keep the HEALPix index in step with the coordinates.
+        With check_tns, the TNS status is taken from the cached TNSLookup, and a refresh is scheduled
+        if it is missing or stale, so saves from the scanning page never wait for TNS.
+        Only a new candidate without background workers is looked up right away (during ingestion).
         """
         self.name = self.generate_LAST_name()
+        self.healpix = int(healpix_index(self.ra, self.dec))
+        lookup_now = refresh_later = False
         if check_tns:
-            self.reported_by_LAST,self.tns_name = self.query_tns()
+            lookup = TNSLookup.objects.filter(candidate_id=self.pk).first() if self.pk else None
+            if lookup is not None:
+                self.apply_tns_result(lookup.reported_by_LAST, lookup.tns_name)
+            if lookup is None or not lookup.is_fresh(self.ra, self.dec):
+                if self.pk is None and not getattr(settings, 'CANDIDATE_ENRICHMENT_ASYNC', False):
+                    lookup_now = True
+                else:
+                    refresh_later = True
+        if lookup_now:
+            try:
+                self.reported_by_LAST, self.tns_name = self.query_tns(raise_errors=True)
+            except Exception as e:
+                # Not cached, so the refresh_tns_lookups command retries it
+                logger.warning(f"TNS lookup of {self.name} failed: {e}")
+                lookup_now = False
         super().save(*args, **kwargs)
+        if lookup_now:
+            self.store_tns_lookup(self.reported_by_LAST, self.tns_name)
+        if refresh_later:
+            self.schedule_tns_refresh()
+
+    def apply_tns_result(self, reported_by_LAST, tns_name):
+        """
+        Merge a TNS lookup result into the candidate. The status only moves forward (a TNS name or a LAST
+        report is never cleared), so a cached result can't undo a report made since it was cached.
+        """
+        self.reported_by_LAST = self.reported_by_LAST or reported_by_LAST
+        self.tns_name = tns_name or self.tns_name
+
+    def store_tns_lookup(self, reported_by_LAST, tns_name):
+        TNSLookup.objects.update_or_create(candidate_id=self.pk, defaults={
+            'ra': self.ra,
+            'dec': self.dec,
+            'reported_by_LAST': reported_by_LAST,
+            'tns_name': tns_name,
+            'checked_at': now(),
+        })
+
+    def refresh_tns_lookup(self):
+        """
+        Query TNS, store the result in the TNSLookup cache and apply it to the candidate.
+        Errors propagate and leave the cache stale, so the refresh is retried later.
+        """
+        reported_by_LAST, tns_name = self.query_tns(raise_errors=True)
+        self.store_tns_lookup(reported_by_LAST, tns_name)
+        old = (self.reported_by_LAST, self.tns_name)
+        self.apply_tns_result(reported_by_LAST, tns_name)
+        if (self.reported_by_LAST, self.tns_name) != old:
+            # update() rather than save(), to not overwrite fields changed concurrently by the scanners
+            Candidate.objects.filter(id=self.id).update(reported_by_LAST=self.reported_by_LAST, tns_name=self.tns_name)
+
+    def schedule_tns_refresh(self):
+        """
+        Send the TNS refresh to the background workers if they are enabled. Otherwise stale
+        lookups are picked up by the refresh_tns_lookups command.
+        """
+        if getattr(settings, 'CANDIDATE_ENRICHMENT_ASYNC', False):
+            from .tasks import refresh_tns_lookup
+            candidate_id = self.pk
+            transaction.on_commit(lambda: refresh_tns_lookup.send(candidate_id))
 
     def generate_LAST_name(self):
         """
@@ -116,10 +241,11 @@ class Candidate(models.Model):
 
         return f"LAST J{ra_str}{dec_str}"
     
-    def query_tns(self):
+    def query_tns(self, raise_errors=False):
         """
         Query the TNS to check if a candidate already exists.
         :param candidate: Candidate instance
+        :param raise_errors: Raise request errors instead of returning (False, None)
         :return: TNS response (JSON) or None if not found
         """
         tns_settings = settings.BROKERS.get('TNS', {})
@@ -139,10 +265,18 @@ class Candidate(models.Model):
         # Headers required for the TNS API
         tns_marker = 'tns_marker{"tns_id": "' + str(TNS_BOT_ID) + '", "type": "bot", "name": "' + TNS_BOT_NAME + '"}'
         headers = {'User-Agent': tns_marker}
+
+        # Crossmatch with the local TNS mirror first, and query TNS only for what it can't tell
+        local_match = tns_catalog_match(self.ra, self.dec, last_alert_at=self.latest_alert_time if self.pk else None)
+        if local_match is not None:
+            return local_match
+
         try:
             # Perform a cone search to get the object name
             cone = tns_cone_search(self.ra, self.dec)
             # logger.debug(f'cone search result: {cone}')
+            if cone is None and raise_errors:
+                raise requests.RequestException("TNS cone search failed")
             if 'data' not in cone.keys():
                 return False, None
             cone_reply = cone['data']
@@ -160,7 +294,7 @@ class Candidate(models.Model):
                         })
                     }
                     # Perform the request
-                    response = requests.post(endpoint, headers=headers, data=payload)
+                    response = http_post(endpoint, headers=headers, data=payload)
                     response.raise_for_status()  # Raise an error for bad status codes
                     result = response.json()
                     reply = result['data']
@@ -181,8 +315,12 @@ class Candidate(models.Model):
             else:
                 return False, None
         except requests.RequestException as e:
+            if raise_errors:
+                raise
             return False, None
         except Exception as e:
+            if raise_errors:
+                raise
             return False, None
 
 
@@ -199,6 +337,112 @@ class Candidate(models.Model):
     def __str__(self):
         return self.name
     
+class TNSLookup(models.Model):
+    """
+    Cached TNS status of a candidate, so that saving a candidate does not query TNS.
+    Refreshed in the background by the refresh_tns_lookup actor or the refresh_tns_lookups command.
+    """
+    candidate = models.OneToOneField(Candidate, on_delete=models.CASCADE, primary_key=True, related_name='tns_lookup')
+    ra = models.FloatField()  # Position the lookup was made for
+    dec = models.FloatField()
+    tns_name = models.CharField(max_length=100, null=True, blank=True)
+    reported_by_LAST = models.BooleanField(default=False)
+    checked_at = models.DateTimeField(db_index=True)
+
+    def is_fresh(self, ra, dec):
+        """
+        True if the lookup is younger than TNS_LOOKUP_TTL and was made for the given position.
+        """
+        return (self.checked_at >= now() - TNS_LOOKUP_TTL
+                and abs(self.ra - ra) < 1e-7 and abs(self.dec - dec) < 1e-7)
+
+    def __str__(self):
+        return f"{self.candidate_id} - {self.tns_name} ({self.checked_at})"
+
+
+class AtlasJob(models.Model):
+    """
+    ATLAS forced photometry request, queued by request_atlas_fp and run by the atlas_jobs manager command.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_SUBMITTED = 'submitted'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_SUBMITTED, 'Submitted'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name='atlas_jobs')
+    mjd_min = models.FloatField()  # Start of the requested photometry window
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    task_url = models.CharField(max_length=255, null=True, blank=True)  # ATLAS task, once submitted
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)  # Error of the last failed attempt
+    n_points = models.PositiveIntegerField(null=True, blank=True)  # Photometry points added
+    created_at = models.DateTimeField(auto_now_add=True)
+    submitted_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.candidate.name} - ATLAS from MJD {self.mjd_min:.1f} ({self.status})"
+
+
+class PhotometryWatermark(models.Model):
+    """
+    How far the forced photometry of a survey has been fetched for a candidate, so that refreshes
+    only request the epochs after the newest stored one (see fetch_window_start).
+    """
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name='photometry_watermarks')
+    survey = models.CharField(max_length=20)  # Telescope name of the stored photometry, e.g. ATLAS, ZTF
+    covered_from = models.DateTimeField()  # Earliest window start fetched so far
+    newest_epoch = models.DateTimeField(null=True, blank=True)  # Newest stored epoch of the survey
+    fetched_at = models.DateTimeField()  # Time of the last successful fetch
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['candidate', 'survey'], name='unique_candidate_survey_watermark'),
+        ]
+
+    def __str__(self):
+        return f"{self.candidate.name} - {self.survey} up to {self.newest_epoch} (fetched {self.fetched_at})"
+
+
+class TNSObject(models.Model):
+    """
+    Local mirror of the TNS public objects catalog, loaded by the sync_tns_catalog command.
+    """
+    name = models.CharField(max_length=20, unique=True)  # Without prefix, e.g. 2024abc
+    name_prefix = models.CharField(max_length=10, null=True, blank=True)  # AT, SN, ...
+    ra = models.FloatField()
+    dec = models.FloatField()
+    healpix = models.BigIntegerField(db_index=True)  # Nested HEALPix index of (ra, dec), for cone searches
+    redshift = models.FloatField(null=True, blank=True)
+    type = models.CharField(max_length=50, null=True, blank=True)
+    reporting_group = models.CharField(max_length=100, null=True, blank=True)
+    source_group = models.CharField(max_length=100, null=True, blank=True)
+    internal_names = models.TextField(null=True, blank=True)
+    discovery_date = models.DateTimeField(null=True, blank=True)
+    last_modified = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name_prefix or ''} {self.name}".strip()
+
+
+class TNSCatalogSnapshot(models.Model):
+    """
+    A load of the TNS public objects catalog. Objects reported after taken_at are not in the mirror.
+    """
+    taken_at = models.DateTimeField(db_index=True)  # Time the TNS export was made
+    loaded_at = models.DateTimeField(auto_now_add=True)
+    n_objects = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"TNS snapshot {self.taken_at} ({self.n_objects} objects)"
+
+
 class CandidatePhotometry(models.Model):
     candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name="photometry")
     obs_date = models.DateTimeField()  # Observation date
@@ -210,6 +454,13 @@ class CandidatePhotometry(models.Model):
     limit = models.FloatField(null=True, blank=True)  # Magnitude limit (if no detection)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # Repeated alerts and forced photometry requests resend the same points
+            models.UniqueConstraint(fields=['candidate', 'telescope', 'filter_band', 'obs_date'],
+                                    name='unique_candidate_photometry_point'),
+        ]
+
     def __str__(self):
         return f"{self.candidate.name} - {self.obs_date} - {self.filter_band}"
 
@@ -284,4 +535,86 @@ class CandidateAlert(models.Model):
     diff_cutout_filename = models.CharField(max_length=255, null=True, blank=True)
     
     def __str__(self):
-        return self.candidate.name
\ No newline at end of file
+        return self.candidate.name
+
+
+class TargetHealpix(models.Model):
+    """
+    HEALPix index of a TOM Target, kept in a side table since the Target model belongs to tom_targets.
+    Maintained by the post_save receiver below. Target.objects.update() and bulk_create() don't send post_save,
+    so call sync_target_healpix() after changing target coordinates in bulk.
+    """
+    target = models.OneToOneField(BaseTarget, on_delete=models.CASCADE, primary_key=True, related_name='healpix_index')
+    healpix = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f"{self.target.name} - {self.healpix}"
+
+
+# Receiver to keep the HEALPix index of a Target in step with its coordinates. Connected in
+# CandidatesConfig.ready() to the configured Target class only (settings.TARGET_MODEL_CLASS).
+def update_target_healpix(sender, instance, raw=False, **kwargs):
+    """
+    Creates or updates the TargetHealpix row whenever a (sidereal) Target is saved.
+    """
+    if raw or not isinstance(instance, BaseTarget):
+        return
+    if instance.ra is None or instance.dec is None:
+        TargetHealpix.objects.filter(target_id=instance.pk).delete()
+        return
+    TargetHealpix.objects.update_or_create(
+        target_id=instance.pk,
+        defaults={'healpix': int(healpix_index(instance.ra, instance.dec))},
+    )
+
+
+def sync_target_healpix(target_ids=None):
+    """
+    Recomputes the TargetHealpix rows of targets, e.g. after a bulk update of their coordinates.
+    :param target_ids: Ids of the targets, all targets if None
+    :return: The number of targets indexed
+    """
+    targets = BaseTarget.objects.all() if target_ids is None else BaseTarget.objects.filter(id__in=target_ids)
+    rows = list(targets.values_list('id', 'ra', 'dec'))
+    indexed = [(target_id, ra, dec) for target_id, ra, dec in rows if ra is not None and dec is not None]
+    with transaction.atomic():
+        TargetHealpix.objects.filter(target_id__in=[row[0] for row in rows]).delete()
+        if indexed:
+            ids, ras, decs = zip(*indexed)
+            TargetHealpix.objects.bulk_create(
+                [TargetHealpix(target_id=target_id, healpix=int(pixel))
+                 for target_id, pixel in zip(ids, healpix_index(ras, decs))],
+                batch_size=1000,
+            )
+    return len(indexed)
+
+
+class IngestedFile(models.Model):
+    """
+    Ledger of the alert JSON files seen by the ingestion, used to find new files and to retry failed ones.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    filename = models.CharField(max_length=255, unique=True)  # Base name of the json file
+    size = models.BigIntegerField(null=True, blank=True)  # Bytes
+    mtime = models.DateTimeField(null=True, blank=True)  # Modification time of the file
+    content_hash = models.CharField(max_length=64, null=True, blank=True)  # sha256 hex digest
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)  # Error of the last failed attempt
+    stage_timings = models.JSONField(default=dict, blank=True)  # Seconds spent in each ingestion stage
+    candidate = models.ForeignKey(Candidate, on_delete=models.SET_NULL, null=True, blank=True, related_name='ingested_files')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.status})"
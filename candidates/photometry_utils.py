@@ -1,27 +1,25 @@
 # Built-in imports
 import io
-import re
-import requests
-import time
-import traceback
-from datetime import datetime, timedelta
-from types import SimpleNamespace
+from datetime import timedelta
+from functools import lru_cache
 
 # Third-party imports
 import numpy as np
 import pandas as pd
-import plotly.graph_objs as go
 from astropy.time import Time
 from lasair import lasair_client
 from plotly.colors import hex_to_rgb
 
 # Django imports
 from django.conf import settings
-from django.utils.safestring import mark_safe
-from django.utils.timezone import make_aware, now
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from django.utils.timezone import now
 
 # Local imports
-from .models import CandidatePhotometry
+from .models import AtlasJob, Candidate, CandidatePhotometry, PhotometryWatermark
+from .time_utils import jd_to_datetime, mjd_to_datetime
 
 # Logging
 import logging
@@ -31,25 +29,144 @@ logger = logging.getLogger(__name__)
 ATLAS_BASEURL = "https://fallingstar-data.com/forcedphot"
 LASAIR_ENDPOINT = "https://lasair-ztf.lsst.ac.uk/api"
 LASAIR_CONE_RADIUS = 5.0  # arcseconds
+LASAIR_LIGHTCURVES_BATCH = 50  # Objects per lightcurves call
+FETCH_OVERLAP = timedelta(days=1)  # Refetched before the newest stored epoch, for epochs processed late
 
+# Light curves are cached until the photometry or the distance of the candidate changes.
+# Times are absolute (MJD) and days-ago is computed in the browser, so the timeout only bounds memory use.
+LIGHT_CURVE_CACHE_TIMEOUT = getattr(settings, 'LIGHT_CURVE_CACHE_TIMEOUT', 7 * 24 * 3600)
 
-def photometry_exists(candidate, obs_date, magnitude, magnitude_error, filter_band='clear'):
+LIGHT_CURVE_COLORS = {'LAST_clear': '#636efa',
+                      'ATLAS_o': '#FFA500', 'ATLAS_c': '#2aa198',
+                      'ZTF_g': '#008000', 'ZTF_r': '#FF0000',}
+LIGHT_CURVE_DEFAULT_COLOR = '#77807f'  # some shade of grey
+TELESCOPE_LEGEND_RANK = {'LAST': 1, 'ZTF': 2, 'ATLAS': 3}
+UNIX_EPOCH_MJD = 40587.0
+
+
+def select_new_points(incoming, existing, tolerance=5):
+    """
+    Select the incoming photometry points that are not in the database yet. A point is a duplicate if it has the same
+    band as an existing point and is within `tolerance` seconds of it, whatever its magnitude, so that the selection
+    agrees with the (candidate, telescope, filter_band, obs_date) unique constraint. Of several incoming points with
+    the same band and obs_date, the first one is kept.
+    :param incoming: DataFrame with at least the columns obs_date (UTC datetimes) and filter_band
+    :param existing: DataFrame of the existing points, with the same two columns
+    :param tolerance: Time tolerance in seconds for matching existing points
+    :return: The new rows of incoming
     """
-    Check if a photometry entry already exists for a given candidate, observation date, magnitude, and filter.
+    incoming = incoming.drop_duplicates(subset=['filter_band', 'obs_date']).reset_index(drop=True)
+    keep = np.ones(len(incoming), dtype=bool)
+    if existing.empty:
+        return incoming
+
+    existing_times = pd.to_datetime(existing['obs_date'], utc=True).to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+    existing_bands = existing['filter_band'].to_numpy()
+    times = incoming['obs_date'].to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+    for band, idx in incoming.groupby('filter_band').indices.items():
+        existing_t = np.sort(existing_times[existing_bands == band])
+        # Existing points within the tolerance of each incoming point are existing_t[lo:hi]
+        lo = np.searchsorted(existing_t, times[idx] - tolerance, side='left')
+        hi = np.searchsorted(existing_t, times[idx] + tolerance, side='right')
+        keep[idx] = hi == lo
+    return incoming[keep]
+
+
+def bulk_add_photometry(candidate, telescope, obs_dates, filter_bands, magnitudes, magnitude_errors, limits,
+                        instrument=None, tolerance=5):
     """
-    obs_date = make_aware(obs_date)
-    query = CandidatePhotometry.objects.filter(
-        candidate=candidate,
-        obs_date__gte=obs_date - timedelta(seconds=5),  # Allowing 5s tolerance
-        obs_date__lte=obs_date + timedelta(seconds=5),
-        filter_band=filter_band
+    Add a batch of photometry points for a candidate, skipping the ones that already exist.
+    The existing points of the candidate for the telescope/bands are fetched once, and the incoming points within
+    `tolerance` seconds of an existing point of the same band are skipped (see select_new_points).
+    Only new points are written, with one bulk_create (see insert_photometry_points).
+    :param candidate: Candidate instance
+    :param telescope: Telescope name
+    :param obs_dates: Sequence of timezone-aware observation datetimes
+    :param filter_bands: Sequence of filter bands, or a single band for all points
+    :param magnitudes: Sequence of magnitudes, None/NaN for non-detections
+    :param magnitude_errors: Sequence of magnitude errors, None/NaN for non-detections
+    :param limits: Sequence of magnitude limits, None/NaN for detections
+    :param instrument: Instrument name
+    :param tolerance: Time tolerance in seconds for matching existing points
+    :return: The number of points added
+    """
+    n = len(obs_dates)
+    if n == 0:
+        return 0
+    if isinstance(filter_bands, str):
+        filter_bands = [filter_bands] * n
+
+    incoming = pd.DataFrame({
+        'obs_date': pd.to_datetime(pd.Series(list(obs_dates)), utc=True),
+        'filter_band': [str(band) for band in filter_bands],
+        'magnitude': pd.to_numeric(pd.Series(list(magnitudes), dtype=object), errors='coerce'),
+        'magnitude_error': pd.to_numeric(pd.Series(list(magnitude_errors), dtype=object), errors='coerce'),
+        'limit': pd.to_numeric(pd.Series(list(limits), dtype=object), errors='coerce'),
+    })
+
+    # Only the existing points in the time range of the batch can be duplicates
+    margin = timedelta(seconds=tolerance)
+    batch_points = CandidatePhotometry.objects.filter(
+        candidate=candidate, telescope=telescope, filter_band__in=incoming['filter_band'].unique().tolist(),
+        obs_date__gte=incoming['obs_date'].min().to_pydatetime() - margin,
+        obs_date__lte=incoming['obs_date'].max().to_pydatetime() + margin,
     )
+    existing = pd.DataFrame(list(batch_points.values_list('obs_date', 'filter_band')),
+                            columns=['obs_date', 'filter_band'])
 
-    # Check for both magnitude and magnitude error if it’s a detection
-    if magnitude is not None:
-        query = query.filter(magnitude=magnitude, magnitude_error=magnitude_error)
-    
-    return query.exists()
+    new_points = select_new_points(incoming, existing, tolerance)
+    if new_points.empty:
+        return 0
+
+    def nullable(value):
+        return None if pd.isna(value) else float(value)
+
+    n_added = insert_photometry_points([
+        CandidatePhotometry(
+            candidate=candidate,
+            obs_date=point.obs_date.to_pydatetime(),
+            magnitude=nullable(point.magnitude),  # Null if non-detection
+            magnitude_error=nullable(point.magnitude_error),
+            limit=nullable(point.limit),
+            filter_band=point.filter_band,
+            telescope=telescope,
+            instrument=instrument,
+        )
+        for point in new_points.itertuples(index=False)
+    ])
+    if n_added:
+        invalidate_light_curve(candidate.id)
+    logger.info(f"Added {n_added} {telescope} photometry points for {candidate.name} "
+                f"({len(incoming) - n_added} already existed).")
+    return n_added
+
+
+def insert_photometry_points(points):
+    """
+    Insert new CandidatePhotometry rows with one bulk_create. If a point violates the unique constraint, e.g. because
+    another process wrote it since the existing points were read, the points are inserted one by one instead and
+    the conflicting ones are skipped, so that only the rows inserted here are counted.
+    :param points: List of unsaved CandidatePhotometry instances
+    :return: The number of rows inserted
+    """
+    try:
+        with transaction.atomic():
+            CandidatePhotometry.objects.bulk_create(points)
+        return len(points)
+    except IntegrityError:
+        pass
+
+    inserted = 0
+    for point in points:
+        point.pk = None
+        point._state.adding = True
+        try:
+            with transaction.atomic():
+                point.save(force_insert=True)
+            inserted += 1
+        except IntegrityError:
+            logger.debug(f"Skipping {point.telescope} {point.filter_band} point at {point.obs_date}, already written.")
+    return inserted
 
 
 def add_photometry_from_last_report(candidate,last_report):
@@ -58,367 +175,404 @@ def add_photometry_from_last_report(candidate,last_report):
     :param candidate: Candidate instance
     :param last_report: last report section from the json file
     """
-    detections_jd = np.array(last_report.get('detections_jd', {}))
-    detections = last_report.get('detections_mag', {})
-    detections_magerr = last_report.get('detections_magerr', {})
-    nondetections_jd = last_report.get('nondetections_jd', {})
-    nondetections_mag = last_report.get('nondetections_mag', {})
-    for i, jd in enumerate(detections_jd):
-        obs_date = Time(jd,format='jd').to_datetime()
-        magnitude = detections[i]
-        magnitude_error = detections_magerr[i]
-        if not photometry_exists(candidate, obs_date, magnitude, magnitude_error):
-            CandidatePhotometry.objects.create(
-                candidate=candidate,
-                obs_date=obs_date,
-                magnitude=magnitude,
-                magnitude_error=magnitude_error,
-                filter_band='clear',
-                telescope="LAST",
-                instrument="LAST-CAM"
-            )
-        else:
-            print("photometry exists")
-
-    for i, jd in enumerate(nondetections_jd):
-        obs_date = Time(jd,format='jd')
-        magnitude = nondetections_mag[i]
-        CandidatePhotometry.objects.create(
-            candidate=candidate,
-            obs_date=obs_date.iso,
-            limit = magnitude,
-            filter_band='clear',  # Use a mapping if needed to human-readable filter names
-            telescope="LAST",
-            instrument="LAST-CAM"
-            )
+    detections_jd = np.array(last_report.get('detections_jd', []), dtype=float)
+    detections = last_report.get('detections_mag', [])
+    detections_magerr = last_report.get('detections_magerr', [])
+    nondetections_jd = np.array(last_report.get('nondetections_jd', []), dtype=float)
+    nondetections_mag = last_report.get('nondetections_mag', [])
+
+    n_det = len(detections_jd)
+    n_nondet = len(nondetections_jd)
+    jd = np.concatenate([detections_jd, nondetections_jd])
+    obs_dates = jd_to_datetime(jd)
+
+    bulk_add_photometry(
+        candidate, "LAST", obs_dates, 'clear',
+        magnitudes=list(detections[:n_det]) + [None] * n_nondet,
+        magnitude_errors=list(detections_magerr[:n_det]) + [None] * n_nondet,
+        limits=[None] * n_det + list(nondetections_mag[:n_nondet]),
+        instrument="LAST-CAM",
+    )
+
+
+def fetch_window_start(candidate, survey, days_ago):
+    """
+    Start of the forced photometry window to request from a survey.
+    If earlier fetches already cover the last `days_ago` days, only the epochs after the newest stored one
+    (minus FETCH_OVERLAP, for late processed epochs) are requested. Otherwise the full window is requested.
+    :param candidate: Candidate instance
+    :param survey: Telescope name of the survey photometry, e.g. ATLAS, ZTF
+    :param days_ago: Number of days ago of the requested window
+    :return: Timezone-aware datetime
+    """
+    window_start = now() - timedelta(days=days_ago)
+    watermark = PhotometryWatermark.objects.filter(candidate=candidate, survey=survey).first()
+    if watermark is None or watermark.covered_from > window_start:
+        return window_start
+    reference = watermark.newest_epoch or watermark.fetched_at
+    return max(window_start, reference - FETCH_OVERLAP)
 
 
-def get_atlas_fp(candidate, days_ago=10):
+def record_photometry_fetch(candidate, survey, window_start, fetched_at=None):
+    """
+    Update the fetch watermark of a survey for a candidate after a successful fetch starting at window_start.
+    """
+    fetched_at = fetched_at or now()
+    newest_epoch = CandidatePhotometry.objects.filter(
+        candidate=candidate, telescope=survey).aggregate(newest=Max('obs_date'))['newest']
+    watermark, created = PhotometryWatermark.objects.get_or_create(
+        candidate=candidate, survey=survey,
+        defaults={'covered_from': window_start, 'newest_epoch': newest_epoch, 'fetched_at': fetched_at})
+    if not created:
+        watermark.covered_from = min(watermark.covered_from, window_start)
+        watermark.newest_epoch = newest_epoch
+        watermark.fetched_at = max(watermark.fetched_at, fetched_at)
+        watermark.save(update_fields=['covered_from', 'newest_epoch', 'fetched_at'])
+    return watermark
+
+
+def request_atlas_fp(candidate, days_ago=10):
     """
-    Query the ATLAS API for force-photometry data.
+    Request ATLAS forced photometry for a candidate. Only queues a job and returns immediately,
+    the atlas_jobs manager command submits it and adds the photometry once ATLAS is done.
+    Only the epochs not fetched yet are requested (see fetch_window_start).
     :param candidate: candidate instance
     :param days_ago: Number of days ago for force photometry. Default is 10 days.
-    :return: None
+    :return: The AtlasJob covering the request
     """
-    
-    atlas_settings = settings.BROKERS.get('ATLAS', {})
-    username = atlas_settings.get('user_name')
-    password = atlas_settings.get('password')
-    if not username or not password:
-        logger.error("ATLAS API credentials not set.")
-        return None
+    mjd_min = Time(fetch_window_start(candidate, "ATLAS", days_ago)).mjd
+    job = (AtlasJob.objects.filter(candidate=candidate, status__in=[AtlasJob.STATUS_QUEUED, AtlasJob.STATUS_SUBMITTED])
+           .order_by('-created_at').first())
+    if job and job.mjd_min <= mjd_min:
+        return job  # An outstanding job already covers this window
+    if job and job.status == AtlasJob.STATUS_QUEUED:
+        job.mjd_min = mjd_min
+        job.save(update_fields=['mjd_min'])
+        return job
+    job = AtlasJob.objects.create(candidate=candidate, mjd_min=mjd_min)
+    logger.info(f"Queued ATLAS forced photometry for {candidate.name} from MJD {mjd_min:.2f}")
+    return job
+
+
+def add_atlas_photometry(candidate, textdata):
+    """
+    Add the photometry of an ATLAS forced photometry result file.
+    :param candidate: candidate instance
+    :param textdata: Content of the ATLAS result file
+    :return: The number of points added
+    """
+    dfresult = pd.read_csv(io.StringIO(textdata.replace("###", "")), sep=r"\s+")
 
-    try:
-        resp = requests.post(url=f"{ATLAS_BASEURL}/api-token-auth/",
-                             data={'username': {username}, 'password': {password}})
-
-        if resp.status_code == 200:
-            token = resp.json()['token']
-            headers = {'Authorization': f'Token {token}', 'Accept': 'application/json'}
-        else:
-            logger.error(f'ERROR {resp.status_code}')
-            logger.error(resp.json())
-            
-        task_url = None
-        while not task_url:
-            with requests.Session() as s:
-                resp = s.post(f"{ATLAS_BASEURL}/queue/", headers=headers,
-                              data={'ra': {str(candidate.ra)}, 'dec': {str(candidate.dec)},
-                                    'mjd_min': {Time(now()).mjd-days_ago}, 'send_email': False})
-
-                if resp.status_code == 201:  # successfully queued
-                    task_url = resp.json()['url']
-                    logger.info(f'Getting ATLAS photometry for {candidate.name}')
-                    logger.debug(f'The task URL is {task_url}')
-                elif resp.status_code == 429:  # throttled
-                    message = resp.json()["detail"]
-                    logger.debug(f'{resp.status_code} {message}')
-                    t_sec = re.findall(r'available in (\d+) seconds', message)
-                    t_min = re.findall(r'available in (\d+) minutes', message)
-                    if t_sec:
-                        waittime = int(t_sec[0])
-                    elif t_min:
-                        waittime = int(t_min[0]) * 60
-                    else:
-                        waittime = 10
-                    logger.debug(f'Waiting {waittime} seconds')
-                    time.sleep(waittime)
-                else:
-                    logger.error(f'ERROR {resp.status_code}')
-                    logger.error(resp.json())
-
-        result_url = None
-        while not result_url:
-            with requests.Session() as s:
-                resp = s.get(task_url, headers=headers)
-
-                if resp.status_code == 200:  # HTTP OK
-                    if resp.json()['finishtimestamp']:
-                        result_url = resp.json()['result_url']
-                        logger.info(f"Task is complete with results available at {result_url}")
-                        break
-                    elif resp.json()['starttimestamp']:
-                        logger.debug(f"Task is running (started at {resp.json()['starttimestamp']})")
-                    else:
-                        logger.debug("Waiting for job to start. Checking again in 10 seconds...")
-                    time.sleep(10)
-                else:
-                    logger.error(f'ERROR {resp.status_code}')
-                    logger.error(resp.json())
-                    # sys.exit()
-
-        with requests.Session() as s:
-            textdata = s.get(result_url, headers=headers).text
-
-        dfresult = pd.read_csv(io.StringIO(textdata.replace("###", "")), sep=r"\s+")
-
-        SNT = 5.
-
-        for obs in dfresult.iloc:
-            obs_date = Time(obs.MJD,format='mjd').to_datetime()
-            if obs.uJy/obs.duJy >= SNT:
-                magnitude = obs.m  # Detection
-                magnitude_error = obs.dm
-                limit = None
-            else:
-                magnitude = None  # Non detection
-                limit = obs.mag5sig
-                magnitude_error = None
-            
-            if not photometry_exists(candidate, obs_date, magnitude,
-                                     magnitude_error, filter_band=obs.F):
-                CandidatePhotometry.objects.create(
-                    candidate=candidate,
-                    obs_date=make_aware(obs_date),
-                    magnitude=magnitude,  # Null if non-detection
-                    magnitude_error=magnitude_error,
-                    filter_band=obs.F,  # Use a mapping if needed to human-readable filter names
-                    telescope="ATLAS",
-                    limit=limit
-                )
-    except requests.RequestException as e:
-        logger.error(f"Error querying ATLAS API: {e}")
-        return None
-    
-    except Exception as e:
-        logger.error(f"Error querying ATLAS API: {e}")
-        traceback.print_exc()
-        return None
-    logger.info("ATLAS photometry data retrieval complete.")
+    SNT = 5.
 
-def get_ztf_fp(candidate, days_ago=10):
+    detection = (dfresult.uJy / dfresult.duJy >= SNT).to_numpy()
+    obs_dates = mjd_to_datetime(dfresult.MJD.to_numpy(dtype=float))
+    return bulk_add_photometry(
+        candidate, "ATLAS", obs_dates, dfresult.F.astype(str).tolist(),
+        magnitudes=np.where(detection, dfresult.m, np.nan),  # Null if non-detection
+        magnitude_errors=np.where(detection, dfresult.dm, np.nan),
+        limits=np.where(detection, np.nan, dfresult.mag5sig),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_lasair_client():
     """
-    Get the ZTF forced photometry for a candidate.
+    Lasair API client, created once per process.
     """
-    logger.info(f"Getting ZTF photometry for {candidate.name}")
-    lasair_settings = settings.BROKERS.get('LASAIR', {})
-    api_token = lasair_settings.get('api_token')
+    api_token = settings.BROKERS.get('LASAIR', {}).get('api_token')
     if not api_token:
         logger.error("LASAIR API credentials not set.")
         raise ValueError("LASAIR API credentials not set.")
-    L = lasair_client(lasair_settings['api_token'], endpoint=LASAIR_ENDPOINT)
+    return lasair_client(api_token, endpoint=LASAIR_ENDPOINT)
+
 
+def find_ztf_object(candidate, L=None):
+    """
+    ZTF objectId of a candidate. The cone search is only made until a match is found,
+    the association is then stored in candidate.ztf_object_id.
+    :param candidate: Candidate instance
+    :param L: Lasair client, get_lasair_client() by default
+    :return: The objectId, or None if there is no ZTF object at the position of the candidate
+    """
+    if candidate.ztf_object_id:
+        return candidate.ztf_object_id
+    L = L or get_lasair_client()
     result = L.cone(ra=candidate.ra, dec=candidate.dec,
                     radius=LASAIR_CONE_RADIUS, requestType='nearest')
-    if 'object' in result:
-        logger.info(f"Found {result['object']} at separation {result['separation']:.2f} with radius {LASAIR_CONE_RADIUS}")
-    else:
-        logger.info('No object found at radius %f' % LASAIR_CONE_RADIUS)
+    if 'object' not in result:
+        logger.info(f"No ZTF object found for {candidate.name} at radius {LASAIR_CONE_RADIUS}")
         return None
-    
-    object_id = result['object']
-    lcs = L.lightcurves([object_id])
-    dfresult = pd.DataFrame(lcs[0]['candidates']) 
-    dfresult = dfresult[dfresult['jd'] > Time.now().jd - days_ago]
-
-    for obs in dfresult.iloc:
-        obs_date = Time(obs.jd,format='jd').to_datetime()
-        filter_band = 'g' if obs.fid ==1 else 'r'  # fid=1 green, fid=2 red
-        if not pd.isna(obs.candid):
-            magnitude = obs.magpsf  # Detection
-            magnitude_error = obs.sigmapsf
-            limit = None
-        else:
-            magnitude = None  # Non detection
-            limit = obs.diffmaglim
-            magnitude_error = None
-        
-        if not photometry_exists(candidate, obs_date, magnitude,
-                                 magnitude_error, filter_band=filter_band):
-            CandidatePhotometry.objects.create(
-                candidate=candidate,
-                obs_date=make_aware(obs_date),
-                magnitude=magnitude,  # Null if non-detection
-                magnitude_error=magnitude_error,
-                filter_band=filter_band,
-                telescope="ZTF",
-                limit=limit
-            )
-
-
-def generate_photometry_graph(candidate):
-    """
-    Generate a photometry graph for a candidate using Plotly, showing days ago on the x-axis (reversed).
-    :param candidate: Candidate instance
-    :return: Safe HTML string for Plotly graph or None if no photometry exists
+    logger.info(f"Found {result['object']} at separation {result['separation']:.2f} with radius {LASAIR_CONE_RADIUS}")
+    candidate.ztf_object_id = result['object']
+    # update() rather than save(), which would also refresh the TNS status
+    Candidate.objects.filter(id=candidate.id).update(ztf_object_id=candidate.ztf_object_id)
+    return candidate.ztf_object_id
+
+
+def ztf_photometry_frame(object_ids, lightcurves):
+    """
+    Convert Lasair light curves to one DataFrame of photometry points, with columns object_id, jd, obs_date,
+    filter_band, magnitude, magnitude_error and limit (NaN where not applicable).
+    :param object_ids: Requested objectIds, in the order of lightcurves
+    :param lightcurves: Result of lasair_client.lightcurves(object_ids)
     """
-    # Get photometry data for the candidate
+    frames = [pd.DataFrame(lc.get('candidates') or []).assign(object_id=lc.get('objectId', object_id))
+              for object_id, lc in zip(object_ids, lightcurves)]
+    columns = ['object_id', 'jd', 'fid', 'candid', 'magpsf', 'sigmapsf', 'diffmaglim']
+    raw = pd.concat(frames, ignore_index=True).reindex(columns=columns) if frames else pd.DataFrame(columns=columns)
+
+    detection = raw['candid'].notna().to_numpy()  # Non-detections have no candid
+    jd = raw['jd'].to_numpy(dtype=float)
+    return pd.DataFrame({
+        'object_id': raw['object_id'].to_numpy(),
+        'jd': jd,
+        'obs_date': jd_to_datetime(jd),
+        'filter_band': np.where(raw['fid'].to_numpy() == 1, 'g', 'r'),  # fid=1 green, fid=2 red
+        'magnitude': np.where(detection, raw['magpsf'].to_numpy(dtype=float), np.nan),  # Null if non-detection
+        'magnitude_error': np.where(detection, raw['sigmapsf'].to_numpy(dtype=float), np.nan),
+        'limit': np.where(detection, np.nan, raw['diffmaglim'].to_numpy(dtype=float)),
+    })
+
+
+def add_ztf_photometry(candidate, points, window_start):
+    """
+    Add the ZTF points (rows of ztf_photometry_frame) after window_start, and update the ZTF fetch watermark.
+    :return: The number of points added
+    """
+    points = points[points['jd'] > Time(window_start).jd]
+    n_added = bulk_add_photometry(
+        candidate, "ZTF", points['obs_date'], points['filter_band'],
+        magnitudes=points['magnitude'], magnitude_errors=points['magnitude_error'], limits=points['limit'],
+    )
+    record_photometry_fetch(candidate, "ZTF", window_start)
+    return n_added
 
-    photometry = CandidatePhotometry.objects.filter(candidate=candidate).order_by('obs_date')
 
-    if not photometry.exists():
-        return None  # If no photometry data, return None
+def get_ztf_fp(candidate, days_ago=10):
+    """
+    Get the ZTF forced photometry for a candidate.
+    Only the epochs not fetched yet are added (see fetch_window_start). Lasair has no time filter on light curves,
+    so the full history is still downloaded and the window is applied here.
+    """
+    logger.info(f"Getting ZTF photometry for {candidate.name}")
+    L = get_lasair_client()
+    object_id = find_ztf_object(candidate, L)
+    if object_id is None:
+        return None
+
+    window_start = fetch_window_start(candidate, "ZTF", days_ago)
+    points = ztf_photometry_frame([object_id], L.lightcurves([object_id]))
+    return add_ztf_photometry(candidate, points, window_start)
 
-    # Get the current timezone-aware datetime
-    today = now()
 
-    # Get unique telescope and filter_band pairs
-    telescope_band_pairs = set(
-        (telescope, band)
-        for telescope in photometry.values_list('telescope', flat=True).distinct()
-        for band in photometry.filter(telescope=telescope).values_list('filter_band', flat=True).distinct()
+def refresh_ztf_photometry(candidates, days_ago=10, batch_size=LASAIR_LIGHTCURVES_BATCH):
+    """
+    Get the ZTF forced photometry for many candidates, with one Lasair lightcurves call per batch of objects.
+    Cone searches are only made for candidates without a stored ZTF objectId.
+    :param candidates: Iterable of Candidate instances
+    :param days_ago: Number of days ago for force photometry. Default is 10 days.
+    :param batch_size: Number of objects per lightcurves call
+    :return: The number of points added
+    """
+    L = get_lasair_client()
+    by_object = {}
+    for candidate in candidates:
+        try:
+            object_id = find_ztf_object(candidate, L)
+        except Exception as e:
+            logger.error(f"Error searching ZTF object of {candidate.name}: {e}")
+            continue
+        if object_id:
+            by_object.setdefault(object_id, []).append(candidate)
+
+    object_ids = list(by_object)
+    n_added = 0
+    for i in range(0, len(object_ids), batch_size):
+        batch = object_ids[i:i + batch_size]
+        try:
+            points = ztf_photometry_frame(batch, L.lightcurves(batch))
+        except Exception as e:
+            logger.error(f"Error fetching ZTF light curves of {len(batch)} objects: {e}")
+            continue
+        for object_id, object_points in points.groupby('object_id', sort=False):
+            for candidate in by_object.get(object_id, []):
+                window_start = fetch_window_start(candidate, "ZTF", days_ago)
+                n_added += add_ztf_photometry(candidate, object_points, window_start)
+    logger.info(f"Added {n_added} ZTF photometry points for {len(object_ids)} objects "
+                f"with {-(-len(object_ids) // batch_size)} lightcurves calls.")
+    return n_added
+
+
+PHOTOMETRY_COLUMNS = ('obs_time', 'magnitude', 'magnitude_error', 'limit')
+
+
+def fetch_light_curve(candidate, max_time_diff=0.1):
+    """
+    Fetch the photometry of a candidate with a single query, split per (telescope, filter_band) into
+    detections and non-detections, each also binned in time.
+    Every set of points is a dict of numpy arrays (see PHOTOMETRY_COLUMNS), with obs_time in unix seconds
+    and NaN for missing values.
+    :param candidate: Candidate instance
+    :param max_time_diff: Maximum time difference (in days) to bin points together
+    :return: List of dicts with keys telescope, filter_band, detections, non_detections, binned_detections
+             and binned_non_detections, in order of first observation. Empty if no photometry exists.
+    """
+    rows = list(
+        CandidatePhotometry.objects.filter(candidate=candidate).order_by('obs_date').values_list(
+            'telescope', 'filter_band', 'obs_date', 'magnitude', 'magnitude_error', 'limit'
+        )
     )
+    if not rows:
+        return []
+
+    telescopes, filter_bands, obs_dates, magnitudes, magnitude_errors, limits = zip(*rows)
+    points = {
+        'obs_time': pd.to_datetime(list(obs_dates), utc=True).to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9,
+        'magnitude': np.array(magnitudes, dtype=float),
+        'magnitude_error': np.array(magnitude_errors, dtype=float),
+        'limit': np.array(limits, dtype=float),
+    }
+
+    # Group by (telescope, filter_band), keeping the obs_date order inside each group
+    keys = np.char.add(np.char.add(np.array(telescopes, dtype=str), '\x1f'), np.array(filter_bands, dtype=str))
+    _, first_index, group_of = np.unique(keys, return_index=True, return_inverse=True)
+    group_of = group_of.ravel()
+
+    light_curve = []
+    for group in np.argsort(first_index):
+        idx = np.flatnonzero(group_of == group)
+        detected = ~np.isnan(points['magnitude'][idx])
+        detections = {column: values[idx[detected]] for column, values in points.items()}
+        non_detections = {column: values[idx[~detected]] for column, values in points.items()}
+        light_curve.append({
+            'telescope': telescopes[idx[0]],
+            'filter_band': filter_bands[idx[0]],
+            'detections': detections,
+            'non_detections': non_detections,
+            'binned_detections': bin_photometry_points(detections, max_time_diff),
+            'binned_non_detections': bin_photometry_points(non_detections, max_time_diff),
+        })
+    return light_curve
+
+
+def light_curve_cache_key(candidate_id):
+    return f'candidates:light_curve_json:{candidate_id}'
+
+
+def invalidate_light_curve(candidate_id):
+    """
+    Drop the cached light curve of a candidate. Called by the photometry writers.
+    """
+    cache.delete(light_curve_cache_key(candidate_id))
 
-    # Create the Plotly graph
-    fig = go.Figure()
 
-    name2color = {'LAST_clear': '#636efa',
-                  'ATLAS_o': '#FFA500', 'ATLAS_c': '#2aa198',
-                  'ZTF_g': '#008000', 'ZTF_r': '#FF0000',}
-    
-    tel2rank = {'LAST': 1, 'ZTF': 2, 'ATLAS': 3}
+def photometry_versions(candidate_ids):
+    """
+    Photometry version of each candidate, as (number of points, highest point id), in one query.
+    Candidates without photometry are not in the returned dict.
+    """
+    rows = (CandidatePhotometry.objects.filter(candidate_id__in=candidate_ids)
+            .values('candidate_id').annotate(n_points=Count('id'), last_id=Max('id'))
+            .values_list('candidate_id', 'n_points', 'last_id'))
+    return {candidate_id: (n_points, last_id) for candidate_id, n_points, last_id in rows}
 
-    # distance_modulus = None
-    if candidate.dist_Mpc:
-        distance_modulus = 5 * (np.log10(candidate.dist_Mpc * 1e6) - 1)
-    
-    for telescope, filter_band in telescope_band_pairs:
-        
-        filtered_photometry = photometry.filter(telescope=telescope, filter_band=filter_band)
-        
-        # Separate detections (magnitude is not empty) and non-detections (magnitude is empty)
-        detections = filtered_photometry.exclude(magnitude__isnull=True).order_by('obs_date')
-        non_detections = filtered_photometry.filter(magnitude__isnull=True).order_by('obs_date')
-
-        binned_detections = bin_photometry_points(detections)
-        binned_non_detections = bin_photometry_points(non_detections)
-
-        
-        # Prepare data for original detections
-        original_detection_days_ago = [(today - p.obs_date).total_seconds() / (24 * 3600) for p in detections]
-        original_detection_magnitudes = [p.magnitude for p in detections]
-        original_detection_errors = [p.magnitude_error for p in detections]
-        
-        # Prepare data for detections
-        detection_days_ago = [(today - p.obs_date).total_seconds() / (24 * 3600) for p in binned_detections]
-        detection_magnitudes = [p.magnitude for p in binned_detections]
-        detection_errors = [p.magnitude_error for p in binned_detections]
-     
-        # Prepare data for original non-detections
-        original_non_detection_days_ago = [(today - p.obs_date).total_seconds() / (24 * 3600) for p in non_detections]
-        original_non_detection_limits = [p.limit for p in non_detections]
-
-        # Prepare data for binned non-detections
-        non_detection_days_ago = [(today - p.obs_date).total_seconds() / (24 * 3600) for p in binned_non_detections]
-        non_detection_limits = [p.limit for p in binned_non_detections]
-
-        # Add detections as scatter points with error bars
-        color = name2color.get(f"{telescope}_{filter_band}", '#77807f') # some shade of grey
-        fig.add_trace(go.Scatter(
-            x=original_detection_days_ago,
-            y=original_detection_magnitudes,
-            error_y=dict(
-                type='data',
-                array=original_detection_errors,
-                visible=True,
-                color=rgb_to_rgba(color, 0.3)  # make binned detections transparent
-            ),
-            mode='markers',
-            marker=dict(symbol='circle', size=8, color=color, opacity=0.3),
-            name=f"{telescope}_{filter_band} Original Detections",
-            legendgroup=f"{telescope}_{filter_band}_detections",
-            showlegend=False  # Hide from legend to avoid clutter
-        ))
-
-        # Add binned detections as scatter points with error bars
-        fig.add_trace(go.Scatter(
-            x=detection_days_ago,
-            y=detection_magnitudes,
-            error_y=dict(
-                type='data',
-                array=detection_errors,
-                visible=True
-            ),
-            mode='markers',
-            marker=dict(symbol='circle', size=8, color=color),
-            name=f"{telescope}_{filter_band} Detections",
-            legendgroup=f"{telescope}_{filter_band}_detections",
-            legendrank=tel2rank[telescope],
-            yaxis="y"
-        ))
-
-        # Add invisible points with abs magnitude values
-        if candidate.dist_Mpc:
-            absolute_magnitudes = [m - distance_modulus for m in detection_magnitudes]
-            fig.add_trace(go.Scatter(
-                x=[None],  # don't actually show new points
-                y=absolute_magnitudes,  # only add abs mag to y2 axis
-                showlegend=False,
-                yaxis="y2"
-            ))
-      
-
-        # Add original non-detections with reduced opacity
-        fig.add_trace(go.Scatter(
-            x=original_non_detection_days_ago,
-            y=original_non_detection_limits,
-            mode='markers',
-            marker=dict(symbol='triangle-down', size=8, color=color, opacity=0.2),
-            legendgroup=f"{telescope}_{filter_band}_non_detections",
-            showlegend=False
-        ))
-
-        # Add binned non-detections as downward arrows
-        fig.add_trace(go.Scatter(
-            x=non_detection_days_ago,
-            y=non_detection_limits,
-            mode='markers',
-            marker=dict(symbol='triangle-down', size=8, color=color),
-            name=f"{telescope}_{filter_band} Non-Detections",
-            legendgroup=f"{telescope}_{filter_band}_non_detections",
-            legendrank=tel2rank[telescope]
-        ))
-
-    # Customize layout
-    fig.update_layout(
-        xaxis_title="Days Ago",
-        yaxis_title="Apparent Magnitude",
-        yaxis=dict(autorange="reversed",  # Magnitude is brighter for lower values
-                   title="Apparenet Magnitude"
-        ),
-        yaxis2=dict(  # Does not appear if no absolute magnitudes are plotted, i.e if not candidate.dist_Mpc
-            title="Absolute Magnitude",
-            overlaying="y",  # Overlay on the same plot
-            side="right",  # Place on the right side
-            autorange="reversed",  # Absolute magnitude is also brighter for lower values
-        ),
-        xaxis=dict(
-            title="Days Ago",
-            autorange="reversed",  # Reverse the x-axis
-        ),
-        legend=dict(
-            orientation="v",  # Vertical legend
-            x=1.2,  # Position the legend at the right
-            y=0.5,  # Center the legend
-        ),
-        margin=dict(l=50, r=0, t=10, b=100),  # Tight margins
-        paper_bgcolor="rgba(0,0,0,0)",  # Transparent outer background
-    )
 
-    # Convert the graph to HTML for embedding in the template
-    graph_html = fig.to_html(full_html=False, include_plotlyjs='cdn')
+def get_light_curves(candidates):
+    """
+    Cached light_curve_payload for a batch of candidates.
+    A cached payload is reused while the candidate's photometry version and dist_Mpc are unchanged.
+    :param candidates: Iterable of Candidate instances
+    :return: Dict of candidate id -> payload
+    """
+    candidates = list(candidates)
+    versions = photometry_versions([candidate.id for candidate in candidates])
+    cached = cache.get_many([light_curve_cache_key(candidate.id) for candidate in candidates])
+
+    light_curves = {}
+    to_cache = {}
+    for candidate in candidates:
+        key = light_curve_cache_key(candidate.id)
+        version = (*versions.get(candidate.id, (0, None)), candidate.dist_Mpc)
+        entry = cached.get(key)
+        if entry and entry[0] == version:
+            light_curves[candidate.id] = entry[1]
+            continue
+        payload = light_curve_payload(candidate) if candidate.id in versions else light_curve_payload(candidate, [])
+        light_curves[candidate.id] = payload
+        to_cache[key] = (version, payload)
+
+    if to_cache:
+        cache.set_many(to_cache, timeout=LIGHT_CURVE_CACHE_TIMEOUT)
+    return light_curves
+
+
+def get_light_curve(candidate):
+    """
+    Cached light_curve_payload for a single candidate.
+    """
+    return get_light_curves([candidate])[candidate.id]
+
+
+def json_column(values, decimals):
+    """
+    Round a numpy array and convert it to a JSON-serializable list, with NaN as None.
+    """
+    return [None if np.isnan(value) else value for value in np.round(values, decimals).tolist()]
+
 
-    return mark_safe(graph_html)
+def light_curve_payload(candidate, light_curve=None):
+    """
+    Compact, columnar light curve of a candidate for client-side plotting.
+    Every telescope/band has its raw and binned detections (mjd, magnitude, magnitude_error) and
+    non-detections (mjd, limit), along with its plot name, color and legend rank.
+    :param candidate: Candidate instance
+    :param light_curve: Output of fetch_light_curve, fetched if not given
+    :return: JSON-serializable dict
+    """
+    if light_curve is None:
+        light_curve = fetch_light_curve(candidate)
+
+    def detections(points):
+        return {
+            'mjd': json_column(points['obs_time'] / (24 * 3600) + UNIX_EPOCH_MJD, 6),
+            'magnitude': json_column(points['magnitude'], 4),
+            'magnitude_error': json_column(points['magnitude_error'], 4),
+        }
+
+    def non_detections(points):
+        return {
+            'mjd': json_column(points['obs_time'] / (24 * 3600) + UNIX_EPOCH_MJD, 6),
+            'limit': json_column(points['limit'], 4),
+        }
+
+    groups = []
+    for group in light_curve:
+        name = f"{group['telescope']}_{group['filter_band']}"
+        color = LIGHT_CURVE_COLORS.get(name, LIGHT_CURVE_DEFAULT_COLOR)
+        groups.append({
+            'name': name,
+            'telescope': group['telescope'],
+            'filter_band': group['filter_band'],
+            'color': color,
+            'error_color': rgb_to_rgba(color, 0.3),  # make binned detections transparent
+            'legend_rank': TELESCOPE_LEGEND_RANK.get(group['telescope'], len(TELESCOPE_LEGEND_RANK) + 1),
+            'raw': {
+                'detections': detections(group['detections']),
+                'non_detections': non_detections(group['non_detections']),
+            },
+            'binned': {
+                'detections': detections(group['binned_detections']),
+                'non_detections': non_detections(group['binned_non_detections']),
+            },
+        })
+
+    distance_modulus = 5 * (np.log10(candidate.dist_Mpc * 1e6) - 1) if candidate.dist_Mpc else None
+    return {
+        'candidate': candidate.id,
+        'distance_modulus': distance_modulus,
+        'groups': groups,
+    }
 
 
 def rgb_to_rgba(color, alpha=1.0):
@@ -434,52 +588,33 @@ def rgb_to_rgba(color, alpha=1.0):
 
 def bin_photometry_points(points, max_time_diff=0.1):
     """
-    Bin data points that are less than max_time_diff days apart.
-    :param points: List of data points (each with obs_date, magnitude, magnitude_error, etc.)
+    Bin data points that are less than max_time_diff days apart from the previous point.
+    Each bin gets the mean time, magnitude and limit of its points (ignoring NaNs), and the
+    quadrature sum of their magnitude errors (NaN if there are none).
+    :param points: Dict of numpy arrays (see PHOTOMETRY_COLUMNS), sorted by obs_time in unix seconds
     :param max_time_diff: Maximum time difference (in days) to bin points together
-    :return: Binned data points
-
-    Note: This function assumes that the input points are sorted by obs_date.
-    """
-    binned_points = []
-    current_bin = []
-
-    for i, point in enumerate(points):
-        if not current_bin:
-            current_bin.append(point)
-        else:
-            time_diff = (point.obs_date - current_bin[-1].obs_date).total_seconds() / (24 * 3600)
-            if time_diff <= max_time_diff:
-                current_bin.append(point)
-            else:
-                # Process the current bin
-                binned_points.append(average_photometry_bin(current_bin))
-                current_bin = [point]
-
-    # Process the last bin
-    if current_bin:
-        binned_points.append(average_photometry_bin(current_bin))
-
-    return binned_points
-
-
-def average_photometry_bin(bin_points):
-    """
-    Compute the average values for a bin of points.
-    :param bin_points: List of points in the bin
-    :return: A single averaged point
-    """
-    avg_obs_date = np.mean([p.obs_date.timestamp() for p in bin_points])
-    avg_obs_date = datetime.fromtimestamp(avg_obs_date)
-    avg_magnitude = np.mean([p.magnitude for p in bin_points if p.magnitude is not None])
-    sum_squared_errors = sum([p.magnitude_error**2 for p in bin_points if p.magnitude_error is not None])
-    avg_magnitude_error = np.sqrt(sum_squared_errors) if sum_squared_errors > 0 else None
-    avg_limit = np.mean([p.limit for p in bin_points if p.limit is not None])
-
-    # Return a new point with averaged values
-    return SimpleNamespace(
-        obs_date=make_aware(avg_obs_date),
-        magnitude=avg_magnitude,
-        magnitude_error=avg_magnitude_error,
-        limit=avg_limit
-    )
+    :return: Binned data points, in the same format
+    """
+    obs_time = points['obs_time']
+    if not len(obs_time):
+        return {column: values[:0] for column, values in points.items()}
+
+    # Start a new bin wherever the gap to the previous point is larger than max_time_diff
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(obs_time) > max_time_diff * 24 * 3600) + 1))
+
+    def bin_sum(values):
+        valid = ~np.isnan(values)
+        return np.add.reduceat(np.where(valid, values, 0.0), starts), np.add.reduceat(valid.astype(int), starts)
+
+    def bin_mean(values):
+        total, count = bin_sum(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return total / count  # NaN for bins without valid values
+
+    sum_squared_errors, _ = bin_sum(points['magnitude_error'] ** 2)
+    return {
+        'obs_time': bin_mean(obs_time),
+        'magnitude': bin_mean(points['magnitude']),
+        'magnitude_error': np.where(sum_squared_errors > 0, np.sqrt(sum_squared_errors), np.nan),
+        'limit': bin_mean(points['limit']),
+    }
@@ -0,0 +1,178 @@
+# Built-in imports
+import threading
+
+# Third-party imports
+import numpy as np
+from astropy import units as u
+from astropy_healpix import HEALPix
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+# Django imports
+from django.db.models import Q
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """
+    Angular separation between two sets of positions, using the haversine formula (stable at small angles).
+    All inputs are in degrees and broadcast against each other.
+    :return: Separation in degrees (numpy array)
+    """
+    ra1, dec1, ra2, dec2 = (np.radians(np.asarray(x, dtype=float)) for x in (ra1, dec1, ra2, dec2))
+    sin_ddec = np.sin((dec2 - dec1) / 2)
+    sin_dra = np.sin((ra2 - ra1) / 2)
+    a = sin_ddec**2 + np.cos(dec1) * np.cos(dec2) * sin_dra**2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+
+HEALPIX_ORDER = 14  # Nested HEALPix order of the stored pixel index, ~13 arcsec pixels
+HEALPIX_ORDER0_RESOLUTION = 58.6  # Approximate pixel size at order 0, in degrees
+
+
+def healpix_index(ra, dec, order=HEALPIX_ORDER):
+    """
+    Nested HEALPix pixel index of one or more positions.
+    :param ra: Right ascension in degrees (scalar or array).
+    :param dec: Declination in degrees (scalar or array).
+    :param order: HEALPix order (nside = 2**order).
+    :return: Pixel index (numpy int64, same shape as the input)
+    """
+    hp = HEALPix(nside=2**order, order='nested')
+    return hp.lonlat_to_healpix(np.asarray(ra, dtype=float) * u.deg, np.asarray(dec, dtype=float) * u.deg)
+
+
+def healpix_cone_ranges(ra, dec, radius, order=HEALPIX_ORDER):
+    """
+    Ranges of nested pixel indices (at `order`) that together cover a cone.
+    The cone is searched at a coarser order whose pixels are about the size of the radius, and every
+    overlapping coarse pixel is expanded to its contiguous range of children at `order`.
+    The HEALPix cone search is done on the sphere, so RA wraparound and the poles need no special casing.
+    :param ra: Right ascension of the cone center in degrees.
+    :param dec: Declination of the cone center in degrees.
+    :param radius: Radius of the cone in degrees.
+    :return: Sorted list of (start, stop) tuples, stop exclusive
+    """
+    search_order = int(np.clip(np.floor(np.log2(HEALPIX_ORDER0_RESOLUTION / max(radius, 1e-9))), 0, order))
+    hp = HEALPix(nside=2**search_order, order='nested')
+    pixels = np.sort(hp.cone_search_lonlat(float(ra) * u.deg, float(dec) * u.deg, float(radius) * u.deg))
+
+    shift = 2 * (order - search_order)
+    ranges = []
+    for pixel in pixels:
+        start, stop = int(pixel) << shift, (int(pixel) + 1) << shift
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = stop  # Merge neighbouring pixels into one range
+        else:
+            ranges.append([start, stop])
+    return [tuple(r) for r in ranges]
+
+
+def healpix_cone_q(ra, dec, radius, field='healpix'):
+    """
+    Build a Q object selecting rows whose HEALPix index falls in a pixel overlapping the cone.
+    This is only a prefilter, the exact separation still has to be checked on the selected rows.
+    :param field: Name (or lookup path) of the HEALPix index field.
+    """
+    q = Q()
+    for start, stop in healpix_cone_ranges(ra, dec, radius):
+        q |= Q(**{f'{field}__gte': start, f'{field}__lt': stop})
+    return q
+
+
+def radec_to_xyz(ra, dec):
+    """
+    Unit vectors of positions given in degrees, as an (N, 3) array.
+    """
+    ra = np.radians(np.atleast_1d(np.asarray(ra, dtype=float)))
+    dec = np.radians(np.atleast_1d(np.asarray(dec, dtype=float)))
+    return np.column_stack((np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)))
+
+
+class SkyIndex:
+    """
+    In-memory spatial index of sky positions: a cKDTree on unit vectors, plus a small buffer of
+    positions added since the tree was built (checked by brute force, folded into the tree every
+    `rebuild_every` additions). Working on unit vectors avoids RA wraparound and pole issues.
+    Safe to share between ingestion worker threads.
+    """
+
+    def __init__(self, ids, ra, dec, rebuild_every=1000):
+        self.rebuild_every = rebuild_every
+        self._lock = threading.Lock()
+        self._ids = np.asarray(ids)
+        self._xyz = radec_to_xyz(ra, dec) if len(self._ids) else np.empty((0, 3))
+        self._tree = cKDTree(self._xyz) if len(self._ids) else None
+        self._new_ids = []
+        self._new_xyz = []
+
+    def __len__(self):
+        return len(self._ids) + len(self._new_ids)
+
+    def add(self, id, ra, dec):
+        """
+        Add a position to the index, e.g. a candidate created during the current ingestion run.
+        """
+        with self._lock:
+            self._new_ids.append(id)
+            self._new_xyz.append(radec_to_xyz(ra, dec)[0])
+            if len(self._new_ids) >= self.rebuild_every:
+                self._rebuild()
+
+    def _rebuild(self):
+        self._ids = np.concatenate([self._ids, np.asarray(self._new_ids)]) if len(self._ids) else np.asarray(self._new_ids)
+        self._xyz = np.vstack([self._xyz, np.asarray(self._new_xyz)])
+        self._tree = cKDTree(self._xyz)
+        self._new_ids = []
+        self._new_xyz = []
+
+    def match(self, ra, dec, radius):
+        """
+        Find the nearest indexed position within `radius` of each of the given positions, in one vectorized query.
+        :param ra: Right ascension in degrees (scalar or array).
+        :param dec: Declination in degrees (scalar or array).
+        :param radius: Match radius in degrees.
+        :return: List with the id of the nearest match for each position, or None where there is no match
+        """
+        with self._lock:
+            return self._match(radec_to_xyz(ra, dec), radius)
+
+    def _match(self, xyz, radius):
+        chord = 2 * np.sin(np.radians(radius) / 2)  # Straight-line distance between unit vectors at that angle
+        best_dist = np.full(len(xyz), np.inf)
+        best_ids = np.full(len(xyz), None, dtype=object)
+
+        if self._tree is not None:
+            dist, idx = self._tree.query(xyz, k=1, distance_upper_bound=chord)
+            found = np.isfinite(dist)
+            best_dist[found] = dist[found]
+            best_ids[found] = self._ids[idx[found]]
+
+        if self._new_ids:
+            dist = np.linalg.norm(xyz[:, None, :] - np.asarray(self._new_xyz)[None, :, :], axis=2)
+            nearest = np.argmin(dist, axis=1)
+            nearest_dist = dist[np.arange(len(xyz)), nearest]
+            better = (nearest_dist <= chord) & (nearest_dist < best_dist)
+            best_dist[better] = nearest_dist[better]
+            best_ids[better] = np.asarray(self._new_ids, dtype=object)[nearest[better]]
+
+        return [None if i is None else i.item() if hasattr(i, 'item') else i for i in best_ids]
+
+
+def group_nearby_positions(ra, dec, radius):
+    """
+    Label positions so that any two positions within `radius` of each other (directly or through
+    a chain of neighbours) share a label.
+    :param ra: Right ascension in degrees (array).
+    :param dec: Declination in degrees (array).
+    :param radius: Linking radius in degrees.
+    :return: Array of integer group labels, one per position
+    """
+    xyz = radec_to_xyz(ra, dec)
+    n = len(xyz)
+    if n == 0:
+        return np.empty(0, dtype=int)
+    pairs = cKDTree(xyz).query_pairs(2 * np.sin(np.radians(radius) / 2), output_type='ndarray')
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    return labels
@@ -0,0 +1,107 @@
+# Built-in imports
+import random
+
+# Third-party imports
+import dramatiq
+from dramatiq.rate_limits import ConcurrentRateLimiter
+from dramatiq.rate_limits.backends import RedisBackend
+
+# Django imports
+from django.conf import settings
+
+# Local imports
+from .models import Candidate, TNSLookup
+from .photometry_utils import get_ztf_fp
+from .utils import add_survey_cutouts, add_host_galaxy
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Enrichment actors, sent by utils.schedule_candidate_enrichment when settings.CANDIDATE_ENRICHMENT_ASYNC is set.
+# Every actor is idempotent, so retries and repeated alerts of the same candidate are harmless.
+# ATLAS forced photometry has its own job manager (atlas.py), since ATLAS tasks are polled rather than awaited.
+# Run the workers with `python manage.py rundramatiq`.
+
+ENRICHMENT_QUEUE = 'enrichment'
+
+# Maximum number of concurrent calls to each external service, across all worker processes.
+# Can be overridden with settings.CANDIDATE_ENRICHMENT_CONCURRENCY.
+SERVICE_CONCURRENCY = {
+    'cutouts': 4,  # PS1 + SDSS image servers
+    'lasair': 2,
+    'glade': 2,  # Local, but memory heavy
+    'tns': 2,
+}
+SERVICE_CONCURRENCY.update(getattr(settings, 'CANDIDATE_ENRICHMENT_CONCURRENCY', {}))
+
+rate_limiter_backend = RedisBackend(
+    url=getattr(settings, 'DRAMATIQ_BROKER', {}).get('OPTIONS', {}).get('url', 'redis://localhost:6379')
+)
+service_mutexes = {
+    # ttl (ms) bounds how long a crashed worker can hold a slot
+    service: ConcurrentRateLimiter(rate_limiter_backend, f'cast-enrichment-{service}', limit=limit, ttl=15 * 60 * 1000)
+    for service, limit in SERVICE_CONCURRENCY.items()
+}
+
+
+def get_candidate(candidate_id):
+    """
+    Returns the candidate, or None if it was deleted before the actor ran.
+    """
+    candidate = Candidate.objects.filter(id=candidate_id).first()
+    if candidate is None:
+        logger.info(f"Candidate {candidate_id} no longer exists, skipping enrichment.")
+    return candidate
+
+
+# When a service is at its concurrency limit, the message is sent again with a delay (see run_with_service).
+# This does not count as a retry, so a busy night never drops enrichment: max_retries is only used up by errors.
+RATE_LIMIT_DELAY = 30_000  # ms, plus up to the same again of random jitter
+
+
+def run_with_service(service, actor, candidate_id, step):
+    """
+    Run step() while holding one of the concurrency slots of a service.
+    If all slots are taken, the message is re-enqueued with a delay instead of being retried.
+    """
+    with service_mutexes[service].acquire(raise_on_failure=False) as acquired:
+        if not acquired:
+            actor.send_with_options(args=(candidate_id,), delay=RATE_LIMIT_DELAY + random.randint(0, RATE_LIMIT_DELAY))
+            return
+        step()
+
+
+@dramatiq.actor(queue_name=ENRICHMENT_QUEUE, max_retries=20, min_backoff=5_000, max_backoff=300_000)
+def enrich_survey_cutouts(candidate_id):
+    candidate = get_candidate(candidate_id)
+    if candidate:
+        run_with_service('cutouts', enrich_survey_cutouts, candidate_id, lambda: add_survey_cutouts(candidate))
+
+
+@dramatiq.actor(queue_name=ENRICHMENT_QUEUE, max_retries=20, min_backoff=10_000, max_backoff=600_000)
+def enrich_ztf_photometry(candidate_id):
+    candidate = get_candidate(candidate_id)
+    if candidate:
+        run_with_service('lasair', enrich_ztf_photometry, candidate_id, lambda: get_ztf_fp(candidate))
+
+
+@dramatiq.actor(queue_name=ENRICHMENT_QUEUE, max_retries=10, min_backoff=5_000, max_backoff=300_000)
+def enrich_host_galaxy(candidate_id):
+    candidate = get_candidate(candidate_id)
+    if candidate:
+        run_with_service('glade', enrich_host_galaxy, candidate_id, lambda: add_host_galaxy(candidate))
+
+
+@dramatiq.actor(queue_name=ENRICHMENT_QUEUE, max_retries=10, min_backoff=30_000, max_backoff=1_800_000)
+def refresh_tns_lookup(candidate_id):
+    """
+    Refresh the cached TNS status of a candidate, sent by Candidate.save when the cache is missing or stale.
+    """
+    candidate = get_candidate(candidate_id)
+    if candidate:
+        lookup = TNSLookup.objects.filter(candidate=candidate).first()
+        if lookup and lookup.is_fresh(candidate.ra, candidate.dec):
+            return  # Already refreshed, e.g. by an earlier message for the same candidate
+        run_with_service('tns', refresh_tns_lookup, candidate_id, candidate.refresh_tns_lookup)
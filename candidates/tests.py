@@ -1,3 +1,290 @@
-from django.test import TestCase
+# Built-in imports
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+# Third-party imports
+import numpy as np
+import pandas as pd
+
+# Django imports
+from django.test import SimpleTestCase, TestCase
+
+# Local imports
+from .models import Candidate, CandidatePhotometry
+from .photometry_utils import (add_photometry_from_last_report, bin_photometry_points, bulk_add_photometry,
+                               fetch_light_curve, select_new_points)
+from .spatial import SkyIndex, angular_separation, healpix_cone_ranges, healpix_index
+from .utils import partition_json_files
+
+
+def reference_bin(points, max_time_diff=0.1):
+    """
+    The binning of bin_photometry_points before it was vectorized, on objects with obs_date, magnitude,
+    magnitude_error and limit attributes (sorted by obs_date). Returns the bins as dict of lists, with NaN
+    for missing values.
+    """
+    bins = []
+    for point in points:
+        if bins and (point.obs_date - bins[-1][-1].obs_date).total_seconds() / (24 * 3600) <= max_time_diff:
+            bins[-1].append(point)
+        else:
+            bins.append([point])
+
+    binned = {'obs_time': [], 'magnitude': [], 'magnitude_error': [], 'limit': []}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for bin_points in bins:
+            magnitudes = [p.magnitude for p in bin_points if p.magnitude is not None]
+            limits = [p.limit for p in bin_points if p.limit is not None]
+            sum_squared_errors = sum([p.magnitude_error**2 for p in bin_points if p.magnitude_error is not None])
+            binned['obs_time'].append(np.mean([p.obs_date.timestamp() for p in bin_points]))
+            binned['magnitude'].append(np.mean(magnitudes) if magnitudes else np.nan)
+            binned['magnitude_error'].append(np.sqrt(sum_squared_errors) if sum_squared_errors > 0 else np.nan)
+            binned['limit'].append(np.mean(limits) if limits else np.nan)
+    return binned
+
+
+def assert_bins_equal(binned, expected):
+    for column, values in expected.items():
+        np.testing.assert_allclose(binned[column], values, rtol=1e-12, atol=1e-9, err_msg=column)
+
+
+class BinPhotometryPointsTest(SimpleTestCase):
+
+    def points(self, obs_dates, magnitudes, magnitude_errors, limits):
+        objects = [
+            type('Point', (), dict(obs_date=obs_date, magnitude=magnitude, magnitude_error=error, limit=limit))
+            for obs_date, magnitude, error, limit in zip(obs_dates, magnitudes, magnitude_errors, limits)
+        ]
+        arrays = {
+            'obs_time': np.array([obs_date.timestamp() for obs_date in obs_dates]),
+            'magnitude': np.array(magnitudes, dtype=float),
+            'magnitude_error': np.array(magnitude_errors, dtype=float),
+            'limit': np.array(limits, dtype=float),
+        }
+        return objects, arrays
+
+    def test_matches_reference_binning(self):
+        rng = np.random.default_rng(42)
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        # Clusters of points minutes apart, separated by gaps around the 0.1 day bin limit
+        offsets = np.cumsum(rng.choice([60.0, 600.0, 8000.0, 9000.0, 86400.0], size=200))
+        obs_dates = [start + timedelta(seconds=float(offset)) for offset in offsets]
+        magnitudes = [None if rng.random() < 0.2 else float(rng.uniform(15, 21)) for _ in obs_dates]
+        errors = [None if rng.random() < 0.2 else float(rng.uniform(0.01, 0.3)) for _ in obs_dates]
+        limits = [None if rng.random() < 0.2 else float(rng.uniform(19, 22)) for _ in obs_dates]
+
+        objects, arrays = self.points(obs_dates, magnitudes, errors, limits)
+        assert_bins_equal(bin_photometry_points(arrays), reference_bin(objects))
+
+    def test_gap_at_bin_limit(self):
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        obs_dates = [start, start + timedelta(days=0.1), start + timedelta(days=0.2, seconds=1)]
+        objects, arrays = self.points(obs_dates, [18.0, 19.0, 20.0], [0.3, 0.4, None], [None, None, None])
+
+        binned = bin_photometry_points(arrays)
+        assert_bins_equal(binned, reference_bin(objects))
+        self.assertEqual(len(binned['obs_time']), 2)
+        self.assertAlmostEqual(binned['magnitude'][0], 18.5)
+        self.assertAlmostEqual(binned['magnitude_error'][0], 0.5)
+        self.assertTrue(np.isnan(binned['magnitude_error'][1]))
+
+    def test_empty(self):
+        _, arrays = self.points([], [], [], [])
+        binned = bin_photometry_points(arrays)
+        self.assertEqual(sorted(binned), sorted(arrays))
+        self.assertTrue(all(len(values) == 0 for values in binned.values()))
+
+
+class FetchLightCurveTest(TestCase):
+
+    def setUp(self):
+        self.candidate = Candidate(ra=150.1, dec=2.2, file_source='candidate_files/test.json')
+        self.candidate.save(check_tns=False)
+
+        rng = np.random.default_rng(7)
+        obs_date = datetime(2025, 3, 1, tzinfo=timezone.utc)
+        for _ in range(120):
+            detected = rng.random() < 0.7
+            obs_date += timedelta(seconds=float(rng.choice([300, 7200, 43200])))
+            CandidatePhotometry.objects.create(
+                candidate=self.candidate,
+                obs_date=obs_date,
+                telescope=str(rng.choice(['LAST', 'ZTF', 'ATLAS'])),
+                filter_band=str(rng.choice(['g', 'r', 'o'])),
+                magnitude=float(rng.uniform(15, 21)) if detected else None,
+                magnitude_error=float(rng.uniform(0.01, 0.3)) if detected else None,
+                limit=float(rng.uniform(19, 22)),
+            )
+
+    def test_matches_queries_per_band(self):
+        light_curve = fetch_light_curve(self.candidate)
+
+        # The grouping and binning of the photometry graph before it was built from a single query
+        photometry = CandidatePhotometry.objects.filter(candidate=self.candidate).order_by('obs_date')
+        pairs = set(photometry.values_list('telescope', 'filter_band'))
+        self.assertEqual({(group['telescope'], group['filter_band']) for group in light_curve}, pairs)
+
+        for group in light_curve:
+            filtered = photometry.filter(telescope=group['telescope'], filter_band=group['filter_band'])
+            detections = list(filtered.exclude(magnitude__isnull=True).order_by('obs_date'))
+            non_detections = list(filtered.filter(magnitude__isnull=True).order_by('obs_date'))
+
+            np.testing.assert_allclose(group['detections']['obs_time'], [p.obs_date.timestamp() for p in detections])
+            np.testing.assert_allclose(group['non_detections']['obs_time'],
+                                       [p.obs_date.timestamp() for p in non_detections])
+            assert_bins_equal(group['binned_detections'], reference_bin(detections))
+            assert_bins_equal(group['binned_non_detections'], reference_bin(non_detections))
+
+    def test_no_photometry(self):
+        CandidatePhotometry.objects.all().delete()
+        self.assertEqual(fetch_light_curve(self.candidate), [])
+
+
+class SelectNewPointsTest(SimpleTestCase):
+
+    def frame(self, rows):
+        return pd.DataFrame({
+            'obs_date': pd.to_datetime([obs_date for obs_date, _ in rows], utc=True),
+            'filter_band': [band for _, band in rows],
+        })
+
+    def test_skips_existing_points_within_tolerance(self):
+        t = datetime(2025, 5, 1, 12, tzinfo=timezone.utc)
+        existing = self.frame([(t, 'g'), (t + timedelta(hours=1), 'r')])
+        incoming = self.frame([
+            (t + timedelta(seconds=3), 'g'),  # Within the tolerance of an existing g point
+            (t + timedelta(seconds=10), 'g'),  # Outside the tolerance
+            (t, 'r'),  # Same time as an existing point, but another band
+            (t + timedelta(hours=1, seconds=-5), 'r'),  # Exactly at the tolerance
+        ])
+
+        new = select_new_points(incoming, existing, tolerance=5)
+        self.assertEqual(list(zip(new['obs_date'], new['filter_band'])),
+                         [(pd.Timestamp(t + timedelta(seconds=10)), 'g'), (pd.Timestamp(t), 'r')])
+
+    def test_drops_incoming_duplicates(self):
+        t = datetime(2025, 5, 1, 12, tzinfo=timezone.utc)
+        incoming = self.frame([(t, 'g'), (t, 'g'), (t, 'r')])
+        incoming['magnitude'] = [18.0, 18.5, 19.0]
+
+        new = select_new_points(incoming, self.frame([]))
+        self.assertEqual(list(new['filter_band']), ['g', 'r'])
+        self.assertEqual(list(new['magnitude']), [18.0, 19.0])  # The first of the duplicates is kept
+
+
+class BulkAddPhotometryTest(TestCase):
+
+    def setUp(self):
+        self.candidate = Candidate(ra=210.5, dec=-12.3, file_source='candidate_files/test.json')
+        self.candidate.save(check_tns=False)
+        self.t = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+    def test_same_last_report_twice(self):
+        last_report = {
+            'detections_jd': [2460800.5, 2460800.6, 2460801.5],
+            'detections_mag': [18.2, 18.1, 17.9],
+            'detections_magerr': [0.05, 0.06, 0.04],
+            'nondetections_jd': [2460798.5, 2460799.5],
+            'nondetections_mag': [20.1, 20.3],
+        }
+        add_photometry_from_last_report(self.candidate, last_report)
+        self.assertEqual(CandidatePhotometry.objects.filter(candidate=self.candidate).count(), 5)
+
+        add_photometry_from_last_report(self.candidate, last_report)
+        self.assertEqual(CandidatePhotometry.objects.filter(candidate=self.candidate).count(), 5)
+
+    def test_skips_points_within_tolerance(self):
+        self.assertEqual(bulk_add_photometry(self.candidate, 'ZTF', [self.t], 'g', [18.0], [0.1], [None]), 1)
+        self.assertEqual(bulk_add_photometry(self.candidate, 'ZTF', [self.t + timedelta(seconds=2)], 'g',
+                                             [18.3], [0.1], [None]), 0)
+        self.assertEqual(bulk_add_photometry(self.candidate, 'ZTF', [self.t], 'r', [18.0], [0.1], [None]), 1)
+        self.assertEqual(CandidatePhotometry.objects.filter(candidate=self.candidate).count(), 2)
+
+    def test_skips_and_does_not_count_concurrent_rows(self):
+        CandidatePhotometry.objects.create(candidate=self.candidate, telescope='LAST', filter_band='clear',
+                                           obs_date=self.t, magnitude=17.5, magnitude_error=0.02)
+        obs_dates = [self.t, self.t + timedelta(hours=1), self.t + timedelta(hours=2)]
+
+        # As if the point at self.t was written by another process after the existing points were read
+        with mock.patch('candidates.photometry_utils.select_new_points',
+                        side_effect=lambda incoming, existing, tolerance: incoming):
+            added = bulk_add_photometry(self.candidate, 'LAST', obs_dates, 'clear',
+                                        [18.0, 18.1, 18.2], [0.1, 0.1, 0.1], [None, None, None])
+
+        self.assertEqual(added, 2)
+        photometry = CandidatePhotometry.objects.filter(candidate=self.candidate)
+        self.assertEqual(photometry.count(), 3)
+        self.assertEqual(photometry.get(obs_date=self.t).magnitude, 17.5)
+
+
+class HealpixConeRangesTest(SimpleTestCase):
+
+    def assert_covers(self, ra, dec, radius, point_ras, point_decs):
+        ranges = healpix_cone_ranges(ra, dec, radius)
+        self.assertEqual(ranges, sorted(ranges))
+        for pixel in healpix_index(point_ras, point_decs):
+            self.assertTrue(any(start <= pixel < stop for start, stop in ranges), pixel)
+
+    def points_in_cone(self, ra, dec, radius, n=500):
+        rng = np.random.default_rng(0)
+        point_ras = (ra + rng.uniform(-90, 90, n * 20)) % 360
+        point_decs = np.clip(dec + rng.uniform(-2 * radius, 2 * radius, n * 20), -90, 90)
+        inside = angular_separation(ra, dec, point_ras, point_decs) < radius
+        return point_ras[inside][:n], point_decs[inside][:n]
+
+    def test_ra_wraparound(self):
+        radius = 10 / 3600
+        self.assert_covers(359.999, 12.0, radius, [0.0005, 359.9985, 359.999], [12.0, 12.001, 11.999])
+        self.assert_covers(0.0005, -30.0, radius, [359.999, 0.001], [-30.0, -30.001])
+
+    def test_poles(self):
+        for dec in (90.0, 89.999, -89.999, -90.0):
+            self.assert_covers(123.0, dec, 20 / 3600, *self.points_in_cone(123.0, dec, 20 / 3600))
+
+    def test_large_radius(self):
+        self.assert_covers(10.0, 45.0, 2.0, *self.points_in_cone(10.0, 45.0, 2.0))
+
+
+class PartitionJsonFilesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def json_file(self, name, ra, dec):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w') as file:
+            json.dump({'at_report': {'RA': {'value': ra}, 'Dec': {'value': dec}}}, file)
+        return path
+
+    def test_groups_nearby_and_same_candidate(self):
+        index = SkyIndex([1], [100.0], [-20.0])
+        a = self.json_file('a.json', 100.0, -20.0)
+        b = self.json_file('b.json', 100.0 + 2 / 3600, -20.0)
+        c = self.json_file('c.json', 100.0, -20.0 + 2.5 / 3600)  # Over 3" from b, linked to it through a
+        d = self.json_file('d.json', 359.9999, 0.0)
+        e = self.json_file('e.json', 0.0001, 0.0)  # 0.7" from d, across RA 0
+        f = self.json_file('f.json', 200.0, 40.0)
+        broken = os.path.join(self.tmp.name, 'broken.json')
+        with open(broken, 'w') as file:
+            file.write('{')
+
+        groups = partition_json_files([a, b, c, d, e, f, broken], index)
+        self.assertEqual([len(group) for group in groups], [3, 2, 1, 1])
+        self.assertEqual(sorted(map(sorted, groups)), sorted([sorted([a, b, c]), sorted([d, e]), [f], [broken]]))
+
+    def test_merges_groups_matching_one_candidate(self):
+        # Both alerts are within 3" of the candidate but 5" apart, so only the candidate ties them together
+        index = SkyIndex([7], [50.0], [10.0])
+        a = self.json_file('a.json', 50.0 - 2.5 / 3600, 10.0)
+        b = self.json_file('b.json', 50.0 + 2.5 / 3600, 10.0)
+        c = self.json_file('c.json', 60.0, 10.0)
+
+        groups = partition_json_files([a, b, c], index)
+        self.assertEqual([sorted(group) for group in groups], [sorted([a, b]), [c]])
+
+    def test_no_files(self):
+        self.assertEqual(partition_json_files([], SkyIndex([], [], [])), [])
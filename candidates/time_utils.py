@@ -0,0 +1,88 @@
+# Third-party imports
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+
+
+# Array-based time conversions. Building one astropy Time per point dominates the cost of
+# ingesting a few thousand ATLAS/ZTF epochs, so every conversion here takes and returns arrays.
+# Datetimes are returned as a timezone-aware (UTC) pandas DatetimeIndex, whose elements are
+# datetime subclasses and can be given directly to Django DateTimeFields.
+
+
+def _time_to_datetime(t):
+    return pd.DatetimeIndex(t.datetime64).tz_localize('UTC')
+
+
+def _datetime_to_time(datetimes):
+    """
+    Convert datetimes (aware, or naive in UTC) to an astropy Time array.
+    """
+    index = pd.DatetimeIndex(pd.to_datetime(list(datetimes), utc=True))
+    return Time(index.tz_localize(None).to_numpy(dtype='datetime64[ns]'), format='datetime64', scale='utc')
+
+
+def jd_to_datetime(jd):
+    """
+    Convert Julian dates (UTC) to timezone-aware datetimes.
+    :param jd: Sequence of Julian dates
+    :return: DatetimeIndex in UTC
+    """
+    jd = np.atleast_1d(np.asarray(jd, dtype=float))
+    if not len(jd):
+        return pd.DatetimeIndex([], tz='UTC')
+    return _time_to_datetime(Time(jd, format='jd', scale='utc'))
+
+
+def mjd_to_datetime(mjd):
+    """
+    Convert modified Julian dates (UTC) to timezone-aware datetimes.
+    :param mjd: Sequence of MJDs
+    :return: DatetimeIndex in UTC
+    """
+    mjd = np.atleast_1d(np.asarray(mjd, dtype=float))
+    if not len(mjd):
+        return pd.DatetimeIndex([], tz='UTC')
+    return _time_to_datetime(Time(mjd, format='mjd', scale='utc'))
+
+
+def iso_to_datetime(iso):
+    """
+    Convert ISO strings (UTC, e.g. '2024-01-01 12:00:00') to timezone-aware datetimes.
+    :param iso: Sequence of ISO strings
+    :return: DatetimeIndex in UTC
+    """
+    iso = [str(s).replace(' UTC', '').strip() for s in np.atleast_1d(iso)]
+    if not iso:
+        return pd.DatetimeIndex([], tz='UTC')
+    return _time_to_datetime(Time(iso, format='iso', scale='utc'))
+
+
+def datetime_to_jd(datetimes):
+    """
+    Convert datetimes (aware, or naive in UTC) to Julian dates.
+    :return: numpy array of Julian dates
+    """
+    if not len(datetimes):
+        return np.empty(0)
+    return _datetime_to_time(datetimes).jd
+
+
+def datetime_to_mjd(datetimes):
+    """
+    Convert datetimes (aware, or naive in UTC) to modified Julian dates.
+    :return: numpy array of MJDs
+    """
+    if not len(datetimes):
+        return np.empty(0)
+    return _datetime_to_time(datetimes).mjd
+
+
+def datetime_to_iso(datetimes):
+    """
+    Convert datetimes (aware, or naive in UTC) to ISO strings in UTC.
+    :return: numpy array of ISO strings
+    """
+    if not len(datetimes):
+        return np.empty(0, dtype=str)
+    return _datetime_to_time(datetimes).iso
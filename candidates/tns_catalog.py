@@ -0,0 +1,79 @@
+# Built-in imports
+import os
+from datetime import datetime, timezone
+
+# Third-party imports
+import pandas as pd
+
+# Django imports
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import make_aware
+
+# Local imports
+from .models import TNSObject, TNSCatalogSnapshot
+from .spatial import healpix_index
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Columns of the TNS public objects CSV (https://www.wis-tns.org/system/files/tns_public_objects/) used by the mirror
+TNS_CSV_COLUMNS = {
+    'name': 'name',
+    'name_prefix': 'name_prefix',
+    'ra': 'ra',
+    'declination': 'dec',
+    'redshift': 'redshift',
+    'type': 'type',
+    'reporting_group': 'reporting_group',
+    'source_group': 'source_group',
+    'internal_names': 'internal_names',
+    'discoverydate': 'discovery_date',
+    'lastmodified': 'last_modified',
+}
+
+
+def read_snapshot_time(csv_path):
+    """
+    The TNS export starts with a line holding the time it was made. Falls back to the file modification time.
+    """
+    first_line = pd.read_csv(csv_path, nrows=1, header=None, compression='infer').iloc[0, 0]
+    taken_at = parse_datetime(str(first_line).strip())
+    if taken_at is None:
+        logger.warning(f"No export time found in {csv_path}, using the file modification time.")
+        return datetime.fromtimestamp(os.path.getmtime(csv_path), tz=timezone.utc)
+    return taken_at if taken_at.tzinfo else make_aware(taken_at, timezone.utc)
+
+
+def load_tns_catalog(csv_path, batch_size=5000):
+    """
+    Load (or update) the local TNS mirror from a TNS public objects CSV export (plain or zipped).
+    Objects are upserted by name, so the mirror stays usable while it is being updated.
+    :param csv_path: Path of the CSV export
+    :param batch_size: Number of objects written per query
+    :return: The new TNSCatalogSnapshot
+    """
+    taken_at = read_snapshot_time(csv_path)
+    df = pd.read_csv(csv_path, skiprows=1, compression='infer', usecols=lambda column: column in TNS_CSV_COLUMNS,
+                     dtype={'name': str, 'name_prefix': str, 'internal_names': str})
+    df = df.rename(columns=TNS_CSV_COLUMNS).dropna(subset=['name', 'ra', 'dec'])
+
+    df['healpix'] = healpix_index(df['ra'].to_numpy(dtype=float), df['dec'].to_numpy(dtype=float))
+    for column in ('discovery_date', 'last_modified'):
+        if column in df:
+            df[column] = pd.to_datetime(df[column], errors='coerce', utc=True)
+    df = df.astype(object).where(df.notna(), None)  # NaN/NaT -> None for the database
+
+    fields = [field for field in TNS_CSV_COLUMNS.values() if field in df] + ['healpix']
+    update_fields = [field for field in fields if field != 'name']
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size]
+        TNSObject.objects.bulk_create(
+            [TNSObject(**{field: row[field] for field in fields}) for row in batch.to_dict('records')],
+            update_conflicts=True, unique_fields=['name'], update_fields=update_fields,
+        )
+        logger.info(f"Loaded {min(start + batch_size, len(df))}/{len(df)} TNS objects")
+
+    snapshot = TNSCatalogSnapshot.objects.create(taken_at=taken_at, n_objects=len(df))
+    logger.info(f"Loaded {snapshot}")
+    return snapshot
@@ -7,6 +7,7 @@ urlpatterns = [
     # path('add/', views.add_candidate_view, name='add'),  # Add a single candidate
     path('list/', views.candidate_list_view, name='list'),  # List all candidates
     path('<int:candidate_id>/', views.candidate_detail, name='candidate_detail'),
+    path('<int:candidate_id>/photometry.json', views.candidate_photometry_json, name='candidate_photometry_json'),
     path('upload/', views.upload_file_view, name='upload'),  # Upload candidates via a file
     path('delete/', views.delete_candidate_view, name='delete_candidate'),  # URL for deletion
     path('add_target/', views.add_target_view, name='add_target'),  # URL for Add Target
@@ -1,11 +1,13 @@
 # Standard library imports
-import glob
+import hashlib
 import json
 import os
 import requests
+import threading
 import time
 import traceback
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from datetime import datetime
 from io import BytesIO, StringIO
@@ -26,17 +28,22 @@ from django.conf import settings
 from django.contrib.auth.models import Group
 from django.core.files import File  # Import the File wrapper
 from django.core.files.base import ContentFile
-from django.db.models import ExpressionWrapper, FloatField
-from django.db.models.functions import ACos, Cos, Pi, Radians, Sin
+from django.db import connection, transaction
+from django.db.models import ExpressionWrapper, F, FloatField, Q, Window
+from django.db.models.functions import ACos, Cos, Pi, Radians, RowNumber, Sin
 from django.shortcuts import get_object_or_404
 from django.utils.dateparse import parse_datetime
+from django.utils.timezone import make_aware
 
 # Local application imports
-from .models import Candidate, CandidateAlert, CandidateDataProduct, CandidatePhotometry
+from .models import Candidate, CandidateAlert, CandidateDataProduct, CandidatePhotometry, IngestedFile
 from tom_dataproducts.models import ReducedDatum
 from tom_targets.models import Target
-from .photometry_utils import get_atlas_fp, get_ztf_fp, add_photometry_from_last_report
+from .photometry_utils import request_atlas_fp, get_ztf_fp, add_photometry_from_last_report
 from .gal_association import associate_galaxy
+from .http_client import http_get, http_post
+from .spatial import SkyIndex, angular_separation, group_nearby_positions, healpix_cone_q
+from .time_utils import datetime_to_mjd
 
 # Logging
 import logging
@@ -89,6 +96,8 @@ def cone_search_filter_candidates(queryset, ra, dec, radius):
     Formula is based on the Angular Distance formula:
     https://en.wikipedia.org/wiki/Angular_distance
 
+    Cone search is preceded by a lookup of the HEALPix pixels overlapping the cone (Candidate.healpix).
+
     :param queryset: Queryset of Candidate objects.
     :type queryset: QuerySet
 
@@ -108,14 +117,10 @@ def cone_search_filter_candidates(queryset, ra, dec, radius):
     dec = float(dec)
     radius = float(radius)
 
-    # Double radius for the bounding box square search
-    # double_radius = radius * 2
+    # HEALPix pre-filter: limit candidates to the (indexed) pixels overlapping the cone,
+    # so the separation below is only computed for a handful of rows
+    queryset = queryset.filter(healpix_cone_q(ra, dec, radius))
 
-    # Square pre-filter: limit candidates to a bounding box to improve performance
-    # queryset = queryset.filter(
-    #     ra__gte=ra - double_radius, ra__lte=ra + double_radius,
-    #     dec__gte=dec - double_radius, dec__lte=dec + double_radius
-    # )
     # Angular separation calculation
     separation = ExpressionWrapper(
         180 * ACos(
@@ -127,6 +132,71 @@ def cone_search_filter_candidates(queryset, ra, dec, radius):
     # Annotate queryset with separation and filter by the radius
     return queryset.annotate(separation=separation).filter(separation__lte=radius)
 
+CUTOUT_TYPES = ['ps1', 'ref', 'new', 'diff', 'sdss']
+
+
+def latest_per_group(queryset, partition_by, order_field='created_at'):
+    """
+    Returns the newest row of each group in a single query.
+    Uses a ROW_NUMBER() window partitioned by the given fields when the database supports it,
+    otherwise falls back to ordering the rows and keeping the first one of each group in Python.
+    :param queryset: Queryset to pick the rows from
+    :param partition_by: List of field names defining a group, e.g. ['candidate_id', 'data_product_type']
+    :param order_field: Field used to decide which row is the newest (descending)
+    :return: List of model instances, one per group
+    """
+    if connection.features.supports_over_clause:
+        ranked = queryset.annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=[F(field) for field in partition_by],
+                order_by=F(order_field).desc(),
+            )
+        )
+        return list(ranked.filter(row_number=1))
+
+    latest = {}
+    for obj in queryset.order_by(f'-{order_field}'):
+        latest.setdefault(tuple(getattr(obj, field) for field in partition_by), obj)
+    return list(latest.values())
+
+
+def prefetch_latest_cutouts(candidates, cutout_types=CUTOUT_TYPES):
+    """
+    Attaches the newest data product of each cutout type to every candidate, using one query for all of them.
+    Each candidate gets a `latest_cutouts` dict mapping cutout type to CandidateDataProduct (or None).
+    :param candidates: Iterable of Candidate instances
+    :param cutout_types: Data product types to fetch
+    :return: The candidates as a list
+    """
+    candidates = list(candidates)
+    products = CandidateDataProduct.objects.filter(
+        candidate_id__in=[candidate.id for candidate in candidates],
+        data_product_type__in=cutout_types,
+    )
+    latest = {
+        (product.candidate_id, product.data_product_type): product
+        for product in latest_per_group(products, ['candidate_id', 'data_product_type'])
+    }
+    for candidate in candidates:
+        candidate.latest_cutouts = {cutout_type: latest.get((candidate.id, cutout_type)) for cutout_type in cutout_types}
+    return candidates
+
+
+def prefetch_latest_alerts(candidates):
+    """
+    Attaches the newest CandidateAlert to every candidate as `last_alert`, using one query for all of them.
+    :param candidates: Iterable of Candidate instances
+    :return: The candidates as a list
+    """
+    candidates = list(candidates)
+    alerts = CandidateAlert.objects.filter(candidate_id__in=[candidate.id for candidate in candidates])
+    latest = {alert.candidate_id: alert for alert in latest_per_group(alerts, ['candidate_id'])}
+    for candidate in candidates:
+        candidate.last_alert = latest.get(candidate.id)
+    return candidates
+
+
 def create_candidate_cutouts(candidate, file_name, product_type):
     file_path = os.path.join(settings.TRANSIENT_DIR+'cutouts', file_name)
     if os.path.exists(file_path):
@@ -163,38 +233,198 @@ def check_candidate_exists_by_cone(ra, dec, radius_arcsec=3):
     return matching_candidates.exists(), None
 
 
-def fetch_ps1_cutout(ra, dec):
+def build_candidate_index():
     """
-    Fetches a PS1 color composite cutout image for a given RA/Dec.
-    :param ra: Right Ascension in degrees.
-    :param dec: Declination in degrees.
+    Builds an in-memory spatial index (SkyIndex) of all candidate positions, used for dedup during ingestion.
+    The database stays the source of truth, the index only saves a cone search query per alert.
+    :return: SkyIndex of candidate ids
+    """
+    rows = list(Candidate.objects.values_list('id', 'ra', 'dec'))
+    ids, ras, decs = zip(*rows) if rows else ([], [], [])
+    logger.info(f"Built candidate spatial index with {len(rows)} candidates.")
+    return SkyIndex(ids, ras, decs)
+
+
+# Result of matching a json file against the candidate index in a batch (see match_json_files):
+# the matched candidate id (None if none), and the size of the index when the batch was matched.
+AlertMatch = namedtuple('AlertMatch', ['ra', 'dec', 'candidate_id', 'index_size'])
+
+
+def find_existing_candidate(ra, dec, radius_arcsec=3, candidate_index=None, match=None):
+    """
+    Finds an existing candidate within a given radius, using the in-memory index if one is given
+    and a database cone search otherwise.
+    :param candidate_index: Optional SkyIndex from build_candidate_index.
+    :param match: Optional AlertMatch of this alert from match_json_files. Its candidate is used without querying
+                  the index, unless it found none and candidates were added to the index since (during the run).
+    :return: Tuple (exists, candidate)
+    """
+    if candidate_index is None:
+        return check_candidate_exists_by_cone(ra, dec, radius_arcsec=radius_arcsec)
+
+    if match is not None and (match.candidate_id is not None or len(candidate_index) == match.index_size):
+        candidate_id = match.candidate_id
+    else:
+        candidate_id = candidate_index.match(ra, dec, radius_arcsec / 3600.0)[0]
+    existing_candidate = Candidate.objects.filter(id=candidate_id).first() if candidate_id is not None else None
+    if candidate_id is not None and existing_candidate is None:
+        # The indexed candidate was deleted in the meantime, fall back to the database
+        return check_candidate_exists_by_cone(ra, dec, radius_arcsec=radius_arcsec)
+    return existing_candidate is not None, existing_candidate
+
+
+# PS1 and SDSS cutouts are cached on disk by survey, size and position rounded to CUTOUT_CACHE_PRECISION
+# decimals (0.36 arcsec), so repeat alerts of a candidate and backfills reuse the images.
+# An empty cache file records that the survey has no image at the position, and expires after
+# CUTOUT_CACHE_EMPTY_TTL seconds, since a PS1 file lookup can also come back empty when the service has a problem.
+# Nothing is evicted automatically, run `python manage.py clean_cutout_cache` (e.g. from cron) to bound its size.
+CUTOUT_SIZE = 240  # pixels
+CUTOUT_CACHE_DIR = getattr(settings, 'CUTOUT_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'cutout_cache'))
+CUTOUT_CACHE_PRECISION = 4
+CUTOUT_CACHE_EMPTY_TTL = getattr(settings, 'CUTOUT_CACHE_EMPTY_TTL', 7 * 24 * 3600)
+CUTOUT_WORKERS = 8
+
+
+def download_ps1_cutout(ra, dec, size=CUTOUT_SIZE):
+    """
+    Downloads a PS1 color composite cutout (jpeg) for a given RA/Dec.
+    :return: The image bytes, b'' if PS1 has no image at the position
     """
     files_query_base_url = 'http://ps1images.stsci.edu/cgi-bin/ps1filenames.py'
     params = {
         "ra" : ra,
         "dec" : dec,
     }
+    response = http_get(files_query_base_url, params=params)
+    response.raise_for_status()
+    # Load data into a pandas DataFrame
+    data_lines = response.text.split('\n')
+    header = data_lines[0].split()
+    rows = [line.split() for line in data_lines[1:] if line.strip()]
+    df = pd.DataFrame(rows, columns=header)
+    filenames = {band: df[df["filter"] == band]["filename"].values for band in ('i', 'r', 'g')} if rows else {}
+    if not filenames or any(len(names) == 0 for names in filenames.values()):
+        return b''  # Outside the PS1 footprint
+
+    cutout_base_url = 'https://ps1images.stsci.edu/cgi-bin/fitscut.cgi?'
+    url = f'{cutout_base_url}?red={filenames["i"][0]}&green={filenames["r"][0]}&blue={filenames["g"][0]}&x={ra}&y={dec}&size={size}&wcs=1&asinh=True&autoscale=99.750000'
+    response = http_get(url)
+    response.raise_for_status()
+    return response.content
+
+
+def download_sdss_cutout(ra, dec, size=CUTOUT_SIZE):
+    """
+    Downloads an SDSS color composite cutout (jpeg) for a given RA/Dec.
+    :return: The image bytes
+    """
+    url = f'https://skyserver.sdss.org/dr16/SkyServerWS/ImgCutout/getjpeg?ra={ra}&dec={dec}&scale=0.2&width={size}&height={size}&opt=G'
+    response = http_get(url)
+    response.raise_for_status()
+    return response.content
+
+
+CUTOUT_DOWNLOADERS = {'ps1': download_ps1_cutout, 'sdss': download_sdss_cutout}
+
+
+def cutout_cache_path(survey, ra, dec, size=CUTOUT_SIZE):
+    ra_key = f"{round(ra, CUTOUT_CACHE_PRECISION):.{CUTOUT_CACHE_PRECISION}f}"
+    dec_key = f"{round(dec, CUTOUT_CACHE_PRECISION):+.{CUTOUT_CACHE_PRECISION}f}"
+    return os.path.join(CUTOUT_CACHE_DIR, survey, f"{survey}_{ra_key}_{dec_key}_{size}.jpg")
+
+
+def read_cached_cutout(path):
+    """
+    Reads a cutout from the on-disk cache.
+    :param path: Cache path, see cutout_cache_path
+    :return: The image bytes, b'' if the survey had no image there (until the entry expires), or None if not cached
+    """
     try:
-        response = requests.get(files_query_base_url, params=params, timeout=30)
-        #print the response
-        data = response.text
-        # Load data into a pandas DataFrame
-        data_lines = data.split('\n')
-        header = data_lines[0].split()
-        rows = [line.split() for line in data_lines[1:] if line.strip()]
-
-        df = pd.DataFrame(rows, columns=header)
-
-        cutout_base_url = 'https://ps1images.stsci.edu/cgi-bin/fitscut.cgi?'
-        url = f'{cutout_base_url}?red={df[df["filter"] == "i"]["filename"].values[0]}&green={df[df["filter"] == "r"]["filename"].values[0]}&blue={df[df["filter"] == "g"]["filename"].values[0]}&x={ra}&y={dec}&size=240&wcs=1&asinh=True&autoscale=99.750000'
-
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        if response.status_code == 200:
-            return ContentFile(BytesIO(response.content).read(), name=f"ps1_cutout.{format}")
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to fetch PS1 cutout: {e}")
-    return None
+        if os.path.getsize(path) == 0:
+            return b'' if time.time() - os.path.getmtime(path) < CUTOUT_CACHE_EMPTY_TTL else None
+        with open(path, 'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def clean_cutout_cache(max_age_days, empty_only=False):
+    """
+    Deletes cached cutouts older than max_age_days (by modification time), expired empty entries, and temporary
+    files left by interrupted writes. Cutouts already saved as data products are not affected.
+    :param max_age_days: Age in days above which cached cutouts are deleted
+    :param empty_only: Only delete the expired empty entries and temporary files
+    :return: Tuple (files deleted, bytes freed)
+    """
+    cutoff = time.time() - max_age_days * 24 * 3600
+    deleted = freed = 0
+    for root, _, filenames in os.walk(CUTOUT_CACHE_DIR):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+                expired_empty = stat.st_size == 0 and time.time() - stat.st_mtime >= CUTOUT_CACHE_EMPTY_TTL
+                stale_tmp = filename.endswith('.tmp') and time.time() - stat.st_mtime >= 3600
+                if expired_empty or stale_tmp or (not empty_only and stat.st_mtime < cutoff):
+                    os.remove(path)
+                    deleted += 1
+                    freed += stat.st_size
+            except FileNotFoundError:
+                continue  # Removed concurrently
+    return deleted, freed
+
+
+def fetch_cutout(survey, ra, dec, size=CUTOUT_SIZE):
+    """
+    Fetches a survey cutout for a given RA/Dec, from the on-disk cache if it was fetched before.
+    :param survey: 'ps1' or 'sdss'
+    :param ra: Right Ascension in degrees.
+    :param dec: Declination in degrees.
+    :param size: Cutout size in pixels
+    :return: ContentFile, or None if the survey has no image there or the download failed
+    """
+    path = cutout_cache_path(survey, ra, dec, size)
+    content = read_cached_cutout(path)
+    if content is None:
+        try:
+            content = CUTOUT_DOWNLOADERS[survey](ra, dec, size)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Failed to fetch {survey.upper()} cutout at {ra}, {dec}: {e}")
+            return None
+        # Write to a temporary file first, so concurrent readers never see a partial image
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+    if not content:
+        return None
+    return ContentFile(content, name=f"{survey}_cutout.jpg")
+
+
+def fetch_cutouts(requested, max_workers=CUTOUT_WORKERS):
+    """
+    Fetches many survey cutouts concurrently (the calls per host are also capped by http_client).
+    :param requested: Iterable of (survey, ra, dec) tuples
+    :param max_workers: Number of threads
+    :return: Dict of (survey, ra, dec) -> ContentFile or None
+    """
+    requested = list(dict.fromkeys(requested))
+    if not requested:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(requested))) as executor:
+        cutouts = executor.map(lambda request: fetch_cutout(*request), requested)
+        return dict(zip(requested, cutouts))
+
+
+def fetch_ps1_cutout(ra, dec):
+    """
+    Fetches a PS1 color composite cutout image for a given RA/Dec.
+    :param ra: Right Ascension in degrees.
+    :param dec: Declination in degrees.
+    """
+    return fetch_cutout('ps1', ra, dec)
+
 
 def fetch_sdss_cutout(ra, dec):
     """
@@ -202,15 +432,7 @@ def fetch_sdss_cutout(ra, dec):
     :param ra: Right Ascension in degrees.
     :param dec: Declination in degrees.
     """
-    url = f'https://skyserver.sdss.org/dr16/SkyServerWS/ImgCutout/getjpeg?ra={ra}&dec={dec}&scale=0.2&width=240&height=240&opt=G'
-    print(url)
-    try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        if response.status_code == 200:
-            return ContentFile(BytesIO(response.content).read(), name=f"sdss_cutout.jpg")
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to fetch SDSS cutout: {e}")
+    return fetch_cutout('sdss', ra, dec)
 
 def save_alert(candidate,discovery_datetime,filename,last_report = None):
     """
@@ -220,49 +442,60 @@ def save_alert(candidate,discovery_datetime,filename,last_report = None):
     :param filename: Name of the json file
     :param last_report: last report section from the json file
     :return: The alert instance
+
+    The candidate's latest_alert_time and alert_count are updated in the same transaction.
     """
-    #Extract the attributes from the last report
-    if last_report != {}:
-        mount = last_report.get('mount', {})
-        camera = last_report.get('camera', {})
-        fieldid = last_report.get('field', {})
-        subimage = last_report.get('cropid', {})
-        score = last_report.get('score', {})
-        ref_cutout_filename = last_report.get('ref_cutout', {})
-        new_cutout_filename = last_report.get('new_cutout', {})
-        diff_cutout_filename = last_report.get('diff_cutout', {})
-    #create the alert
-        alert = CandidateAlert.objects.create(
-            candidate = candidate,
-            filename = os.path.basename(filename),
-            discovery_datetime = discovery_datetime,
-            mount = mount,
-            camera = camera,
-            fieldid = fieldid,
-            subimage = subimage,
-            score = score,
-            ref_cutout_filename = ref_cutout_filename,
-            new_cutout_filename = new_cutout_filename,
-            diff_cutout_filename = diff_cutout_filename,
-        )
-    #If the last report is empty, ingest the attributes from the filename
-    else:
-        attributes = filename.split("_")
-        mount = attributes[0].split(".")[2]
-        camera = attributes[0].split(".")[3]
-        fieldid = attributes[3]
-        subimage = attributes[6]
-    
+    with transaction.atomic():
+        #Extract the attributes from the last report
+        if last_report != {}:
+            mount = last_report.get('mount', {})
+            camera = last_report.get('camera', {})
+            fieldid = last_report.get('field', {})
+            subimage = last_report.get('cropid', {})
+            score = last_report.get('score', {})
+            ref_cutout_filename = last_report.get('ref_cutout', {})
+            new_cutout_filename = last_report.get('new_cutout', {})
+            diff_cutout_filename = last_report.get('diff_cutout', {})
         #create the alert
-        alert = CandidateAlert.objects.create(
-            candidate = candidate,
-            filename = filename,
-            discovery_datetime = discovery_datetime,
-            mount = mount,
-            camera = camera,
-            fieldid = fieldid,
-            subimage = subimage,
+            alert = CandidateAlert.objects.create(
+                candidate = candidate,
+                filename = os.path.basename(filename),
+                discovery_datetime = discovery_datetime,
+                mount = mount,
+                camera = camera,
+                fieldid = fieldid,
+                subimage = subimage,
+                score = score,
+                ref_cutout_filename = ref_cutout_filename,
+                new_cutout_filename = new_cutout_filename,
+                diff_cutout_filename = diff_cutout_filename,
+            )
+        #If the last report is empty, ingest the attributes from the filename
+        else:
+            filename = os.path.basename(filename)
+            attributes = filename.split("_")
+            mount = attributes[0].split(".")[2]
+            camera = attributes[0].split(".")[3]
+            fieldid = attributes[3]
+            subimage = attributes[6]
+    
+            #create the alert
+            alert = CandidateAlert.objects.create(
+                candidate = candidate,
+                filename = filename,
+                discovery_datetime = discovery_datetime,
+                mount = mount,
+                camera = camera,
+                fieldid = fieldid,
+                subimage = subimage,
+            )
+
+        # Keep the denormalized alert summary on the candidate in step with the new alert
+        Candidate.objects.filter(pk=candidate.pk).update(
+            latest_alert_time=alert.created_at,
+            alert_count=F('alert_count') + 1,
         )
+    candidate.refresh_from_db(fields=['latest_alert_time', 'alert_count'])
     return alert
 
 
@@ -286,12 +519,187 @@ def add_ToO_names_to_candidate(candidate, last_report):
                 logger.error(f"Error saving ToO name for candidate {candidate.id}: {e}")
 
 
-def process_json_file(file):
+def add_survey_cutouts(candidate, surveys=('ps1', 'sdss')):
+    """
+    Fetches the PS1 and SDSS cutouts of a candidate concurrently, skipping the surveys it already has a cutout from.
+    :param candidate: Candidate instance
+    :param surveys: Surveys to fetch
+    :return: The number of cutouts added
+    """
+    existing_types = set(
+        candidate.data_products.filter(data_product_type__in=surveys).values_list('data_product_type', flat=True)
+    )
+    missing = [survey for survey in surveys if survey not in existing_types]
+    cutouts = fetch_cutouts([(survey, candidate.ra, candidate.dec) for survey in missing])
+    added = 0
+    for survey in missing:
+        cutout = cutouts[(survey, candidate.ra, candidate.dec)]
+        if cutout:
+            CandidateDataProduct.objects.create(
+                candidate=candidate,
+                datafile=cutout,
+                data_product_type=survey,
+                name=f"{candidate.name} {survey.upper()} cutout",
+            )
+            added += 1
+    return added
+
+
+def add_host_galaxy(candidate):
+    """
+    Associates a candidate with a host galaxy from GLADE, unless it already has one.
+    :param candidate: Candidate instance
+    """
+    if candidate.host_galaxy:
+        return
+    gal_name, dist_Mpc, z = associate_galaxy(candidate.ra, candidate.dec)
+    if gal_name:
+        candidate.host_galaxy = gal_name
+
+        # Assume always exist if galaxy is found
+        candidate.dist_Mpc = dist_Mpc  
+        candidate.redshift = z
+        # update() rather than save(), to not overwrite fields changed concurrently by the scanners
+        # or save_alert, and to not schedule a TNS refresh
+        Candidate.objects.filter(id=candidate.id).update(host_galaxy=gal_name, dist_Mpc=dist_Mpc, redshift=z)
+
+
+def enrich_candidate(candidate, survey_cutouts=True, forced_photometry=True):
+    """
+    Runs the slow enrichment steps of a candidate inline: survey cutouts, ATLAS and ZTF forced photometry,
+    and host galaxy association. All steps are idempotent.
+    :param candidate: Candidate instance
+    :param survey_cutouts: Fetch the PS1 and SDSS cutouts
+    :param forced_photometry: Query ATLAS and ZTF for forced photometry
+    """
+    if survey_cutouts:
+        add_survey_cutouts(candidate)
+
+    # Forced Photometry
+    if forced_photometry:
+        try:
+            request_atlas_fp(candidate)  # Queued, run by the atlas_jobs manager
+        except Exception as e:
+            print(f"Error requesting Atlas photometry for candidate {candidate.id}: {e}")
+        
+        try:
+            get_ztf_fp(candidate)
+        except Exception as e:
+            print(f"Error fetching ZTF photometry for candidate {candidate.id}: {e}")
+    
+    # Associate with a host galaxy
+    try:
+        add_host_galaxy(candidate)
+    except Exception as e:
+        print(f"Error trying to associate galaxy for candidate {candidate.id}: {e}")
+
+
+def schedule_candidate_enrichment(candidate, survey_cutouts=True, forced_photometry=True):
+    """
+    Runs the enrichment steps of a candidate, either inline or, if settings.CANDIDATE_ENRICHMENT_ASYNC is set,
+    by sending them to the dramatiq enrichment actors (see tasks.py) so ingestion returns immediately.
+    Takes the same arguments as enrich_candidate.
+    """
+    if not getattr(settings, 'CANDIDATE_ENRICHMENT_ASYNC', False):
+        enrich_candidate(candidate, survey_cutouts=survey_cutouts, forced_photometry=forced_photometry)
+        return
+
+    # Each step is guarded, so a broker or database hiccup only loses that step and not the ingestion of the alert
+    from .tasks import enrich_survey_cutouts, enrich_ztf_photometry, enrich_host_galaxy
+    if survey_cutouts:
+        run_optional_step(f"sending survey cutouts of candidate {candidate.id}", enrich_survey_cutouts.send, candidate.id)
+    if forced_photometry:
+        # Queued, run by the atlas_jobs manager
+        run_optional_step(f"requesting Atlas photometry for candidate {candidate.id}", request_atlas_fp, candidate)
+        run_optional_step(f"sending ZTF photometry of candidate {candidate.id}", enrich_ztf_photometry.send, candidate.id)
+    if not candidate.host_galaxy:
+        run_optional_step(f"sending host galaxy of candidate {candidate.id}", enrich_host_galaxy.send, candidate.id)
+
+
+class StageTimer:
+    """
+    Records the time spent between consecutive laps into a dict of stage timings (seconds).
+    """
+
+    def __init__(self, timings=None):
+        self.timings = timings if timings is not None else {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = round(self.timings.get(stage, 0) + now - self._last, 3)
+        self._last = now
+
+
+def add_photometry_from_at_report(candidate, at_report):
+    """
+    Adds the non-detection and detection of the AT report, for old json files without a last report.
+    :param candidate: Candidate instance
+    :param at_report: at_report section from the json file
+    """
+    non_detection = at_report.get('non_detection', {})
+    if non_detection:
+        obs_date = parse_datetime(non_detection.get('obsdate', [None])[0].replace(" UTC", ""))
+        limit = non_detection.get('flux', None)
+        filter_value = non_detection.get('filter_value', None)
+        telescope = "LAST"  # You can map instrument_value to actual telescope name
+        instrument = "LAST-CAM"  # You can map instrument_value to actual instrument name
+
+        CandidatePhotometry.objects.create(
+            candidate=candidate,
+            obs_date=obs_date,
+            limit = limit,
+            filter_band=str(filter_value),  # Use a mapping if needed to human-readable filter names
+            telescope=telescope,
+            instrument=instrument
+        )
+
+    photometry_data = at_report.get('photometry', {}).get('photometry_group', {})
+    obs_date = photometry_data.get('obsdate', [None])[0]
+    if obs_date:
+        obs_date = parse_datetime(obs_date.replace(" UTC", ""))
+        magnitude = photometry_data.get('flux', None)
+        magnitude_error = 0  # Add logic to calculate or store flux error if available
+        filter_value = photometry_data.get('filter_value', None)
+        telescope = "LAST"  # You can map instrument_value to actual telescope name
+        instrument = "LAST-CAM"  # You can map instrument_value to actual instrument name
+
+        CandidatePhotometry.objects.create(
+            candidate=candidate,
+            obs_date=obs_date,
+            magnitude=magnitude,
+            magnitude_error=magnitude_error,
+            filter_band=str(filter_value),  # Use a mapping if needed to human-readable filter names
+            telescope=telescope,
+            instrument=instrument
+        )
+
+
+def run_optional_step(description, step, *args, **kwargs):
+    """
+    Runs an ingestion step that comes after the alert was committed. Errors are logged and do not fail
+    the file, since processing it again would add a second alert.
+    """
+    try:
+        step(*args, **kwargs)
+    except Exception as e:
+        logger.error(f"Error {description}: {e}")
+
+
+def process_json_file(file, candidate_index=None, stage_timings=None, ledger_entry=None, match=None):
     """
     Processes the uploaded JSON file and adds candidates to the database.
+    The candidate, the alert and the json data product are written in one transaction, in which the ledger entry
+    is also marked done. The later steps (ToO name, photometry, cutouts, enrichment) only log their errors.
     :param file: Ingested json file object 
+    :param candidate_index: Optional SkyIndex of candidate positions used for dedup instead of a cone search query.
+                            New candidates are added to it.
+    :param stage_timings: Optional dict filled with the seconds spent in each stage (parse, dedup, alert, enrichment)
+    :param ledger_entry: Optional IngestedFile of the file, marked done when the alert is committed
+    :param match: Optional AlertMatch of the file from match_json_files, used for dedup
     :return: The number of candidates successfully added
     """
+    timer = StageTimer(stage_timings)
     try:
         # Read and decode the file content before parsing as JSON
         file_content = file.read().decode('utf-8')  # Decode to string
@@ -310,197 +718,309 @@ def process_json_file(file):
     dec = at_report.get('Dec', {}).get('value')
     discovery_datetime = at_report.get('discovery_datetime',{})[0]
     discovery_datetime = discovery_datetime[:discovery_datetime.find('UTC')-1]
+    timer.lap('parse')
     
-    candidate_exists, existing_candidate = check_candidate_exists_by_cone(float(ra), float(dec), radius_arcsec=3)
-    if candidate_exists:
-        save_alert(existing_candidate,discovery_datetime,file.name,last_report)
-        if last_report != {}:
+    candidate_exists, existing_candidate = find_existing_candidate(float(ra), float(dec), radius_arcsec=3,
+                                                                   candidate_index=candidate_index, match=match)
+    timer.lap('dedup')
+
+    with transaction.atomic():
+        if candidate_exists:
+            candidate = existing_candidate
+        else:
+            # Save to the database
+            candidate = Candidate.objects.create(ra=ra, dec=dec,discovery_datetime=discovery_datetime)
+            candidates_added += 1
+        save_alert(candidate,discovery_datetime,file.name,last_report)
+        #save the json file as a data product
+        if not candidate_exists or last_report != {}:
             wrapped_file = File(file)
             wrapped_file.name = os.path.basename(file.name)
             CandidateDataProduct.objects.create(
-            candidate=existing_candidate,
-            datafile=wrapped_file,
-            data_product_type='json',
-            name = wrapped_file.name
-            )
-            add_ToO_names_to_candidate(existing_candidate,last_report)
-            add_photometry_from_last_report(existing_candidate,last_report)    
-            #update candidate cutouts
-            update_candidate_cutouts(existing_candidate)
-            
-            # Query for forced photometry
-            get_atlas_fp(existing_candidate)
-            get_ztf_fp(existing_candidate)
-
-        if not existing_candidate.host_galaxy:
-            gal_name, dist_Mpc, z = associate_galaxy(existing_candidate.ra, existing_candidate.dec)
-            if gal_name:
-                existing_candidate.host_galaxy = gal_name
-                
-                # Assume always exist if galaxy is found
-                existing_candidate.dist_Mpc = dist_Mpc  
-                existing_candidate.redshift = z
-                existing_candidate.save()
-
-        return None
-
-    # Save to the database
-    candidate = Candidate.objects.create(ra=ra, dec=dec,discovery_datetime=discovery_datetime)
-    save_alert(candidate,discovery_datetime,file.name,last_report)
-    #save the json file as a data product
-    wrapped_file = File(file)
-    wrapped_file.name = os.path.basename(file.name)
-    CandidateDataProduct.objects.create(
-            candidate=candidate,
-            datafile=wrapped_file,
-            data_product_type='json',
-            name=os.path.basename(file.name)
-        )
-    candidates_added += 1
-
-    # If there is no last report (old json format), add photometry from the AT tns report
-    if last_report == {}:
-        non_detection = at_report.get('non_detection', {})
-        if non_detection:
-            obs_date = parse_datetime(non_detection.get('obsdate', [None])[0].replace(" UTC", ""))
-            limit = non_detection.get('flux', None)
-            filter_value = non_detection.get('filter_value', None)
-            telescope = "LAST"  # You can map instrument_value to actual telescope name
-            instrument = "LAST-CAM"  # You can map instrument_value to actual instrument name
-
-            CandidatePhotometry.objects.create(
                 candidate=candidate,
-                obs_date=obs_date,
-                limit = limit,
-                filter_band=str(filter_value),  # Use a mapping if needed to human-readable filter names
-                telescope=telescope,
-                instrument=instrument
+                datafile=wrapped_file,
+                data_product_type='json',
+                name=wrapped_file.name
             )
+        # If there is no last report (old json format), add photometry from the AT tns report
+        if not candidate_exists and last_report == {}:
+            add_photometry_from_at_report(candidate, at_report)
+        if ledger_entry is not None:
+            ledger_entry.status = IngestedFile.STATUS_DONE
+            ledger_entry.candidate = candidate
+            ledger_entry.save(update_fields=['status', 'candidate', 'updated_at'])
+    if not candidate_exists and candidate_index is not None:
+        candidate_index.add(candidate.id, float(ra), float(dec))
 
-        photometry_data = at_report.get('photometry', {}).get('photometry_group', {})
-        obs_date = photometry_data.get('obsdate', [None])[0]
-        if obs_date:
-            obs_date = parse_datetime(obs_date.replace(" UTC", ""))
-            magnitude = photometry_data.get('flux', None)
-            magnitude_error = 0  # Add logic to calculate or store flux error if available
-            filter_value = photometry_data.get('filter_value', None)
-            telescope = "LAST"  # You can map instrument_value to actual telescope name
-            instrument = "LAST-CAM"  # You can map instrument_value to actual instrument name
-
-            CandidatePhotometry.objects.create(
-                candidate=candidate,
-                obs_date=obs_date,
-                magnitude=magnitude,
-                magnitude_error=magnitude_error,
-                filter_band=str(filter_value),  # Use a mapping if needed to human-readable filter names
-                telescope=telescope,
-                instrument=instrument
-            )
     # If there is a last report, add photometry and cutouts from the last report
     if last_report != {}:
-        try:
-            add_photometry_from_last_report(candidate,last_report)
-        except Exception as e:
-            print(f"Error adding photometry: {e}")
+        run_optional_step(f"saving ToO name of candidate {candidate.id}",
+                          add_ToO_names_to_candidate, candidate, last_report)
+        run_optional_step(f"adding photometry of candidate {candidate.id}",
+                          add_photometry_from_last_report, candidate, last_report)
+        #cutout images ingestion
+        run_optional_step(f"adding cutouts of candidate {candidate.id}", update_candidate_cutouts, candidate)
+    timer.lap('alert')
 
-        add_ToO_names_to_candidate(candidate,last_report)
+    if candidate_exists:
+        # Forced photometry (only for alerts with a last report) and host galaxy, if still missing
+        run_optional_step(f"scheduling enrichment of candidate {candidate.id}", schedule_candidate_enrichment,
+                          candidate, survey_cutouts=False, forced_photometry=last_report != {})
+        timer.lap('enrichment')
+        return None
 
-        #cutout images ingestion
-        update_candidate_cutouts(candidate)
+    # Survey cutouts, forced photometry and host galaxy
+    run_optional_step(f"scheduling enrichment of candidate {candidate.id}", schedule_candidate_enrichment, candidate)
+    timer.lap('enrichment')
+
+    return candidates_added
     
-    #PS1 cutout
-    try:
-        ps1_cutout = fetch_ps1_cutout(ra, dec)
-    except Exception as e:
-        ps1_cutout = None
-    if ps1_cutout:
-        CandidateDataProduct.objects.create(
-            candidate=candidate,
-            datafile=ps1_cutout,
-            data_product_type='ps1',
-            name=f"{candidate.name} PS1 cutout",
-        )
-    #SDSS cutout
-    try:
-        sdss_cutout = fetch_sdss_cutout(ra, dec)
-    except Exception as e:
-        print(f"Error fetching SDSS cutout for candidate {candidate.id}: {e}")
-        sdss_cutout = None
-    if sdss_cutout:
-        CandidateDataProduct.objects.create(
-            candidate=candidate,
-            datafile=sdss_cutout,
-            data_product_type='sdss',
-            name=f"{candidate.name} SDSS cutout",
-        )
 
-    # Forced Photometry
+def read_alert_position(json_file):
+    """
+    Reads the RA/Dec of the alert in a json file.
+    :param json_file: Path to the json file
+    :return: Tuple (ra, dec) in degrees, or (None, None) if the file can't be read
+    """
     try:
-        get_atlas_fp(candidate)
-    except Exception as e:
-        print(f"Error fetching Atlas photometry for candidate {candidate.id}: {e}")
-    
+        with open(json_file, 'rb') as file:
+            at_report = json.load(file).get('at_report', {})
+        return float(at_report['RA']['value']), float(at_report['Dec']['value'])
+    except Exception:
+        return None, None
+
+
+def match_json_files(json_files, candidate_index, radius_arcsec=3):
+    """
+    Matches the alerts of a batch of json files against the candidate index in one vectorized query.
+    :param json_files: List of json file paths
+    :param candidate_index: SkyIndex of the existing candidates
+    :param radius_arcsec: Dedup radius in arcseconds
+    :return: Dict of json file path -> AlertMatch, for the files whose position could be read
+    """
+    positions = {json_file: read_alert_position(json_file) for json_file in json_files}
+    valid = [json_file for json_file, (ra, dec) in positions.items() if ra is not None]
+    if not valid:
+        return {}
+    ras = np.array([positions[json_file][0] for json_file in valid])
+    decs = np.array([positions[json_file][1] for json_file in valid])
+    index_size = len(candidate_index)
+    matched_ids = candidate_index.match(ras, decs, radius_arcsec / 3600.0)
+    return {json_file: AlertMatch(ra, dec, candidate_id, index_size)
+            for json_file, ra, dec, candidate_id in zip(valid, ras, decs, matched_ids)}
+
+
+def partition_json_files(json_files, candidate_index, radius_arcsec=3, matches=None):
+    """
+    Splits json files into groups that can be ingested independently of each other.
+    Files within the dedup radius of each other, or matching the same existing candidate, end up in the
+    same group, so two workers never create (or update) the same candidate.
+    :param json_files: List of json file paths
+    :param candidate_index: SkyIndex of the existing candidates
+    :param radius_arcsec: Dedup radius in arcseconds
+    :param matches: Optional result of match_json_files for these files
+    :return: List of lists of file paths, largest group first
+    """
+    radius_deg = radius_arcsec / 3600.0
+    if matches is None:
+        matches = match_json_files(json_files, candidate_index, radius_arcsec)
+    valid = [json_file for json_file in json_files if json_file in matches]
+    # Unreadable files get a group of their own, their error is reported when they are processed
+    groups = [[json_file] for json_file in json_files if json_file not in matches]
+    if not valid:
+        return groups
+
+    ras = np.array([matches[json_file].ra for json_file in valid])
+    decs = np.array([matches[json_file].dec for json_file in valid])
+    labels = group_nearby_positions(ras, decs, radius_deg)
+    matched_ids = [matches[json_file].candidate_id for json_file in valid]
+
+    # Merge the groups matching the same existing candidate (union-find over the group labels)
+    root = list(range(labels.max() + 1))
+
+    def find(label):
+        while root[label] != label:
+            root[label] = root[root[label]]
+            label = root[label]
+        return label
+
+    label_of_candidate = {}
+    for label, candidate_id in zip(labels, matched_ids):
+        if candidate_id is None:
+            continue
+        if candidate_id in label_of_candidate:
+            root[find(label)] = find(label_of_candidate[candidate_id])
+        else:
+            label_of_candidate[candidate_id] = label
+
+    grouped = defaultdict(list)
+    for json_file, label in zip(valid, labels):
+        grouped[find(label)].append(json_file)
+    groups.extend(grouped.values())
+    return sorted(groups, key=len, reverse=True)
+
+
+def alert_files_with_data(filenames):
+    """
+    Returns the json files that already have a json data product or an alert, i.e. whose alert was committed
+    (also for files ingested through the upload form, which have no ledger entry). Processing them again would
+    add a second alert.
+    :param filenames: Base names of json files
+    :return: Set of base names
+    """
+    filenames = list(filenames)
+    products = CandidateDataProduct.objects.filter(data_product_type='json', name__in=filenames).values_list('name', flat=True)
+    alerts = CandidateAlert.objects.filter(filename__in=filenames).values_list('filename', flat=True)
+    return set(products) | set(alerts)
+
+
+def is_file_ingested(filename):
+    """
+    Checks whether a json file was already ingested, according to the ledger or its alert data.
+    :param filename: Base name of the json file
+    """
+    return (IngestedFile.objects.filter(filename=filename, status=IngestedFile.STATUS_DONE).exists()
+            or bool(alert_files_with_data([filename])))
+
+
+def ingest_json_path(json_file, candidate_index=None, match=None):
+    """
+    Ingests a single json file from disk, logging the outcome and how long it took.
+    The attempt is recorded in the IngestedFile ledger (status, attempts, error and stage timings).
+    :param json_file: Path to the json file
+    :param candidate_index: Optional SkyIndex used for dedup
+    :param match: Optional AlertMatch of the file from match_json_files
+    :return: Tuple (candidates added, seconds spent)
+    """
+    start = time.perf_counter()
+    filename = os.path.basename(json_file)
+    entry, _ = IngestedFile.objects.get_or_create(filename=filename)
+    entry.status = IngestedFile.STATUS_PROCESSING
+    entry.attempts += 1
+    entry.save(update_fields=['status', 'attempts', 'updated_at'])
+
+    candidates_added = 0
+    stage_timings = {}
     try:
-        get_ztf_fp(candidate)
+        stat = os.stat(json_file)
+        entry.size = stat.st_size
+        entry.mtime = make_aware(datetime.fromtimestamp(stat.st_mtime))
+        with open(json_file, 'rb') as file:
+            entry.content_hash = hashlib.sha256(file.read()).hexdigest()
+            file.seek(0)
+            candidates_added = process_json_file(file, candidate_index=candidate_index,
+                                                 stage_timings=stage_timings, ledger_entry=entry, match=match) or 0
+            if candidates_added:
+                logger.info(f"Processed {filename}: {candidates_added} candidate(s) added.")
+            else:
+                logger.warning(f"Skipping {filename}: Candidate already exists or no RA/Dec found.")
+        entry.status = IngestedFile.STATUS_DONE
+        entry.error = None
     except Exception as e:
-        print(f"Error fetching ZTF photometry for candidate {candidate.id}: {e}")
-    
-    # Associate with a host galaxy
+        logger.error(f"Error processing {filename}: {e}")
+        traceback.print_exc()
+        entry.status = IngestedFile.STATUS_FAILED
+        entry.error = traceback.format_exc()
+    elapsed = time.perf_counter() - start
+    logger.info(f"Ingesting {filename} took {elapsed:.1f} s.")
+
+    entry.stage_timings = stage_timings
+    if entry.candidate_id is None:
+        entry.candidate_id = (CandidateDataProduct.objects.filter(data_product_type='json', name=filename)
+                              .values_list('candidate_id', flat=True).first())
+    entry.save()
+    return candidates_added, elapsed
+
+
+def ingest_json_file_group(json_files, candidate_index=None, matches=None):
+    """
+    Ingests a group of json files one after the other, in a worker thread.
+    Each worker thread uses its own database connection, which is closed when the group is done.
+    :param matches: Optional result of match_json_files
+    :return: List of (candidates added, seconds spent) tuples, one per file
+    """
+    matches = matches or {}
     try:
-        gal_name, dist_Mpc, z = associate_galaxy(candidate.ra, candidate.dec)
-        if gal_name:
-            candidate.host_galaxy = gal_name
-            
-            # Assume always exist if galaxy is found
-            candidate.dist_Mpc = dist_Mpc  
-            candidate.redshift = z
-            candidate.save()
-    except Exception as e:
-        print(f"Error trying to associate galaxy for candidate {candidate.id}: {e}")
+        return [ingest_json_path(json_file, candidate_index, matches.get(json_file)) for json_file in json_files]
+    finally:
+        connection.close()
 
-    return candidates_added
-    
 
-def process_multiple_json_files(directory_path,cutoff=3):
+def process_multiple_json_files(directory_path,cutoff=3,workers=1,retry_failed=False,max_attempts=3):
     """
     Processes new JSON files from the last day that are not already in the database.
+    New files are found by checking just the recent file names against the IngestedFile ledger.
     :param directory_path: Path to the directory containing JSON files
+    :param cutoff: Only files modified in the last `cutoff` days are considered
+    :param workers: Number of files processed concurrently. With more than one worker, the files are first
+                    partitioned by sky position so that workers never touch the same candidate.
+    :param retry_failed: Also retry files that failed before the cutoff window (or got stuck while processing)
+    :param max_attempts: Files are retried until they failed this many times
     :return: The total number of candidates successfully added
     """
 
-    # Step 1: Get JSON names already in DB
-    existing_json_names = set(
-        CandidateDataProduct.objects.filter(data_product_type='json')
-        .values_list('name', flat=True)
-    )
+    # Step 1: Collect recent JSON files (24 hours ago by default)
+    cutoff_time = (datetime.now() - timedelta(days=cutoff)).timestamp()
+    recent_files = {
+        entry.name: entry.path for entry in os.scandir(directory_path)
+        if entry.name.endswith('.json') and entry.is_file() and entry.stat().st_mtime > cutoff_time
+    }
 
-    # Step 2: Set time cutoff to 24 hours ago
-    cutoff_time = datetime.now() - timedelta(days=cutoff)
+    # Step 2: Check just these names against the ledger
+    ledger = IngestedFile.objects.in_bulk(list(recent_files), field_name='filename')
 
-    # Step 3: Collect new JSON files
-    json_files = [
-        file for file in glob.glob(os.path.join(directory_path, "*.json"))
-        if datetime.fromtimestamp(os.path.getmtime(file)) > cutoff_time
-        and os.path.basename(file) not in existing_json_names
+    # Step 3: Select new files, and failed ones that may be retried
+    candidate_names = [
+        name for name in recent_files
+        if name not in ledger
+        or (ledger[name].status == IngestedFile.STATUS_FAILED and ledger[name].attempts < max_attempts)
     ]
+    retry_names = []
+    if retry_failed:
+        stuck_before = make_aware(datetime.now() - timedelta(hours=1))
+        retry_names = [
+            name for name in IngestedFile.objects.filter(
+                Q(status=IngestedFile.STATUS_FAILED) | Q(status=IngestedFile.STATUS_PROCESSING, updated_at__lt=stuck_before),
+                attempts__lt=max_attempts,
+            ).values_list('filename', flat=True)
+            if name not in recent_files and os.path.exists(os.path.join(directory_path, name))
+        ]
+    # Files uploaded through the web form, or whose alert was committed before a later step failed,
+    # already have their data and are not processed again
+    with_data = alert_files_with_data(candidate_names + retry_names)
+    IngestedFile.objects.filter(filename__in=with_data).exclude(status=IngestedFile.STATUS_DONE).update(
+        status=IngestedFile.STATUS_DONE)
+    json_files = [recent_files[name] for name in candidate_names if name not in with_data]
+    json_files += [os.path.join(directory_path, name) for name in retry_names if name not in with_data]
 
     logger.info(f"Found {len(json_files)} new files to process.")
     total_candidates_added = 0
+    if not json_files:
+        logger.info(f"Total candidates added: {total_candidates_added}")
+        return total_candidates_added
+
+    # Build the spatial index for dedup once per run, and match all the alerts against it in one query
+    candidate_index = build_candidate_index()
+    matches = match_json_files(json_files, candidate_index)
 
     # Step 4: Process each new file
-    for json_file in json_files:
-        try:
-            with open(json_file, 'rb') as file:
-                candidates_added = process_json_file(file)
-                if candidates_added:
-                    logger.info(f"Processed {os.path.basename(json_file)}: {candidates_added} candidate(s) added.")
-                    total_candidates_added += candidates_added
-                else:
-                    logger.warning(f"Skipping {os.path.basename(json_file)}: Candidate already exists or no RA/Dec found.")
-        except Exception as e:
-            logger.error(f"Error processing {os.path.basename(json_file)}: {e}")
-            traceback.print_exc()
+    start = time.perf_counter()
+    if workers > 1:
+        groups = partition_json_files(json_files, candidate_index, matches=matches)
+        logger.info(f"Processing {len(json_files)} files in {len(groups)} sky groups with {workers} workers.")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = [result
+                       for group_results in executor.map(ingest_json_file_group, groups, [candidate_index] * len(groups),
+                                                         [matches] * len(groups))
+                       for result in group_results]
+    else:
+        results = [ingest_json_path(json_file, candidate_index, matches.get(json_file)) for json_file in json_files]
+    elapsed = time.perf_counter() - start
 
+    total_candidates_added = sum(candidates_added for candidates_added, _ in results)
+    latencies = [latency for _, latency in results]
+    logger.info(f"Processed {len(results)} files in {elapsed:.1f} s ({len(results) / max(elapsed, 1e-9):.2f} files/s), "
+                f"per-file latency mean {np.mean(latencies):.1f} s, max {np.max(latencies):.1f} s.")
     logger.info(f"Total candidates added: {total_candidates_added}")
     return total_candidates_added
 
@@ -510,19 +1030,45 @@ def check_target_exists_for_candidate(candidate_id, radius_arcsec=3):
     Checks if a target exists for a given candidate using a cone search.
     :param candidate_id: The ID of the candidate.
     :param radius_arcsec: Radius of the cone search in arcseconds (default is 3").
-    :return: The first matching Target object or None if no match is found.
+    :return: The nearest matching Target object or None if no match is found.
     """
     # Get the candidate
     candidate = get_object_or_404(Candidate, id=candidate_id)
 
-    # Convert radius to degrees
-    radius_deg = radius_arcsec / 3600.0
-
     # Perform a cone search around the candidate's RA/Dec
-    queryset = Target.objects.all()
-    matching_targets = cone_search_filter(queryset, candidate.ra, candidate.dec, radius_deg)
-    # Return the first matching target if any, or None
-    return matching_targets.first()
+    return resolve_targets_for_candidates([candidate], radius_arcsec)[candidate.id]
+
+
+def resolve_targets_for_candidates(candidates, radius_arcsec=3):
+    """
+    Finds the matching Target for each of a batch of candidates using a single query.
+    The query selects targets in the HEALPix pixels overlapping any of the cones (TargetHealpix), and
+    the exact separation is then computed in memory on those few rows only.
+    :param candidates: Iterable of Candidate instances (e.g. one page of the list view).
+    :param radius_arcsec: Radius of the cone search in arcseconds (default is 3").
+    :return: Dict mapping candidate id to the nearest matching Target, or None if there is no match.
+    """
+    candidates = list(candidates)
+    matches = {candidate.id: None for candidate in candidates}
+    if not candidates:
+        return matches
+
+    radius_deg = radius_arcsec / 3600.0
+    pixels = Q()
+    for candidate in candidates:
+        pixels |= healpix_cone_q(candidate.ra, candidate.dec, radius_deg, field='healpix_index__healpix')
+    targets = list(Target.objects.filter(pixels))
+    if not targets:
+        return matches
+
+    target_ra = np.array([target.ra for target in targets], dtype=float)
+    target_dec = np.array([target.dec for target in targets], dtype=float)
+    for candidate in candidates:
+        separation = angular_separation(candidate.ra, candidate.dec, target_ra, target_dec)
+        nearest = int(np.argmin(separation))
+        if separation[nearest] <= radius_deg:
+            matches[candidate.id] = targets[nearest]
+    return matches
 
 
 def transfer_candidate_photometry_to_target(candidate, target):
@@ -532,13 +1078,13 @@ def transfer_candidate_photometry_to_target(candidate, target):
     :param target: Target instance
     """
     # Query all photometry for the candidate
-    photometry_entries = candidate.photometry.all()
+    photometry_entries = list(candidate.photometry.all())
+    obs_mjds = datetime_to_mjd([entry.obs_date for entry in photometry_entries])
 
-    for entry in photometry_entries:
+    for entry, obs_mjd in zip(photometry_entries, obs_mjds):
         # Prepare the JSON value for ReducedDatum
-        print(Time(entry.obs_date.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S"), format='iso').mjd)
         value = {
-            "time": Time(entry.obs_date.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S"), format='iso').mjd,  # Store as mjd
+            "time": float(obs_mjd),  # Store as mjd
             "filter": entry.filter_band,
             "magnitude": entry.magnitude,
             "error": entry.magnitude_error,
@@ -660,7 +1206,7 @@ def tns_cone_search(ra, dec, radius=3.0):
     }
     # Perform the request
     try:
-        response = requests.post(endpoint, headers=headers, data=payload)
+        response = http_post(endpoint, headers=headers, data=payload)
         response.raise_for_status()  # Raise an error for bad status codes
         return response.json()  # Parse the JSON response
     except requests.RequestException as e:
@@ -753,7 +1299,7 @@ def send_json_tns_report(report):
     headers = {'User-Agent': tns_marker}
     json_read = json.dumps(report, indent = 4)
     json_data = {'api_key': TNS_API_KEY, 'data': json_read}
-    response = requests.post(json_url, headers = headers, data = json_data)
+    response = http_post(json_url, headers = headers, data = json_data)
     return response
 
 
@@ -773,7 +1319,7 @@ def send_tns_reply(id_report):
     tns_marker = 'tns_marker{"tns_id": "' + str(TNS_BOT_ID) + '", "type": "bot", "name": "' + TNS_BOT_NAME + '"}'
     headers = {'User-Agent': tns_marker}
     reply_data = {'api_key': TNS_API_KEY, 'report_id': id_report}
-    response = requests.post(reply_url, headers = headers, data = reply_data,timeout=30)
+    response = http_post(reply_url, headers = headers, data = reply_data)
     return response
 
 
@@ -912,7 +1458,7 @@ def get_horizons_data(candidate_id):
     }
 
     # Make the API request
-    response = requests.get(base_url, params=params)
+    response = http_get(base_url, params=params)
     data = response.json()
     if data['data_first_pass']:
         return data
@@ -8,6 +8,7 @@ import astropy.units as u
 
 # Django imports
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse
 from django.contrib import messages
 from django.utils.safestring import mark_safe
 from django.urls import reverse
@@ -15,7 +16,6 @@ from django.core.paginator import Paginator
 from datetime import timedelta, datetime
 from django.utils.timezone import now
 from django.utils.dateparse import parse_datetime
-from django.db.models import Subquery, OuterRef
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.conf import settings
 from django.db.models import Q
@@ -24,9 +24,10 @@ from django.db.models import Q
 from .forms import FileUploadForm
 from .utils import process_json_file, add_candidate_as_target, check_target_exists_for_candidate,\
                    send_tns_report,update_candidate_cutouts,tns_report_details,\
-                   get_horizons_data, set_reported_by_LAST
+                   get_horizons_data, set_reported_by_LAST, prefetch_latest_cutouts, prefetch_latest_alerts,\
+                   resolve_targets_for_candidates, CUTOUT_TYPES
 from .models import Candidate,CandidateDataProduct,CandidateAlert
-from .photometry_utils import generate_photometry_graph, get_atlas_fp, get_ztf_fp
+from .photometry_utils import get_light_curve, request_atlas_fp, get_ztf_fp
 from .astro_colibri import prepare_astro_colibri_data, send_astro_colibri
 
 
@@ -96,15 +97,15 @@ def delete_candidate_view(request):
 
 def refresh_atlas_view(request, candidate_id):
     """
-    Query Atlas for photometry for a candidate.
-    Does not add photometry that already exists.
+    Request Atlas photometry for a candidate. The request is queued and the photometry is added
+    by the atlas_jobs manager when ATLAS is done. Does not add photometry that already exists.
     """
     candidate = get_object_or_404(Candidate, id=candidate_id)
     return_url = request.POST.get('return_url', reverse('candidates:list'))
     try:
         daysago = request.POST.get('daysago')
-        get_atlas_fp(candidate, int(daysago))
-        messages.success(request, f"Atlas photometry was updated for {candidate.name}.")
+        request_atlas_fp(candidate, int(daysago))
+        messages.success(request, f"Atlas photometry was requested for {candidate.name}, it will appear once ATLAS is done.")
     except Exception as e:
         messages.error(request, f"Failed to refresh Atlas for {candidate.name}: {e}")
 
@@ -157,6 +158,29 @@ def refresh_ztf_view(request, candidate_id):
     return redirect(return_url)
 
 
+def enrich_candidates(candidates):
+    """
+    Build the per-candidate display data (target, cutouts, last alert) for the list page.
+    The light curves are loaded by the browser from candidate_photometry_json.
+    Only called on the current page of candidates, so the cost does not grow with the filter window.
+    :param candidates: Iterable of Candidate instances (usually a page of the list queryset)
+    :return: List of dicts, one per candidate
+    """
+    candidates = prefetch_latest_cutouts(candidates, CUTOUT_TYPES)
+    candidates = prefetch_latest_alerts(candidates)
+    targets = resolve_targets_for_candidates(candidates)
+
+    return [
+        {
+            'candidate': candidate,
+            'target': targets[candidate.id],  # Include Target if it exists
+            'cutouts': [candidate.latest_cutouts[cutout_type] for cutout_type in CUTOUT_TYPES],
+            'last_alert': candidate.last_alert,
+        }
+        for candidate in candidates
+    ]
+
+
 @login_required
 @user_passes_test(lambda user: user.groups.filter(name='LAST general').exists())
 def candidate_list_view(request):
@@ -217,14 +241,8 @@ def candidate_list_view(request):
             candidates = candidates.filter(discovery_datetime__gte=discovery_date)
         except ValueError:
             pass  # invalid date format, ignore
-    # Annotate candidates with the latest alert timestamp
-    candidates = candidates.annotate(
-        latest_alert_time=Subquery(
-            CandidateAlert.objects.filter(candidate=OuterRef('pk'))
-            .order_by('-created_at')
-            .values('created_at')[:1]
-        )
-    ).order_by('-latest_alert_time')
+    # Order by the latest alert timestamp (denormalized and indexed on Candidate)
+    candidates = candidates.order_by('-latest_alert_time')
 
     # Get filter values from the request
     start_datetime = request_params['start_datetime']
@@ -246,33 +264,16 @@ def candidate_list_view(request):
     if end_datetime:
         candidates = candidates.filter(latest_alert_time__lte=end_datetime)
     
-    cutout_types = ['ps1', 'ref', 'new', 'diff','sdss']
-    
-    candidate_status = [
-        {
-            'candidate': candidate,
-            'target': check_target_exists_for_candidate(candidate.id),  # Include Target if it exists
-            'graph': generate_photometry_graph(candidate),  # Generate photometry graph
-            'cutouts': [
-                CandidateDataProduct.objects.filter(candidate=candidate, data_product_type=cutout_type)
-                    .order_by('-created_at')
-                    .first()
-                for cutout_type in cutout_types
-            ],
-            'last_alert': CandidateAlert.objects.filter(candidate=candidate).order_by('-created_at').first(),
-        }
-        for candidate in candidates
-    ]
-
-    # Apply pagination
+    # Apply pagination on the queryset, so only the visible page is enriched
     items_per_page = request_params['items_per_page']
     try:
         items_per_page = int(items_per_page)
     except ValueError:
         items_per_page = 25
-    paginator = Paginator(candidate_status, items_per_page) 
+    paginator = Paginator(candidates, items_per_page) 
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    page_obj.object_list = enrich_candidates(page_obj.object_list)
     
     # Construct query string without 'page' parameter for pagination links
     parsed = urlparse(request.get_full_path())
@@ -284,8 +285,8 @@ def candidate_list_view(request):
         **request_params,
 
         'start_datetime': start_datetime,  # override in case not supplied, and then changed to "now"
-        'candidate_status': candidate_status,
-        'candidate_count': candidates.count(),
+        'candidate_status': page_obj.object_list,
+        'candidate_count': paginator.count,
         'page_obj': page_obj,
         'query_without_page': query_without_page,
         'tns_test': settings.TNS_TEST,
@@ -500,6 +501,17 @@ def update_cutouts_view(request, candidate_id):
     # Redirect back to the filtered candidate list
     return redirect(f"{reverse('candidates:list')}?filter={filter_value}")
 
+@login_required
+@user_passes_test(lambda user: user.groups.filter(name='LAST general').exists())
+def candidate_photometry_json(request, candidate_id):
+    """
+    Columnar photometry of a candidate (raw and binned, per telescope/band), plotted in the browser.
+    Only used by the candidate list, the detail page (open to everyone) gets the same payload inline.
+    """
+    candidate = get_object_or_404(Candidate, id=candidate_id)
+    return JsonResponse(get_light_curve(candidate))
+
+
 def candidate_detail(request, candidate_id):
     request_params = extract_params_from_request(request)
     candidate = get_object_or_404(Candidate, id=candidate_id)
@@ -512,24 +524,31 @@ def candidate_detail(request, candidate_id):
     b = coord.galactic.b.degree
     coords = {'l': l, 'b': b,'ra_hms': ra_hms, 'dec_dms': dec_dms}
 
-    # Separate PS1 & SDSS cutouts
-    ps1_cutout = candidate.data_products.filter(data_product_type="ps1").first()
-    sdss_cutout = candidate.data_products.filter(data_product_type="sdss").first()
-    # Group cutouts by the minute they were created
+    # Separate PS1 & SDSS cutouts (newest of each)
+    prefetch_latest_cutouts([candidate], ['ps1', 'sdss'])
+    ps1_cutout = candidate.latest_cutouts['ps1']
+    sdss_cutout = candidate.latest_cutouts['sdss']
+    # Group cutouts by the minute they were created, and collect the json files for the alerts
     grouped_cutouts = defaultdict(list)  
+    json_products = []
 
-    for cutout in candidate.data_products.filter(data_product_type__in=['ref', 'new', 'diff']):
-        cutout_time = cutout.created_at.strftime("%Y-%m-%d %H:%M")  # Extract minute
-        grouped_cutouts[cutout_time].append(cutout)  
+    for data_product in candidate.data_products.filter(data_product_type__in=['ref', 'new', 'diff', 'json']):
+        if data_product.data_product_type == 'json':
+            json_products.append(data_product)
+            continue
+        cutout_time = data_product.created_at.strftime("%Y-%m-%d %H:%M")  # Extract minute
+        grouped_cutouts[cutout_time].append(data_product)  
 
     context = {
         **request_params,
         'candidate': candidate,
-        'photometry_graph': generate_photometry_graph(candidate),
         'ps1_cutout': ps1_cutout,
         'sdss_cutout': sdss_cutout,
+        'json_products': json_products,
+        'alerts': candidate.alert.all(),
         'grouped_cutouts': dict(sorted(grouped_cutouts.items(), reverse=True)),  # Sort by newest first
         'coords': coords,
+        'light_curve': get_light_curve(candidate),
     }
     return render(request, 'candidates/candidate_detail.html', context)
 